@@ -0,0 +1,367 @@
+"""
+Benchmark of the per-RPC cost added by the interceptors.
+
+Every configuration serves the hello_world Greeter over loopback and is
+measured for the four RPC types, both sequentially (per-RPC latency) and with
+several concurrent callers (throughput). The report is written as JSON so
+that runs can be compared, e.g. before a release:
+
+    python -m benchmarks.interceptor_overhead --output bench.json
+    python -m benchmarks.interceptor_overhead --compare bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import platform
+import statistics
+import sys
+import time
+from concurrent import futures
+from typing import Any, Callable, Dict, List, Optional
+
+import grpc
+import prometheus_client
+from prometheus_client.registry import CollectorRegistry
+
+from py_grpc_prometheus import grpc_utils
+from py_grpc_prometheus import prometheus_server_interceptor
+from py_grpc_prometheus.aggregator import BackgroundAggregator
+from py_grpc_prometheus.prometheus_aio_client_interceptor import (
+    PromAioClientInterceptor,
+)
+from py_grpc_prometheus.prometheus_aio_server_interceptor import (
+    PromAioServerInterceptor,
+)
+from py_grpc_prometheus.prometheus_client_interceptor import PromClientInterceptor
+from py_grpc_prometheus.server import interceptor as server_interceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_aio_server import AioGreeter
+from tests.integration.hello_world.hello_world_server import Greeter
+
+RPC_TYPES = (
+    grpc_utils.UNARY,
+    grpc_utils.SERVER_STREAMING,
+    grpc_utils.CLIENT_STREAMING,
+    grpc_utils.BIDI_STREAMING,
+)
+
+# name -> (stack, server interceptor factory, client interceptor factory)
+CONFIGURATIONS: Dict[str, Any] = {
+    "sync-none": ("sync", None, None),
+    "sync-server": (
+        "sync",
+        lambda registry: server_interceptor.PromServerInterceptor(registry=registry),
+        None,
+    ),
+    "sync-server-sharded": (
+        "sync",
+        lambda registry: server_interceptor.PromServerInterceptor(
+            registry=registry, sharded_metrics=True
+        ),
+        None,
+    ),
+    "sync-server-aggregated": (
+        "sync",
+        lambda registry: server_interceptor.PromServerInterceptor(
+            registry=registry, aggregator=BackgroundAggregator()
+        ),
+        None,
+    ),
+    "sync-legacy-server": (
+        "sync",
+        lambda registry: prometheus_server_interceptor.PromServerInterceptor(
+            enable_handling_time_histogram=True, registry=registry
+        ),
+        None,
+    ),
+    "sync-client": (
+        "sync",
+        None,
+        lambda registry: PromClientInterceptor(
+            enable_client_handling_time_histogram=True, registry=registry
+        ),
+    ),
+    "aio-none": ("aio", None, None),
+    "aio-server": (
+        "aio",
+        lambda registry: PromAioServerInterceptor(
+            enable_handling_time_histogram=True, registry=registry
+        ),
+        None,
+    ),
+    "aio-client": (
+        "aio",
+        None,
+        lambda registry: PromAioClientInterceptor(
+            enable_client_handling_time_histogram=True, registry=registry
+        ),
+    ),
+}
+
+
+def _summarize(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "mean_us": statistics.mean(latencies) * 1e6,
+        "p50_us": _quantile(latencies, 0.50) * 1e6,
+        "p90_us": _quantile(latencies, 0.90) * 1e6,
+        "p99_us": _quantile(latencies, 0.99) * 1e6,
+    }
+
+
+def _quantile(sorted_latencies: List[float], q: float) -> float:
+    # statistics.quantiles() needs Python 3.8, take the nearest rank instead.
+    index = max(math.ceil(q * len(sorted_latencies)) - 1, 0)
+    return sorted_latencies[index]
+
+
+def _requests(messages: int):
+    return {
+        grpc_utils.UNARY: hello_world_pb2.HelloRequest(name="bench"),
+        grpc_utils.SERVER_STREAMING: hello_world_pb2.MultipleHelloResRequest(
+            name="bench", res=messages
+        ),
+        grpc_utils.CLIENT_STREAMING: [hello_world_pb2.HelloRequest(name="bench")]
+        * messages,
+        grpc_utils.BIDI_STREAMING: [
+            hello_world_pb2.MultipleHelloResRequest(name="bench", res=1)
+        ]
+        * messages,
+    }
+
+
+def _sync_call(stub, rpc_type: str, request) -> Callable[[], Any]:
+    if rpc_type == grpc_utils.UNARY:
+        return lambda: stub.SayHello(request)
+    if rpc_type == grpc_utils.SERVER_STREAMING:
+        return lambda: list(stub.SayHelloUnaryStream(request))
+    if rpc_type == grpc_utils.CLIENT_STREAMING:
+        return lambda: stub.SayHelloStreamUnary(iter(request))
+    return lambda: list(stub.SayHelloBidiStream(iter(request)))
+
+
+def _aio_call(stub, rpc_type: str, request) -> Callable[[], Any]:
+    async def _iterate(requests):
+        for item in requests:
+            yield item
+
+    if rpc_type == grpc_utils.UNARY:
+        return lambda: stub.SayHello(request)
+    if rpc_type == grpc_utils.SERVER_STREAMING:
+
+        async def _server_streaming():
+            return [response async for response in stub.SayHelloUnaryStream(request)]
+
+        return _server_streaming
+    if rpc_type == grpc_utils.CLIENT_STREAMING:
+        return lambda: stub.SayHelloStreamUnary(_iterate(request))
+
+    async def _bidi_streaming():
+        return [
+            response async for response in stub.SayHelloBidiStream(_iterate(request))
+        ]
+
+    return _bidi_streaming
+
+
+def _run_sync(server_factory, client_factory, args) -> Dict[str, Any]:
+    registry = CollectorRegistry()
+    interceptors = (server_factory(registry),) if server_factory else ()
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=args.concurrency * 2),
+        interceptors=interceptors,
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    channel = grpc.insecure_channel("localhost:%d" % port)
+    if client_factory:
+        channel = grpc.intercept_channel(channel, client_factory(registry))
+    stub = hello_world_grpc.GreeterStub(channel)
+    results = {}
+    try:
+        for rpc_type, request in _requests(args.messages).items():
+            call = _sync_call(stub, rpc_type, request)
+            for _ in range(args.warmup):
+                call()
+
+            latencies = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                call()
+                latencies.append(time.perf_counter() - start)
+
+            def _worker(count):
+                for _ in range(count):
+                    call()
+
+            per_worker = max(args.iterations // args.concurrency, 1)
+            with futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                start = time.perf_counter()
+                list(pool.map(_worker, [per_worker] * args.concurrency))
+                elapsed = time.perf_counter() - start
+
+            results[rpc_type] = dict(
+                _summarize(latencies),
+                throughput_rps=per_worker * args.concurrency / elapsed,
+            )
+    finally:
+        channel.close()
+        server.stop(0)
+    return results
+
+
+async def _run_aio(server_factory, client_factory, args) -> Dict[str, Any]:
+    registry = CollectorRegistry()
+    interceptors = (server_factory(registry),) if server_factory else ()
+    server = grpc.aio.server(interceptors=interceptors)
+    hello_world_grpc.add_GreeterServicer_to_server(AioGreeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    await server.start()
+    channel = grpc.aio.insecure_channel(
+        "localhost:%d" % port,
+        interceptors=(client_factory(registry),) if client_factory else None,
+    )
+    stub = hello_world_grpc.GreeterStub(channel)
+    results = {}
+    try:
+        for rpc_type, request in _requests(args.messages).items():
+            call = _aio_call(stub, rpc_type, request)
+            for _ in range(args.warmup):
+                await call()
+
+            latencies = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                await call()
+                latencies.append(time.perf_counter() - start)
+
+            async def _worker(count):
+                for _ in range(count):
+                    await call()
+
+            per_worker = max(args.iterations // args.concurrency, 1)
+            start = time.perf_counter()
+            await asyncio.gather(*[_worker(per_worker)] * args.concurrency)
+            elapsed = time.perf_counter() - start
+
+            results[rpc_type] = dict(
+                _summarize(latencies),
+                throughput_rps=per_worker * args.concurrency / elapsed,
+            )
+    finally:
+        await channel.close()
+        await server.stop(0)
+    return results
+
+
+def run(args) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        "environment": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "grpcio": grpc.__version__,
+            "prometheus_client": getattr(prometheus_client, "__version__", None),
+        },
+        "parameters": {
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "messages": args.messages,
+            "concurrency": args.concurrency,
+        },
+        "results": {},
+    }
+    for name in args.configurations:
+        stack, server_factory, client_factory = CONFIGURATIONS[name]
+        try:
+            if stack == "sync":
+                results = _run_sync(server_factory, client_factory, args)
+            else:
+                results = asyncio.run(_run_aio(server_factory, client_factory, args))
+        except Exception as err:  # pylint: disable=broad-except
+            # A broken configuration is reported rather than aborting the run.
+            results = {"error": repr(err)}
+        report["results"][name] = results
+
+    # The added latency is relative to the configuration without interceptor
+    # on the same stack.
+    for name, results in report["results"].items():
+        baseline = report["results"].get("%s-none" % CONFIGURATIONS[name][0], {})
+        for rpc_type, result in results.items():
+            if rpc_type in baseline and isinstance(result, dict):
+                result["overhead_p50_us"] = (
+                    result["p50_us"] - baseline[rpc_type]["p50_us"]
+                )
+    return report
+
+
+def compare(report, baseline, max_regression: float) -> List[str]:
+    """Returns the results whose p50 latency regressed more than max_regression."""
+    regressions = []
+    for name, results in report["results"].items():
+        for rpc_type, result in results.items():
+            previous = baseline["results"].get(name, {}).get(rpc_type)
+            if not isinstance(result, dict) or not isinstance(previous, dict):
+                continue
+            ratio = result["p50_us"] / previous["p50_us"]
+            if ratio > 1 + max_regression:
+                regressions.append(
+                    "%s %s: p50 %.1fus -> %.1fus (%+.0f%%)"
+                    % (
+                        name,
+                        rpc_type,
+                        previous["p50_us"],
+                        result["p50_us"],
+                        (ratio - 1) * 100,
+                    )
+                )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument(
+        "--messages", type=int, default=10, help="Messages per streaming RPC."
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--configurations",
+        nargs="+",
+        choices=sorted(CONFIGURATIONS),
+        default=list(CONFIGURATIONS),
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    parser.add_argument(
+        "--compare", help="Fail if p50 latencies regressed against this report."
+    )
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    # Log records are still created, but not written out to stderr.
+    logging.getLogger().addHandler(logging.NullHandler())
+
+    report = run(args)
+    rendered = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(rendered)
+    else:
+        print(rendered)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.max_regression)
+        for regression in regressions:
+            print("REGRESSION", regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Benchmark of the scrape cost of merging the metrics of many processes.
+
+Worker processes record one RPC for each of --methods methods in
+prometheus_client's multiprocess mode, then the files they leave behind are
+scraped with prometheus_client's MultiProcessCollector and with
+py_grpc_prometheus.multiprocess, before and after the restarted (dead)
+workers are folded into the archive:
+
+    python -m benchmarks.multiprocess_merge --methods 10 100 1000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from prometheus_client import generate_latest, multiprocess as prometheus_multiprocess
+from prometheus_client.registry import CollectorRegistry
+
+from py_grpc_prometheus import multiprocess
+
+WORKER = """
+import os
+import sys
+
+import grpc
+
+from py_grpc_prometheus.server.metrics import Metrics
+
+metrics = Metrics(None)
+for i in range(int(sys.argv[1])):
+    method_metrics = metrics.method_metrics("bench.Service", "Method%d" % i, False, False)
+    method_metrics.record_started_rpc()
+    method_metrics.record_completed_rpc(grpc.StatusCode.OK)
+    method_metrics.record_request_latency(0.01)
+print(os.getpid())
+"""
+
+
+def _run_workers(path: str, workers: int, methods: int) -> List[int]:
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=path)
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", WORKER, str(methods)],
+            env=env,
+            stdout=subprocess.PIPE,
+        )
+        for _ in range(workers)
+    ]
+    return [int(process.communicate()[0]) for process in processes]
+
+
+def _scrape_ms(registry: CollectorRegistry, scrapes: int) -> float:
+    generate_latest(registry)  # Warms up the caches.
+    start = time.perf_counter()
+    for _ in range(scrapes):
+        generate_latest(registry)
+    return (time.perf_counter() - start) / scrapes * 1000
+
+
+def _count_files(path: str) -> int:
+    return len([name for name in os.listdir(path) if name.endswith(".db")])
+
+
+def run(methods: int, args) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as path:
+        _run_workers(path, args.workers, methods)
+        dead_pids = _run_workers(path, args.dead_workers, methods)
+
+        reference = CollectorRegistry()
+        prometheus_multiprocess.MultiProcessCollector(reference, path)
+        registry = multiprocess.make_registry(path)
+        result = {
+            "files": _count_files(path),
+            "prometheus_client_ms": _scrape_ms(reference, args.scrapes),
+            "py_grpc_prometheus_ms": _scrape_ms(registry, args.scrapes),
+        }
+
+        start = time.perf_counter()
+        for pid in dead_pids:
+            multiprocess.mark_process_dead(pid, path)
+        result["mark_process_dead_ms"] = (
+            (time.perf_counter() - start) / max(len(dead_pids), 1) * 1000
+        )
+        result["archived_files"] = _count_files(path)
+        result["archived_py_grpc_prometheus_ms"] = _scrape_ms(registry, args.scrapes)
+        return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--methods", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--workers", type=int, default=8, help="Live workers.")
+    parser.add_argument(
+        "--dead-workers", type=int, default=16, help="Restarted workers."
+    )
+    parser.add_argument("--scrapes", type=int, default=20)
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    args = parser.parse_args(argv)
+
+    report = {
+        "workers": args.workers,
+        "dead_workers": args.dead_workers,
+        "results": {str(methods): run(methods, args) for methods in args.methods},
+    }
+    rendered = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(rendered)
+    else:
+        print(rendered)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
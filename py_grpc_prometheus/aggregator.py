@@ -0,0 +1,300 @@
+"""
+Recording RPCs from a background thread.
+
+With a BackgroundAggregator, the interceptors do not update any
+prometheus_client object while handling an RPC. Each record is appended to a
+bounded queue as a compact (record method, value) event and a
+daemon thread applies the events to the registry every flush_interval
+seconds, so the metrics lag behind by up to that interval.
+"""
+
+import collections
+import functools
+import threading
+from typing import AsyncIterator, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+import grpc
+from prometheus_client import Counter
+from prometheus_client.registry import CollectorRegistry
+
+from py_grpc_prometheus import grpc_utils
+from py_grpc_prometheus.recorder import MethodMetrics, Recorder
+from py_grpc_prometheus.shared_metrics import registry_metric
+
+# What to do with an event when the queue is full.
+DROP = "drop"
+RECORD_INLINE = "record_inline"
+
+Event = Tuple[Callable, object]
+
+
+class BackgroundAggregator:
+    """
+    Applies the events recorded by the interceptors from a daemon thread.
+
+    max_queue_size bounds the events waiting to be applied. When the queue
+    is full, the DROP overflow policy discards the event and counts it in
+    grpc_metrics_dropped_events_total, in the registry of the interceptor
+    that recorded it, while RECORD_INLINE applies it on the RPC thread
+    instead, trading the RPC latency for exact metrics. One aggregator can be
+    shared by several interceptors.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = 100000,
+        flush_interval: float = 0.1,
+        overflow: str = DROP,
+    ) -> None:
+        if overflow not in (DROP, RECORD_INLINE):
+            raise ValueError("overflow must be DROP or RECORD_INLINE")
+        self._events: Deque[Event] = collections.deque()
+        self._max_queue_size = max_queue_size
+        self._flush_interval = flush_interval
+        self._overflow = overflow
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="grpc-metrics-aggregator", daemon=True
+        )
+        self._thread.start()
+
+    def wrap(self, recorder: Recorder) -> "QueuedRecorder":
+        """Returns a recorder whose records are applied by this aggregator."""
+        dropped_events = registry_metric(
+            recorder.registry,
+            "grpc_metrics_dropped_events_total",
+            _dropped_events_counter,
+        )
+        return QueuedRecorder(
+            recorder, functools.partial(self.put, dropped_events=dropped_events)
+        )
+
+    def put(
+        self,
+        apply: Callable,
+        value: object = None,
+        dropped_events: Optional[Counter] = None,
+    ) -> None:
+        # deque.append and len are atomic, the bound is only approximate when
+        # several threads race for the last slots.
+        if len(self._events) < self._max_queue_size:
+            self._events.append((apply, value))
+        elif self._overflow == RECORD_INLINE:
+            _apply(apply, value)
+        elif dropped_events is not None:
+            dropped_events.inc()
+
+    def flush(self) -> None:
+        """Applies the queued events now, e.g. before a final scrape."""
+        events = self._events
+        with self._flush_lock:
+            while events:
+                apply, value = events.popleft()
+                _apply(apply, value)
+
+    def close(self) -> None:
+        """Stops the background thread after applying the queued events."""
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._flush_interval):
+            self.flush()
+
+
+def _dropped_events_counter(registry: Optional[CollectorRegistry]) -> Counter:
+    return Counter(
+        "grpc_metrics_dropped_events_total",
+        "Total number of RPC metric events dropped because the background "
+        "aggregation queue was full.",
+        registry=registry,
+    )
+
+
+def _apply(apply: Callable, value: object) -> None:
+    if value is None:
+        apply()
+    else:
+        apply(value)
+
+
+class QueuedRecorder:
+    """A Recorder whose MethodMetrics queue their records on an aggregator."""
+
+    def __init__(self, recorder: Recorder, put: Callable) -> None:
+        self._recorder = recorder
+        self._put = put
+        self._method_metrics: Dict[Tuple[str, str, str], QueuedMethodMetrics] = {}
+
+    def method_metrics(
+        self, grpc_type: str, grpc_service: str, grpc_method: str
+    ) -> "QueuedMethodMetrics":
+        key = (grpc_type, grpc_service, grpc_method)
+        method_metrics = self._method_metrics.get(key)
+        if method_metrics is None:
+            recorded = self._recorder.method_metrics(*key)
+            # Methods over the cardinality limit are recorded under other
+            # labels, and only those are cached.
+            key = (recorded.grpc_type, recorded.grpc_service, recorded.grpc_method)
+            method_metrics = self._method_metrics.get(key)
+            if method_metrics is None:
+                method_metrics = self._method_metrics.setdefault(
+                    key,
+                    QueuedMethodMetrics(
+                        recorded,
+                        self._put,
+                        self._recorder.stream_flush_policy,
+                    ),
+                )
+        return method_metrics
+
+
+class _QueuedCount:
+    """Stands in for a counter child, queueing the increments."""
+
+    __slots__ = ("_put", "_apply")
+
+    def __init__(self, put: Callable, apply: Callable) -> None:
+        self._put = put
+        self._apply = apply
+
+    def inc(self, amount: int = 1) -> None:
+        self._put(self._apply, amount)
+
+
+class QueuedMethodMetrics:
+    """The MethodMetrics interface, queueing every record as an event."""
+
+    __slots__ = (
+        "grpc_type",
+        "grpc_service",
+        "grpc_method",
+        "_put",
+        "_stream_flush_policy",
+        "_started_rpc",
+        "_completed_rpc",
+        "_request_latency",
+        "_request_latency_ns",
+        "_stream_recv_latency_ns",
+        "_stream_send_latency_ns",
+        "_stream_msg_received",
+        "_stream_msg_sent",
+        "_rpc_in_flight",
+        "_rpc_done",
+        "_msg_received_bytes",
+        "_msg_sent_bytes",
+        "_deserialize_latency_ns",
+        "_serialize_latency_ns",
+    )
+
+    def __init__(
+        self,
+        method_metrics: MethodMetrics,
+        put: Callable,
+        stream_flush_policy: grpc_utils.FlushPolicy,
+    ) -> None:
+        self.grpc_type = method_metrics.grpc_type
+        self.grpc_service = method_metrics.grpc_service
+        self.grpc_method = method_metrics.grpc_method
+        self._put = put
+        self._stream_flush_policy = stream_flush_policy
+        # The events carry the bound methods applying them, resolved once here.
+        self._started_rpc = method_metrics.record_started_rpc
+        self._completed_rpc = method_metrics.record_completed_rpc
+        self._request_latency = method_metrics.record_request_latency
+        self._request_latency_ns = method_metrics.record_request_latency_ns
+        self._stream_recv_latency_ns = method_metrics.record_stream_recv_latency_ns
+        self._stream_send_latency_ns = method_metrics.record_stream_send_latency_ns
+        self._stream_msg_received = _QueuedCount(
+            put, method_metrics.record_stream_msgs_received
+        )
+        self._stream_msg_sent = _QueuedCount(
+            put, method_metrics.record_stream_msgs_sent
+        )
+        self._rpc_in_flight = method_metrics.record_rpc_in_flight
+        self._rpc_done = method_metrics.record_rpc_done
+        self._msg_received_bytes = method_metrics.record_msg_received_bytes
+        self._msg_sent_bytes = method_metrics.record_msg_sent_bytes
+        self._deserialize_latency_ns = method_metrics.record_deserialize_latency_ns
+        self._serialize_latency_ns = method_metrics.record_serialize_latency_ns
+
+    def record_started_rpc(self) -> None:
+        self._put(self._started_rpc)
+
+    def record_completed_rpc(self, grpc_code: grpc.StatusCode) -> None:
+        self._put(self._completed_rpc, grpc_code)
+
+    def record_request_latency(
+        self, latency: float, exemplar: Optional[Dict[str, str]] = None
+    ) -> None:
+        if exemplar is None:
+            self._put(self._request_latency, latency)
+        else:
+            self._put(
+                functools.partial(self._request_latency, exemplar=exemplar), latency
+            )
+
+    def record_request_latency_ns(
+        self, latency_ns: int, exemplar: Optional[Dict[str, str]] = None
+    ) -> None:
+        if exemplar is None:
+            self._put(self._request_latency_ns, latency_ns)
+        else:
+            self._put(
+                functools.partial(self._request_latency_ns, exemplar=exemplar),
+                latency_ns,
+            )
+
+    def record_stream_recv_latency_ns(self, latency_ns: int) -> None:
+        self._put(self._stream_recv_latency_ns, latency_ns)
+
+    def record_stream_send_latency_ns(self, latency_ns: int) -> None:
+        self._put(self._stream_send_latency_ns, latency_ns)
+
+    def record_rpc_in_flight(self) -> None:
+        self._put(self._rpc_in_flight)
+
+    def record_rpc_done(self) -> None:
+        self._put(self._rpc_done)
+
+    def record_msg_received_bytes(self, size: int) -> None:
+        self._put(self._msg_received_bytes, size)
+
+    def record_msg_sent_bytes(self, size: int) -> None:
+        self._put(self._msg_sent_bytes, size)
+
+    def record_deserialize_latency_ns(self, latency_ns: int) -> None:
+        self._put(self._deserialize_latency_ns, latency_ns)
+
+    def record_serialize_latency_ns(self, latency_ns: int) -> None:
+        self._put(self._serialize_latency_ns, latency_ns)
+
+    def record_stream_msg_received(
+        self, req_iterator: Iterator["grpc.TRequest"]
+    ) -> Iterator["grpc.TRequest"]:
+        return grpc_utils.count_iterator(
+            req_iterator, self._stream_msg_received, self._stream_flush_policy
+        )
+
+    def record_stream_msg_sent(
+        self, resp_iterator: Iterator["grpc.TResponse"]
+    ) -> Iterator["grpc.TResponse"]:
+        return grpc_utils.count_iterator(
+            resp_iterator, self._stream_msg_sent, self._stream_flush_policy
+        )
+
+    def record_stream_msg_received_async(
+        self, req_iterator: AsyncIterator["grpc.TRequest"]
+    ) -> AsyncIterator["grpc.TRequest"]:
+        return grpc_utils.count_async_iterator(
+            req_iterator, self._stream_msg_received, self._stream_flush_policy
+        )
+
+    def record_stream_msg_sent_async(
+        self, resp_iterator: AsyncIterator["grpc.TResponse"]
+    ) -> AsyncIterator["grpc.TResponse"]:
+        return grpc_utils.count_async_iterator(
+            resp_iterator, self._stream_msg_sent, self._stream_flush_policy
+        )
@@ -0,0 +1,123 @@
+"""Histogram bucket layouts and per-method bucket overrides."""
+
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from prometheus_client import Histogram
+from prometheus_client.metrics_core import Metric
+from prometheus_client.registry import CollectorRegistry
+
+DEFAULT_BUCKETS = Histogram.DEFAULT_BUCKETS
+
+
+def exponential_buckets(start: float, factor: float, count: int) -> List[float]:
+    """
+    Returns count buckets, the first one being start and each following one
+    factor times the previous one.
+    """
+    if start <= 0:
+        raise ValueError("start must be positive")
+    if factor <= 1:
+        raise ValueError("factor must be greater than 1")
+    if count < 1:
+        raise ValueError("count must be at least 1")
+    return [start * factor**i for i in range(count)]
+
+
+def linear_buckets(start: float, width: float, count: int) -> List[float]:
+    """Returns count buckets, width apart, the first one being start."""
+    if width <= 0:
+        raise ValueError("width must be positive")
+    if count < 1:
+        raise ValueError("count must be at least 1")
+    return [start + width * i for i in range(count)]
+
+
+# Message sizes in bytes, from 64B to 16MiB, the default maximum message size
+# being 4MiB.
+PAYLOAD_SIZE_BUCKETS = exponential_buckets(64, 4, 10)
+
+# (De)serialization times in seconds, from 10µs to about 2.6s.
+SERIALIZATION_BUCKETS = exponential_buckets(0.00001, 4, 10)
+
+
+class MethodHistogram:
+    """
+    A histogram whose bucket layout can be overridden per method.
+
+    prometheus_client histograms share one layout between all their children,
+    so every distinct layout is kept in its own unregistered histogram and
+    this collector exposes them together as a single metric family. The
+    overrides are keyed by method path, e.g. ``/package.Service/Method``, and
+    ``labels()`` routes each method to the histogram holding its layout.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        registry: Optional[CollectorRegistry],
+        buckets: Sequence[float],
+        per_method_buckets: Dict[str, Sequence[float]],
+    ) -> None:
+        self._labelnames = tuple(labelnames)
+        self._default = Histogram(
+            name, documentation, labelnames, registry=None, buckets=buckets
+        )
+        layouts: Dict[tuple, Histogram] = {}
+        self._per_method: Dict[str, Histogram] = {}
+        for method, method_buckets in per_method_buckets.items():
+            layout = tuple(method_buckets)
+            if layout not in layouts:
+                layouts[layout] = Histogram(
+                    name, documentation, labelnames, registry=None, buckets=layout
+                )
+            self._per_method[method] = layouts[layout]
+        self._histograms = [self._default] + list(layouts.values())
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *labelvalues: str, **labelkwargs: str) -> Histogram:
+        if labelvalues:
+            labelkwargs = dict(zip(self._labelnames, labelvalues))
+        histogram = self._per_method.get(
+            "/%s/%s" % (labelkwargs["grpc_service"], labelkwargs["grpc_method"]),
+            self._default,
+        )
+        return histogram.labels(**labelkwargs)
+
+    def describe(self) -> Iterable[Metric]:
+        return self._default.describe()
+
+    def collect(self) -> Iterable[Metric]:
+        family = None
+        for histogram in self._histograms:
+            for metric in histogram.collect():
+                if family is None:
+                    family = metric
+                else:
+                    family.samples.extend(metric.samples)
+        return [family] if family is not None else []
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str],
+    registry: Optional[CollectorRegistry],
+    buckets: Optional[Sequence[float]] = None,
+    per_method_buckets: Optional[Dict[str, Sequence[float]]] = None,
+):
+    """
+    Creates a latency histogram with the given layout, only paying for the
+    per-method routing when overrides are configured.
+    """
+    if buckets is None:
+        buckets = DEFAULT_BUCKETS
+    if per_method_buckets:
+        return MethodHistogram(
+            name, documentation, labelnames, registry, buckets, per_method_buckets
+        )
+    return Histogram(
+        name, documentation, labelnames, registry=registry, buckets=buckets
+    )
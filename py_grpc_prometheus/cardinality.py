@@ -0,0 +1,92 @@
+"""Bounding the number of methods the interceptors export series for."""
+
+import threading
+from typing import Iterable, List, Optional, Set, Tuple
+
+from prometheus_client import Counter
+from prometheus_client.registry import CollectorRegistry
+
+from py_grpc_prometheus.shared_metrics import registry_metric
+
+# The grpc_service and grpc_method label values of the methods over the limit.
+OTHER = "__other__"
+
+
+def service_methods(*service_descriptors) -> List[str]:
+    """
+    Returns the method paths of protobuf service descriptors.
+
+    e.g. service_methods(hello_world_pb2.DESCRIPTOR.services_by_name["Greeter"])
+    returns ["/Greeter/SayHello", ...], to be passed as known_methods.
+    """
+    return [
+        "/%s/%s" % (service.full_name, method.name)
+        for service in service_descriptors
+        for method in service.methods
+    ]
+
+
+class CardinalityGuard:
+    """
+    Bounds the methods the interceptors label their metrics with.
+
+    The grpc_service and grpc_method labels come from the method path sent by
+    the client, or asked for by the application on the client side, so a
+    buggy or hostile peer can create any number of series. The methods in
+    known_methods, full method paths such as ``/package.Service/Method``, are
+    always recorded under their own labels, and so are the first max_methods
+    other methods seen. Any further method is recorded as ``__other__`` and
+    its RPCs are counted in grpc_metrics_overflowed_rpcs_total, keeping both
+    the memory of the interceptors and the scrape size bounded.
+
+    A guard can be shared by several interceptors, which then share the limit
+    and count the overflowed RPCs in the registry of each interceptor.
+    """
+
+    def __init__(
+        self,
+        max_methods: int = 1000,
+        known_methods: Iterable[str] = (),
+    ) -> None:
+        self._max_methods = max_methods
+        self._methods: Set[Tuple[str, str]] = set()
+        for method_path in known_methods:
+            _, grpc_service, grpc_method = method_path.split("/")
+            self._methods.add((grpc_service, grpc_method))
+        self._admitted = 0
+        self._lock = threading.Lock()
+
+    def admit(self, grpc_service: str, grpc_method: str) -> bool:
+        """Returns whether the method is recorded under its own labels."""
+        key = (grpc_service, grpc_method)
+        if key in self._methods:
+            return True
+        if self._admitted >= self._max_methods:
+            return False
+        with self._lock:
+            if key in self._methods:
+                return True
+            if self._admitted >= self._max_methods:
+                return False
+            self._admitted += 1
+            self._methods.add(key)
+            return True
+
+    def overflowed_rpcs(self, grpc_type: str, registry: Optional[CollectorRegistry]):
+        """
+        Returns the counter child of the RPCs of the given type over the limit,
+        in the given registry.
+        """
+        return registry_metric(
+            registry, "grpc_metrics_overflowed_rpcs_total", _overflowed_rpcs_counter
+        ).labels(grpc_type)
+
+
+def _overflowed_rpcs_counter(registry: Optional[CollectorRegistry]) -> Counter:
+    return Counter(
+        "grpc_metrics_overflowed_rpcs_total",
+        "Total number of RPCs started for methods over the cardinality limit, "
+        "recorded with the __other__ service and method labels.",
+        ["grpc_type"],
+        registry=registry,
+    )
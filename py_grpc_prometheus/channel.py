@@ -0,0 +1,186 @@
+"""
+Instrumenting the serializers of client stubs.
+
+The client interceptors see the request and response messages but never
+their bytes: the channel serializes the requests after the interceptors and
+deserializes the responses before them, with the serializers the generated
+stubs pass when creating their multi-callables. InstrumentedChannel wraps a
+channel, synchronous or grpc.aio, so that the stubs created on it get
+serializers recording into the metrics of a client interceptor.
+"""
+
+from typing import Any, Callable, Optional, Tuple
+
+from py_grpc_prometheus import grpc_utils
+from py_grpc_prometheus.clock import DEFAULT_CLOCK, Clock
+from py_grpc_prometheus.method_filter import MethodFilter
+
+Serializer = Optional[Callable[[Any], bytes]]
+Deserializer = Optional[Callable[[bytes], Any]]
+
+
+class InstrumentedChannel:
+    """
+    Delegates to channel, wrapping the serializers of its multi-callables.
+
+    The requests serialized are recorded as messages sent and the responses
+    deserialized as messages received, into the MethodMetrics recorder gives
+    for the method: their size with payload_size and the time taken to
+    (de)serialize them with serialization_time. Methods rejected by
+    method_filter are not instrumented.
+    Use it through the instrument_channel() method of the client interceptors.
+    """
+
+    def __init__(
+        self,
+        channel: Any,
+        recorder: Any,
+        method_filter: Optional[MethodFilter] = None,
+        payload_size: bool = True,
+        serialization_time: bool = False,
+        clock: Clock = DEFAULT_CLOCK,
+    ) -> None:
+        self._channel = channel
+        self._recorder = recorder
+        self._method_filter = method_filter
+        self._payload_size = payload_size
+        self._serialization_time = serialization_time
+        self._clock = clock
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._channel, name)
+
+    def __enter__(self) -> "InstrumentedChannel":
+        self._channel.__enter__()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> Any:
+        return self._channel.__exit__(*exc_info)
+
+    async def __aenter__(self) -> "InstrumentedChannel":
+        await self._channel.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> Any:
+        return await self._channel.__aexit__(*exc_info)
+
+    def unary_unary(
+        self,
+        method: str,
+        request_serializer: Serializer = None,
+        response_deserializer: Deserializer = None,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        return self._channel.unary_unary(
+            method,
+            *self._serializers(
+                grpc_utils.UNARY, method, request_serializer, response_deserializer
+            ),
+            *args,
+            **kwargs,
+        )
+
+    def unary_stream(
+        self,
+        method: str,
+        request_serializer: Serializer = None,
+        response_deserializer: Deserializer = None,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        return self._channel.unary_stream(
+            method,
+            *self._serializers(
+                grpc_utils.SERVER_STREAMING,
+                method,
+                request_serializer,
+                response_deserializer,
+            ),
+            *args,
+            **kwargs,
+        )
+
+    def stream_unary(
+        self,
+        method: str,
+        request_serializer: Serializer = None,
+        response_deserializer: Deserializer = None,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        return self._channel.stream_unary(
+            method,
+            *self._serializers(
+                grpc_utils.CLIENT_STREAMING,
+                method,
+                request_serializer,
+                response_deserializer,
+            ),
+            *args,
+            **kwargs,
+        )
+
+    def stream_stream(
+        self,
+        method: str,
+        request_serializer: Serializer = None,
+        response_deserializer: Deserializer = None,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        return self._channel.stream_stream(
+            method,
+            *self._serializers(
+                grpc_utils.BIDI_STREAMING,
+                method,
+                request_serializer,
+                response_deserializer,
+            ),
+            *args,
+            **kwargs,
+        )
+
+    def _serializers(
+        self,
+        grpc_type: str,
+        method: str,
+        request_serializer: Serializer,
+        response_deserializer: Deserializer,
+    ) -> Tuple[Serializer, Deserializer]:
+        if self._method_filter is not None and not self._method_filter(method):
+            return request_serializer, response_deserializer
+        # e.g. /package.ServiceName/MethodName
+        grpc_service, grpc_method = "", ""
+        parts = method.split("/")
+        if len(parts) >= 3:
+            grpc_service, grpc_method = parts[1:3]
+        method_metrics = self._recorder.method_metrics(
+            grpc_type, grpc_service, grpc_method
+        )
+        return (
+            grpc_utils.measure_serializer(
+                request_serializer,
+                method_metrics.record_msg_sent_bytes if self._payload_size else None,
+                (
+                    method_metrics.record_serialize_latency_ns
+                    if self._serialization_time
+                    else None
+                ),
+                self._clock,
+            ),
+            grpc_utils.measure_deserializer(
+                response_deserializer,
+                (
+                    method_metrics.record_msg_received_bytes
+                    if self._payload_size
+                    else None
+                ),
+                (
+                    method_metrics.record_deserialize_latency_ns
+                    if self._serialization_time
+                    else None
+                ),
+                self._clock,
+            ),
+        )
@@ -1,8 +1,17 @@
 from prometheus_client import Counter
+from prometheus_client import Gauge
 from prometheus_client import Histogram
+from prometheus_client.registry import REGISTRY
 
-def init_metrics(registry):
-  return {
+from py_grpc_prometheus import grpc_utils
+from py_grpc_prometheus.buckets import PAYLOAD_SIZE_BUCKETS
+from py_grpc_prometheus.buckets import SERIALIZATION_BUCKETS
+from py_grpc_prometheus.buckets import histogram
+from py_grpc_prometheus.recorder import Recorder
+
+def init_metrics(registry, latency_sampling=False, buckets=None, per_method_buckets=None,
+                 in_flight=False, payload_size=False, serialization_time=False):
+  metrics = {
       "grpc_client_started_counter": Counter(
           "grpc_client_started_total",
           "Total number of RPCs started on the client",
@@ -32,26 +41,32 @@ def init_metrics(registry):
           registry=registry
       ),
 
-      "grpc_client_handled_histogram": Histogram(
+      "grpc_client_handled_histogram": histogram(
           "grpc_client_handling_seconds",
           "Histogram of response latency (seconds) of the gRPC until" \
             "it is finished by the application.",
           ["grpc_type", "grpc_service", "grpc_method"],
-          registry=registry
+          registry,
+          buckets,
+          per_method_buckets
       ),
 
-      "grpc_client_stream_recv_histogram": Histogram(
+      "grpc_client_stream_recv_histogram": histogram(
           "grpc_client_msg_recv_handling_seconds",
           "Histogram of response latency (seconds) of the gRPC single message receive.",
           ["grpc_type", "grpc_service", "grpc_method"],
-          registry=registry
+          registry,
+          buckets,
+          per_method_buckets
       ),
 
-      "grpc_client_stream_send_histogram": Histogram(
+      "grpc_client_stream_send_histogram": histogram(
           "grpc_client_msg_send_handling_seconds",
           "Histogram of response latency (seconds) of the gRPC single message send.",
           ["grpc_type", "grpc_service", "grpc_method"],
-          registry=registry
+          registry,
+          buckets,
+          per_method_buckets
       ),
 
       # Legacy metrics for backwards compatibility
@@ -64,10 +79,141 @@ def init_metrics(registry):
           registry=registry
       ),
 
-      "legacy_grpc_client_completed_latency_seconds_histogram": Histogram(
+      "legacy_grpc_client_completed_latency_seconds_histogram": histogram(
           "grpc_client_completed_latency_seconds",
           "Histogram of rpc response latency (in seconds) for completed rpcs.",
           ["grpc_type", "grpc_service", "grpc_method"],
-          registry=registry
+          registry,
+          buckets,
+          per_method_buckets
       ),
-  }
\ No newline at end of file
+  }
+  if latency_sampling:
+    # With sampling only some RPCs are observed into grpc_client_handling_seconds,
+    # the exact count is grpc_client_started_total and this counter keeps the exact sum.
+    metrics["grpc_client_handled_seconds_counter"] = Counter(
+        "grpc_client_handled_seconds_total",
+        "Total response latency (seconds) of all gRPC completed on the client, "
+        "including the ones not sampled into grpc_client_handling_seconds.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=registry
+    )
+  if in_flight:
+    metrics["grpc_client_in_flight_gauge"] = Gauge(
+        "grpc_client_in_flight_rpcs",
+        "Number of RPCs started on the client and not completed yet.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=registry,
+        multiprocess_mode="livesum"
+    )
+  if payload_size:
+    metrics["grpc_client_msg_received_bytes"] = Histogram(
+        "grpc_client_msg_received_bytes",
+        "Histogram of the serialized size (bytes) of the messages received by the client.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=registry,
+        buckets=PAYLOAD_SIZE_BUCKETS
+    )
+    metrics["grpc_client_msg_sent_bytes"] = Histogram(
+        "grpc_client_msg_sent_bytes",
+        "Histogram of the serialized size (bytes) of the messages sent by the client.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=registry,
+        buckets=PAYLOAD_SIZE_BUCKETS
+    )
+  if serialization_time:
+    metrics["grpc_client_msg_deserialize_histogram"] = Histogram(
+        "grpc_client_msg_deserialize_seconds",
+        "Histogram of the time (seconds) taken to deserialize the messages received by the client.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=registry,
+        buckets=SERIALIZATION_BUCKETS
+    )
+    metrics["grpc_client_msg_serialize_histogram"] = Histogram(
+        "grpc_client_msg_serialize_seconds",
+        "Histogram of the time (seconds) taken to serialize the messages sent by the client.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=registry,
+        buckets=SERIALIZATION_BUCKETS
+    )
+  return metrics
+
+
+def init_recorder(metrics,
+                  is_legacy,
+                  enable_client_handling_time_histogram=False,
+                  enable_client_stream_receive_time_histogram=False,
+                  enable_client_stream_send_time_histogram=False,
+                  latency_sampler=None,
+                  stream_flush_policy=grpc_utils.EXACT_FLUSH_POLICY,
+                  cardinality_guard=None,
+                  registry=REGISTRY):
+  """Returns the Recorder for the metrics the client interceptors export."""
+  if is_legacy:
+    return Recorder(
+        started_counter=metrics["grpc_client_started_counter"],
+        handled_counter=metrics["legacy_grpc_client_completed_counter"],
+        latency_histogram=metrics["legacy_grpc_client_completed_latency_seconds_histogram"],
+        stream_msg_received_counter=metrics["grpc_client_stream_msg_received"],
+        stream_msg_sent_counter=metrics["grpc_client_stream_msg_sent"],
+        stream_flush_policy=stream_flush_policy,
+        cardinality_guard=cardinality_guard,
+        in_flight_gauge=metrics.get("grpc_client_in_flight_gauge"),
+        msg_received_bytes_histogram=metrics.get("grpc_client_msg_received_bytes"),
+        msg_sent_bytes_histogram=metrics.get("grpc_client_msg_sent_bytes"),
+        deserialize_latency_histogram=metrics.get("grpc_client_msg_deserialize_histogram"),
+        serialize_latency_histogram=metrics.get("grpc_client_msg_serialize_histogram"),
+        registry=registry
+    )
+  return Recorder(
+      started_counter=metrics["grpc_client_started_counter"],
+      handled_counter=metrics["grpc_client_handled_counter"],
+      latency_histogram=metrics["grpc_client_handled_histogram"]
+      if enable_client_handling_time_histogram else None,
+      stream_msg_received_counter=metrics["grpc_client_stream_msg_received"],
+      stream_msg_sent_counter=metrics["grpc_client_stream_msg_sent"],
+      stream_recv_latency_histogram=metrics["grpc_client_stream_recv_histogram"]
+      if enable_client_stream_receive_time_histogram else None,
+      stream_send_latency_histogram=metrics["grpc_client_stream_send_histogram"]
+      if enable_client_stream_send_time_histogram else None,
+      latency_sampler=latency_sampler,
+      latency_sum_counter=metrics.get("grpc_client_handled_seconds_counter"),
+      stream_flush_policy=stream_flush_policy,
+      cardinality_guard=cardinality_guard,
+      in_flight_gauge=metrics.get("grpc_client_in_flight_gauge"),
+      msg_received_bytes_histogram=metrics.get("grpc_client_msg_received_bytes"),
+      msg_sent_bytes_histogram=metrics.get("grpc_client_msg_sent_bytes"),
+      deserialize_latency_histogram=metrics.get("grpc_client_msg_deserialize_histogram"),
+      serialize_latency_histogram=metrics.get("grpc_client_msg_serialize_histogram"),
+      registry=registry
+  )
+
+
+class MethodMetricsCache(object):
+  """
+  Caches the MethodMetrics of each method path called with one RPC type.
+
+  The client interceptors look the metrics of every call up by the method path
+  of its call details, so once a method has been called, recording a call
+  needs neither parsing the path nor resolving any label. The number of cached
+  paths is bounded so that an application calling arbitrary method names
+  cannot grow the cache without limit.
+  """
+
+  def __init__(self, recorder, grpc_type, max_size=1024):
+    self._recorder = recorder
+    self._grpc_type = grpc_type
+    self._max_size = max_size
+    self._method_metrics = {}
+
+  def get(self, client_call_details):
+    """Returns the metrics of the called method."""
+    method = client_call_details.method
+    method_metrics = self._method_metrics.get(method)
+    if method_metrics is None:
+      grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_call(client_call_details)
+      method_metrics = self._recorder.method_metrics(
+          self._grpc_type, grpc_service_name, grpc_method_name)
+      if len(self._method_metrics) < self._max_size:
+        self._method_metrics[method] = method_metrics
+    return method_metrics
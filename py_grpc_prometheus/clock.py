@@ -0,0 +1,42 @@
+"""
+Clocks the interceptors time RPCs with.
+
+A clock is any callable returning an integer number of nanoseconds from an
+arbitrary but fixed origin, and never going backwards. All interceptors take
+one as their clock argument and only ever subtract two of its readings.
+"""
+
+import threading
+import time
+from typing import Callable
+
+Clock = Callable[[], int]
+
+# The highest resolution monotonic clock, used unless another one is given.
+DEFAULT_CLOCK: Clock = time.perf_counter_ns
+
+# The system-wide monotonic clock. Its resolution may be lower than
+# DEFAULT_CLOCK's, but its readings are comparable across processes.
+MONOTONIC_CLOCK: Clock = time.monotonic_ns
+
+
+class ManualClock:
+    """
+    A clock that only advances when told to.
+
+    It makes the recorded latencies deterministic in tests and benchmarks,
+    e.g. with a servicer advancing the clock by the latency it simulates.
+    """
+
+    def __init__(self, start_ns: int = 0) -> None:
+        self._now_ns = start_ns
+        self._lock = threading.Lock()
+
+    def __call__(self) -> int:
+        return self._now_ns
+
+    def advance(self, seconds: float = 0, nanoseconds: int = 0) -> None:
+        if seconds < 0 or nanoseconds < 0:
+            raise ValueError("A clock cannot go backwards")
+        with self._lock:
+            self._now_ns += int(seconds * 1e9) + nanoseconds
@@ -0,0 +1,95 @@
+"""
+Linking the slowest RPCs of the latency histograms to concrete requests.
+
+OpenMetrics exemplars attach labels, typically a trace id, to an observation
+of a histogram bucket, so that a latency spike can be followed to a trace of
+one of the RPCs that caused it. prometheus_client keeps the last exemplar of
+each bucket and only exposes them in the OpenMetrics format, which
+Prometheus negotiates when its exemplar storage is enabled.
+
+Finding the exemplar of an RPC, e.g. parsing its metadata, is only done for
+the RPCs at least min_latency slow, so the cost is paid by few of them.
+"""
+
+import logging
+import re
+from typing import Any, Callable, Dict, Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+Exemplar = Dict[str, str]
+
+# The OpenMetrics limit on the total length of the names and values of the
+# labels of an exemplar, above which prometheus_client raises ValueError.
+MAX_EXEMPLAR_LENGTH = 128
+
+_LABEL_NAME_RE = re.compile(r"^[a-zA-Z_][a-zA-Z0-9_]*$")
+
+# Called with the servicer context of the RPC on the server side, and with
+# its client call details on the client side.
+ExemplarFn = Callable[[Any], Optional[Exemplar]]
+
+
+class ExemplarSampler:
+    """
+    Picks the exemplars of the handling latency histograms.
+
+    exemplar_fn returns the exemplar labels of an RPC, or None, and is only
+    called for the RPCs that took min_latency seconds or more, e.g. the lower
+    bound of the slowest buckets of interest. As the labels usually come from
+    the clients, exemplars prometheus_client would reject, e.g. longer than
+    MAX_EXEMPLAR_LENGTH, are dropped, and so are the errors of exemplar_fn:
+    an exemplar never fails the RPC.
+    """
+
+    def __init__(self, exemplar_fn: ExemplarFn, min_latency: float = 0.0) -> None:
+        self._exemplar_fn = exemplar_fn
+        self._min_latency_ns = int(min_latency * 1e9)
+
+    def exemplar(self, latency_ns: int, source: Any) -> Optional[Exemplar]:
+        if latency_ns < self._min_latency_ns:
+            return None
+        try:
+            exemplar = self._exemplar_fn(source)
+            if exemplar is None or not _is_valid(exemplar):
+                return None
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.debug("Failed to get the exemplar of an RPC", exc_info=True)
+            return None
+        return exemplar
+
+
+def _is_valid(exemplar: Exemplar) -> bool:
+    length = 0
+    for name, value in exemplar.items():
+        if not (isinstance(value, str) and _LABEL_NAME_RE.match(name)):
+            return False
+        length += len(name) + len(value)
+    return length <= MAX_EXEMPLAR_LENGTH
+
+
+def metadata_exemplar(key: str, label: str = "trace_id") -> ExemplarFn:
+    """
+    Returns an exemplar_fn taking the exemplar from the RPC's metadata.
+
+    The value of the key metadata entry, sent by the client or by the
+    application on the client side, becomes the value of the label exemplar
+    label. RPCs without it, or whose value is too long for an exemplar, have
+    no exemplar.
+    """
+
+    def exemplar_fn(source: Any) -> Optional[Exemplar]:
+        if hasattr(source, "invocation_metadata"):
+            metadata = source.invocation_metadata()
+        else:
+            metadata = getattr(source, "metadata", None)
+        for metadata_key, value in metadata or ():
+            if metadata_key == key:
+                if isinstance(value, bytes):
+                    value = value.decode("utf-8", "replace")
+                if len(label) + len(value) > MAX_EXEMPLAR_LENGTH:
+                    return None
+                return {label: value}
+        return None
+
+    return exemplar_fn
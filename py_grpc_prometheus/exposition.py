@@ -0,0 +1,319 @@
+"""
+Serving the metrics of the interceptors.
+
+prometheus_client collects and serializes the whole registry on every
+scrape, holding each metric's lock while the RPCs keep recording. Several
+Prometheus replicas and ad-hoc tools scraping the same process multiply that
+cost, so CachedRenderer keeps the rendered, optionally gzip-compressed,
+payload for a configurable TTL and coalesces concurrent scrapes into a single
+render. It backs both make_wsgi_app(), for any WSGI server, and
+start_aio_http_server().
+
+prometheus_client.start_http_server runs a threaded WSGI server next to the
+event loop, whose threads compete with it for the GIL. MetricsServer is a
+minimal HTTP/1.1 server on asyncio streams instead, so it runs on the same
+loop as grpc.aio.server. The registry is rendered in an executor and the
+response is written without blocking, so large scrapes never stall the loop.
+"""
+
+import asyncio
+import concurrent.futures
+import gzip
+import hashlib
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from prometheus_client.exposition import choose_encoder
+from prometheus_client.registry import REGISTRY, CollectorRegistry
+
+_LOGGER = logging.getLogger(__name__)
+
+_REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+Headers = List[Tuple[str, str]]
+
+
+class Payload(NamedTuple):
+    """A rendered registry, as sent in a response."""
+
+    body: bytes
+    content_type: str
+    content_encoding: Optional[str]
+    etag: str
+    rendered_at: float
+
+
+def _gzip_accepted(accept_encoding: str) -> bool:
+    return any(
+        encoding.split(";")[0].strip().lower() == "gzip"
+        for encoding in accept_encoding.split(",")
+    )
+
+
+class CachedRenderer:
+    """
+    Renders a registry, reusing the payload for ttl seconds.
+
+    Payloads of the whole registry are cached per format and compression.
+    Scrapes of a payload being rendered wait for that render rather than
+    starting their own, whatever the ttl, so ttl=0 still coalesces concurrent
+    scrapes while never serving a payload completed before the scrape arrived.
+    The payload is gzip-compressed once per render when compress is set and
+    the client accepts it. As the format comes from the client's Accept
+    header, at most max_payloads payloads are cached and the other formats
+    are rendered on every scrape, as are the scrapes restricted with name[].
+    """
+
+    def __init__(
+        self,
+        registry: CollectorRegistry = REGISTRY,
+        ttl: float = 0.0,
+        compress: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+        max_payloads: int = 8,
+    ) -> None:
+        self._registry = registry
+        self._ttl = ttl
+        self._compress = compress
+        self._clock = clock
+        self._max_payloads = max_payloads
+        self._payloads: Dict[tuple, Payload] = {}
+        self._locks: Dict[tuple, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def render(
+        self,
+        accept_header: str = "",
+        names: Sequence[str] = (),
+        accept_encoding: str = "",
+    ) -> Payload:
+        encoder, content_type = choose_encoder(accept_header)
+        compress = self._compress and _gzip_accepted(accept_encoding)
+        if names:
+            return self._render(
+                encoder(self._registry.restricted_registry(names)),
+                content_type,
+                compress,
+            )
+
+        key = (content_type, compress)
+        requested_at = self._clock()
+        lock = self._locks.get(key)
+        if lock is None:
+            with self._locks_lock:
+                lock = self._locks.get(key)
+                if lock is None:
+                    if len(self._locks) >= self._max_payloads:
+                        return self._render(
+                            encoder(self._registry), content_type, compress
+                        )
+                    lock = self._locks[key] = threading.Lock()
+        with lock:
+            payload = self._payloads.get(key)
+            if payload is not None and (
+                payload.rendered_at >= requested_at
+                or requested_at - payload.rendered_at < self._ttl
+            ):
+                return payload
+
+            payload = self._render(encoder(self._registry), content_type, compress)
+            self._payloads[key] = payload
+            return payload
+
+    def _render(self, body: bytes, content_type: str, compress: bool) -> Payload:
+        content_encoding = None
+        if compress:
+            body = gzip.compress(body)
+            content_encoding = "gzip"
+        return Payload(
+            body,
+            content_type,
+            content_encoding,
+            '"%s"' % hashlib.md5(body).hexdigest(),
+            self._clock(),
+        )
+
+
+def _respond(
+    renderer: CachedRenderer, method: str, query: str, headers: Dict[str, str]
+) -> Tuple[int, Headers, bytes]:
+    if method not in ("GET", "HEAD"):
+        return 405, [("Content-Type", "text/plain")], b""
+    payload = renderer.render(
+        headers.get("accept", ""),
+        parse_qs(query).get("name[]", []),
+        headers.get("accept-encoding", ""),
+    )
+    response_headers = [("Content-Type", payload.content_type), ("ETag", payload.etag)]
+    if payload.content_encoding is not None:
+        response_headers.append(("Content-Encoding", payload.content_encoding))
+    if headers.get("if-none-match") == payload.etag:
+        return 304, response_headers, b""
+    response_headers.append(("Content-Length", str(len(payload.body))))
+    return 200, response_headers, b"" if method == "HEAD" else payload.body
+
+
+def make_wsgi_app(
+    registry: CollectorRegistry = REGISTRY, ttl: float = 0.0, compress: bool = True
+) -> Callable:
+    """
+    Returns a WSGI app serving the registry through a CachedRenderer.
+
+    It can replace prometheus_client.make_wsgi_app in any WSGI server.
+    """
+    renderer = CachedRenderer(registry, ttl, compress)
+
+    def app(environ: dict, start_response: Callable) -> Iterable[bytes]:
+        headers = {
+            name[5:].replace("_", "-").lower(): value
+            for name, value in environ.items()
+            if name.startswith("HTTP_")
+        }
+        status, response_headers, body = _respond(
+            renderer,
+            environ["REQUEST_METHOD"],
+            environ.get("QUERY_STRING", ""),
+            headers,
+        )
+        start_response("%d %s" % (status, _REASONS[status]), response_headers)
+        return [body]
+
+    return app
+
+
+class MetricsServer:
+    """
+    Serves the registry over HTTP on the running event loop.
+
+    Like prometheus_client.start_http_server, every path serves the metrics,
+    the Accept header selects the Prometheus or OpenMetrics text format and
+    name[] query parameters restrict the output to the given metrics. The
+    rendering, through a CachedRenderer, runs in executor, the loop's default
+    executor when None.
+    """
+
+    def __init__(
+        self,
+        registry: CollectorRegistry = REGISTRY,
+        executor: Optional[concurrent.futures.Executor] = None,
+        request_timeout: float = 10.0,
+        ttl: float = 0.0,
+        compress: bool = True,
+    ) -> None:
+        self._renderer = CachedRenderer(registry, ttl, compress)
+        self._executor = executor
+        self._request_timeout = request_timeout
+        self._server: Optional[asyncio.Server] = None
+
+    @property
+    def port(self) -> int:
+        """The port the server listens on, useful when started on port 0."""
+        if self._server is None:
+            raise RuntimeError("The metrics server is not started")
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, port: int, addr: str = "0.0.0.0") -> None:
+        self._server = await asyncio.start_server(self._handle, addr, port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            try:
+                head = await asyncio.wait_for(
+                    reader.readuntil(b"\r\n\r\n"), self._request_timeout
+                )
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                return
+            except asyncio.LimitOverrunError:
+                await self._write(writer, 400, [], b"")
+                return
+            await self._respond_to(writer, head)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond_to(self, writer: asyncio.StreamWriter, head: bytes) -> None:
+        lines = head.decode("latin-1").split("\r\n")
+        request_line = lines[0].split(" ")
+        if len(request_line) != 3:
+            await self._write(writer, 400, [], b"")
+            return
+        method, target, _ = request_line
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                _respond,
+                self._renderer,
+                method,
+                urlsplit(target).query,
+                headers,
+            )
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Failed to render the metrics")
+            await self._write(writer, 500, [], b"")
+            return
+        await self._write(writer, *response)
+
+    @staticmethod
+    async def _write(
+        writer: asyncio.StreamWriter, status: int, headers: Headers, body: bytes
+    ) -> None:
+        if not any(name == "Content-Length" for name, _ in headers):
+            headers = headers + [("Content-Length", str(len(body)))]
+        writer.write(
+            (
+                "HTTP/1.1 %d %s\r\n%sConnection: close\r\n\r\n"
+                % (
+                    status,
+                    _REASONS[status],
+                    "".join("%s: %s\r\n" % header for header in headers),
+                )
+            ).encode("latin-1")
+        )
+        writer.write(body)
+        # Waits for the transport to send the response instead of blocking
+        # until the whole body is written.
+        await writer.drain()
+
+
+async def start_aio_http_server(
+    port: int,
+    addr: str = "0.0.0.0",
+    registry: CollectorRegistry = REGISTRY,
+    executor: Optional[concurrent.futures.Executor] = None,
+    ttl: float = 0.0,
+    compress: bool = True,
+) -> MetricsServer:
+    """
+    Starts serving the registry on the running event loop.
+
+    This is the asyncio counterpart of prometheus_client.start_http_server,
+    to be awaited next to grpc.aio.server().start(). The returned server is
+    stopped with its stop() coroutine. See CachedRenderer for ttl and
+    compress.
+    """
+    server = MetricsServer(registry, executor, ttl=ttl, compress=compress)
+    await server.start(port, addr)
+    return server
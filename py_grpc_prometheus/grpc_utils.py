@@ -1,5 +1,7 @@
 import grpc
 
+from py_grpc_prometheus.clock import DEFAULT_CLOCK
+
 
 UNARY = "UNARY"
 SERVER_STREAMING = "SERVER_STREAMING"
@@ -41,7 +43,11 @@ def split_method_call(handler_call_details):
   """
 
   # e.g. /package.ServiceName/MethodName
-  parts = handler_call_details.method.split("/")
+  method = handler_call_details.method
+  if isinstance(method, bytes):
+    # grpc.aio hands the client interceptors the encoded method name.
+    method = method.decode("utf-8")
+  parts = method.split("/")
   if len(parts) < 3:
     return "", "", False
 
@@ -49,8 +55,142 @@ def split_method_call(handler_call_details):
   return grpc_service_name, grpc_method_name, True
 
 
-def wrap_rpc_behavior(handler, fn):
-  """Returns a new rpc handler that wraps the given function"""
+class FlushPolicy(object):
+  """
+  Controls how often the message count of a stream is flushed to its counter.
+
+  With the default policy every message increments the counter, so the
+  exported value is always exact. Streams with many small messages can instead
+  count locally and flush every max_messages messages and/or once max_interval
+  seconds have passed since the last flush, trading a slightly lagging counter
+  for one counter update per batch. Whatever is still pending is flushed when
+  the stream terminates, including on cancellation and errors.
+  max_interval is measured with clock, which the interceptors replace with
+  their own through with_clock().
+  """
+
+  def __init__(self, max_messages=1, max_interval=None, clock=DEFAULT_CLOCK):
+    if max_messages < 1:
+      raise ValueError("max_messages must be at least 1")
+    if max_interval is not None and max_interval <= 0:
+      raise ValueError("max_interval must be positive")
+    self.max_messages = max_messages
+    self.max_interval = max_interval
+    self.clock = clock
+
+  @property
+  def exact(self):
+    return self.max_messages == 1
+
+  def with_clock(self, clock):
+    """Returns this policy measuring max_interval with the given clock."""
+    if self.max_interval is None or clock is self.clock:
+      return self
+    return FlushPolicy(self.max_messages, self.max_interval, clock)
+
+
+EXACT_FLUSH_POLICY = FlushPolicy()
+
+
+def count_iterator(iterator, counter, flush_policy=EXACT_FLUSH_POLICY):
+  """Yields the items of iterator, counting them on the given bound counter."""
+  if flush_policy.exact:
+    for item in iterator:
+      counter.inc()
+      yield item
+    return
+
+  max_messages = flush_policy.max_messages
+  max_interval = flush_policy.max_interval
+  max_interval_ns = None if max_interval is None else int(max_interval * 1e9)
+  pending = 0
+  try:
+    if max_interval is None:
+      for item in iterator:
+        pending += 1
+        if pending >= max_messages:
+          counter.inc(pending)
+          pending = 0
+        yield item
+    else:
+      clock = flush_policy.clock
+      flush_at = clock() + max_interval_ns
+      for item in iterator:
+        pending += 1
+        if pending >= max_messages or clock() >= flush_at:
+          counter.inc(pending)
+          pending = 0
+          flush_at = clock() + max_interval_ns
+        yield item
+  finally:
+    if pending:
+      counter.inc(pending)
+
+
+async def count_async_iterator(iterator, counter, flush_policy=EXACT_FLUSH_POLICY):
+  """
+  Yields the items of an async iterator, counting them on the given bound counter.
+
+  This is the grpc.aio counterpart of count_iterator, for request iterators
+  and async generator responses.
+  """
+  if flush_policy.exact:
+    async for item in iterator:
+      counter.inc()
+      yield item
+    return
+
+  max_messages = flush_policy.max_messages
+  max_interval = flush_policy.max_interval
+  max_interval_ns = None if max_interval is None else int(max_interval * 1e9)
+  pending = 0
+  try:
+    if max_interval is None:
+      async for item in iterator:
+        pending += 1
+        if pending >= max_messages:
+          counter.inc(pending)
+          pending = 0
+        yield item
+    else:
+      clock = flush_policy.clock
+      flush_at = clock() + max_interval_ns
+      async for item in iterator:
+        pending += 1
+        if pending >= max_messages or clock() >= flush_at:
+          counter.inc(pending)
+          pending = 0
+          flush_at = clock() + max_interval_ns
+        yield item
+  finally:
+    if pending:
+      counter.inc(pending)
+
+
+def wrap_iterator_inc_counter(iterator,
+                              counter,
+                              grpc_type,
+                              grpc_service_name,
+                              grpc_method_name,
+                              flush_policy=EXACT_FLUSH_POLICY):
+  """Wraps an iterator and collect metrics."""
+  return count_iterator(
+      iterator,
+      counter.labels(
+          grpc_type=grpc_type,
+          grpc_service=grpc_service_name,
+          grpc_method=grpc_method_name),
+      flush_policy)
+
+
+def wrap_rpc_behavior(handler, fn, serializers_fn=None):
+  """
+  Returns a new rpc handler that wraps the given function.
+
+  serializers_fn, if given, is called with the request_streaming and
+  response_streaming flags, the request deserializer and the response
+  serializer of the handler, and returns the pair to use instead.
+  """
   if handler is None:
     return None
 
@@ -66,14 +206,186 @@ def wrap_rpc_behavior(handler, fn):
   else:
     behavior_fn = handler.unary_unary
     handler_factory = grpc.unary_unary_rpc_method_handler
+  request_deserializer = handler.request_deserializer
+  response_serializer = handler.response_serializer
+  if serializers_fn is not None:
+    request_deserializer, response_serializer = serializers_fn(
+        handler.request_streaming, handler.response_streaming,
+        request_deserializer, response_serializer)
   return handler_factory(
       fn(behavior_fn, handler.request_streaming, handler.response_streaming),
-      request_deserializer=handler.request_deserializer,
-      response_serializer=handler.response_serializer)
+      request_deserializer=request_deserializer,
+      response_serializer=response_serializer)
+
+
+def measure_deserializer(deserializer, record_size=None, record_latency_ns=None,
+                         clock=DEFAULT_CLOCK):
+  """
+  Returns a deserializer recording every message it deserializes.
+
+  record_size gets the size of the bytes received on the wire, so no message
+  is serialized again to measure it, and record_latency_ns the time the
+  deserializer took. A None deserializer passes the bytes through.
+  """
+  if record_size is None and (deserializer is None or record_latency_ns is None):
+    return deserializer
+
+  def deserialize(data):
+    if record_size is not None:
+      record_size(len(data))
+    if deserializer is None:
+      return data
+    if record_latency_ns is None:
+      return deserializer(data)
+    start = clock()
+    message = deserializer(data)
+    record_latency_ns(clock() - start)
+    return message
+
+  return deserialize
+
+
+def measure_serializer(serializer, record_size=None, record_latency_ns=None, clock=DEFAULT_CLOCK):
+  """Returns a serializer recording every message it serializes, see measure_deserializer."""
+  if record_size is None and (serializer is None or record_latency_ns is None):
+    return serializer
 
+  def serialize(message):
+    if serializer is None:
+      data = message
+    elif record_latency_ns is None:
+      data = serializer(message)
+    else:
+      start = clock()
+      data = serializer(message)
+      record_latency_ns(clock() - start)
+    if record_size is not None:
+      record_size(len(data))
+    return data
 
-def compute_error_code(grpc_exception):
+  return serialize
+
+
+def measure_handler_serializers(method_metrics, request_deserializer, response_serializer,
+                                payload_size=True, serialization_time=False,
+                                clock=DEFAULT_CLOCK):
+  """
+  Returns the serializers of a server handler recording the message sizes,
+  and/or the time taken to (de)serialize them, of its RPCs.
+  """
+  return (
+      measure_deserializer(
+          request_deserializer,
+          method_metrics.record_msg_received_bytes if payload_size else None,
+          method_metrics.record_deserialize_latency_ns if serialization_time else None,
+          clock),
+      measure_serializer(
+          response_serializer,
+          method_metrics.record_msg_sent_bytes if payload_size else None,
+          method_metrics.record_serialize_latency_ns if serialization_time else None,
+          clock))
+
+
+def measuring_serializers_fn(recorder, grpc_service_name, grpc_method_name,
+                             payload_size=True, serialization_time=False,
+                             clock=DEFAULT_CLOCK):
+  """Returns the serializers_fn of wrap_rpc_behavior applying measure_handler_serializers."""
+  def serializers_fn(request_streaming, response_streaming,
+                     request_deserializer, response_serializer):
+    method_metrics = recorder.method_metrics(
+        get_method_type(request_streaming, response_streaming),
+        grpc_service_name, grpc_method_name)
+    return measure_handler_serializers(
+        method_metrics, request_deserializer, response_serializer,
+        payload_size, serialization_time, clock)
+
+  return serializers_fn
+
+
+def compute_error_code(grpc_exception, servicer_context=None):
+  """
+  Returns the status code of an RPC that failed with grpc_exception.
+
+  Given the servicer context, an exception carrying no code of its own, e.g.
+  the one raised by abort(), gets the error code set on the context.
+  """
   if isinstance(grpc_exception, grpc.Call):
     return grpc_exception.code()
 
+  if servicer_context is not None:
+    code = _servicer_code(servicer_context)
+    if code is not None and code is not grpc.StatusCode.OK:
+      return code
   return grpc.StatusCode.UNKNOWN
+
+
+def compute_status_code(servicer_context):
+  """
+  Returns the status code of the RPC handled with servicer_context so far.
+
+  An RPC the client cancelled is CANCELLED and one whose code the servicer
+  did not set is OK. This goes through the public ServicerContext.code() of
+  grpcio >= 1.38, and only falls back to the context's private state before.
+  grpc.aio contexts have no is_active(), as cancelling the RPC cancels its
+  handler instead.
+  """
+  is_active = getattr(servicer_context, "is_active", None)
+  if is_active is not None and not is_active():
+    return grpc.StatusCode.CANCELLED
+
+  code = _servicer_code(servicer_context)
+  return grpc.StatusCode.OK if code is None else code
+
+
+def _servicer_code(servicer_context):
+  try:
+    return servicer_context.code()
+  except (AttributeError, NotImplementedError):
+    state = getattr(servicer_context, "_state", None)
+    return None if state is None else state.code
+
+
+def track_in_flight(method_metrics, servicer_context):
+  """
+  Counts an RPC as in flight on the server until it terminates.
+
+  The RPC is done when the servicer context runs its callbacks, which is
+  also when a stream ends or is cancelled, whether or not its response
+  iterator is ever exhausted.
+  """
+  method_metrics.record_rpc_in_flight()
+  if not servicer_context.add_callback(method_metrics.record_rpc_done):
+    # The RPC has already terminated.
+    method_metrics.record_rpc_done()
+
+
+class HandlerCache(object):
+  """
+  Caches the wrapped rpc handler of each method path.
+
+  The continuation is still invoked on every call so that the interceptors
+  further down the chain keep running, but as long as it hands back the same
+  handler object for a method, the previously wrapped handler is reused
+  instead of being rebuilt. The number of cached methods is bounded so that
+  a client sending arbitrary method names cannot grow the cache without limit.
+  """
+
+  def __init__(self, wrap_handler, max_size=1024):
+    self._wrap_handler = wrap_handler
+    self._max_size = max_size
+    self._handlers = {}
+
+  def get(self, handler, handler_call_details):
+    """Returns the wrapped version of handler, building it on first use."""
+    if handler is None:
+      return None
+
+    method = handler_call_details.method
+    cached = self._handlers.get(method)
+    if cached is not None and cached[0] is handler:
+      return cached[1]
+
+    wrapped_handler = self._wrap_handler(handler, handler_call_details)
+    if cached is not None or len(self._handlers) < self._max_size:
+      self._handlers[method] = (handler, wrapped_handler)
+    return wrapped_handler
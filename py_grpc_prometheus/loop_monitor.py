@@ -0,0 +1,191 @@
+"""
+Monitoring the event loop of grpc.aio servers.
+
+All the handlers of a grpc.aio server share one event loop, so a handler
+blocking it, e.g. with synchronous I/O or CPU-bound work, delays every other
+RPC, and the delay shows up in their grpc_server_handling_seconds instead of
+in the culprit's. LoopMonitor measures the loop's scheduling lag with a
+periodic probe and, given to PromAioServerInterceptor, times every step the
+handlers run on the loop, i.e. the code between two awaits, to count the
+steps slower than a threshold against the RPC method running them.
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Dict, Generator, Optional, Sequence, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.registry import REGISTRY, CollectorRegistry
+
+from py_grpc_prometheus.buckets import exponential_buckets
+from py_grpc_prometheus.clock import DEFAULT_CLOCK, Clock
+
+# From 1ms to about 2s.
+LAG_BUCKETS = exponential_buckets(0.001, 2, 12)
+
+
+class _SlowSteps:
+    """The slow step counters of a method, bound on the first slow step."""
+
+    __slots__ = ("_counter", "_seconds_counter", "_labels", "_count", "_seconds")
+
+    def __init__(
+        self, counter: Counter, seconds_counter: Counter, labels: Tuple[str, ...]
+    ) -> None:
+        self._counter = counter
+        self._seconds_counter = seconds_counter
+        self._labels = labels
+        self._count: Any = None
+        self._seconds: Any = None
+
+    def record(self, duration_ns: int) -> None:
+        if self._count is None:
+            self._seconds = self._seconds_counter.labels(*self._labels)
+            self._count = self._counter.labels(*self._labels)
+        self._count.inc()
+        self._seconds.inc(duration_ns / 1e9)
+
+
+class _TimedAwaitable:
+    """Drives a coroutine step by step, reporting the steps over the threshold."""
+
+    __slots__ = ("_awaitable", "_monitor", "_slow_steps")
+
+    def __init__(
+        self, awaitable: Any, monitor: "LoopMonitor", slow_steps: _SlowSteps
+    ) -> None:
+        self._awaitable = awaitable
+        self._monitor = monitor
+        self._slow_steps = slow_steps
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        awaitable = self._awaitable
+        clock = self._monitor.clock
+        threshold_ns = self._monitor.slow_callback_threshold_ns
+        value: Any = None
+        error: Optional[BaseException] = None
+        while True:
+            start = clock()
+            try:
+                if error is None:
+                    future = awaitable.send(value)
+                else:
+                    future = awaitable.throw(error)
+            except StopIteration as stop:
+                self._check(clock() - start, threshold_ns)
+                return stop.value
+            except BaseException:
+                self._check(clock() - start, threshold_ns)
+                raise
+            self._check(clock() - start, threshold_ns)
+            try:
+                value = yield future
+                error = None
+            except GeneratorExit:
+                awaitable.close()
+                raise
+            except BaseException as e:  # pylint: disable=broad-except
+                value = None
+                error = e
+
+    def _check(self, duration_ns: int, threshold_ns: int) -> None:
+        if duration_ns >= threshold_ns:
+            self._slow_steps.record(duration_ns)
+
+
+class LoopMonitor:
+    """
+    Exports the lag and task count of the running event loop.
+
+    Once started on the loop, a probe sleeping interval seconds at a time
+    observes how late it wakes up into grpc_server_event_loop_lag_seconds and
+    sets grpc_server_event_loop_tasks to the number of pending tasks. The
+    steps of the handlers of the interceptors given this monitor which run
+    for slow_callback_threshold seconds or more are counted in
+    grpc_server_event_loop_slow_callbacks_total and
+    grpc_server_event_loop_slow_callback_seconds_total, per method.
+    """
+
+    def __init__(
+        self,
+        registry: Optional[CollectorRegistry] = REGISTRY,
+        interval: float = 1.0,
+        slow_callback_threshold: float = 0.1,
+        buckets: Sequence[float] = LAG_BUCKETS,
+        clock: Clock = DEFAULT_CLOCK,
+    ) -> None:
+        self.clock = clock
+        self.slow_callback_threshold_ns = int(slow_callback_threshold * 1e9)
+        self._interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._slow_steps: Dict[Tuple[str, str, str], _SlowSteps] = {}
+        self._lock = threading.Lock()
+        self._lag_histogram = Histogram(
+            "grpc_server_event_loop_lag_seconds",
+            "Histogram of the delay (seconds) of the event loop in running a callback "
+            "after it was due.",
+            registry=registry,
+            buckets=buckets,
+        )
+        self._tasks_gauge = Gauge(
+            "grpc_server_event_loop_tasks",
+            "Number of pending tasks of the event loop.",
+            registry=registry,
+            multiprocess_mode="livesum",
+        )
+        self._slow_steps_counter = Counter(
+            "grpc_server_event_loop_slow_callbacks_total",
+            "Total number of event loop steps of RPC handlers slower than the "
+            "slow callback threshold.",
+            ["grpc_type", "grpc_service", "grpc_method"],
+            registry=registry,
+        )
+        self._slow_steps_seconds_counter = Counter(
+            "grpc_server_event_loop_slow_callback_seconds_total",
+            "Total time (seconds) the event loop spent in steps of RPC handlers "
+            "slower than the slow callback threshold.",
+            ["grpc_type", "grpc_service", "grpc_method"],
+            registry=registry,
+        )
+
+    def start(self) -> None:
+        """Starts the probe on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._probe())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _probe(self) -> None:
+        interval_ns = int(self._interval * 1e9)
+        while True:
+            due = self.clock() + interval_ns
+            await asyncio.sleep(self._interval)
+            self._lag_histogram.observe(max(self.clock() - due, 0) / 1e9)
+            self._tasks_gauge.set(len(asyncio.all_tasks()))
+
+    def timed(
+        self, awaitable: Awaitable, grpc_type: str, grpc_service: str, grpc_method: str
+    ) -> Awaitable:
+        """
+        Returns an awaitable running the given coroutine, or any awaitable
+        with send() and throw(), and counting its slow steps against the
+        given method.
+        """
+        key = (grpc_type, grpc_service, grpc_method)
+        slow_steps = self._slow_steps.get(key)
+        if slow_steps is None:
+            with self._lock:
+                slow_steps = self._slow_steps.setdefault(
+                    key,
+                    _SlowSteps(
+                        self._slow_steps_counter, self._slow_steps_seconds_counter, key
+                    ),
+                )
+        return _TimedAwaitable(awaitable, self, slow_steps)
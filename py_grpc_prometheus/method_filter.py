@@ -0,0 +1,77 @@
+"""Include/exclude rules deciding which methods are instrumented."""
+
+import fnmatch
+import re
+from typing import Dict, Iterable, Union
+
+_GLOB_CHARACTERS = frozenset("*?[")
+
+
+class _Rules:
+    def __init__(self, rules: Iterable[str]) -> None:
+        self.methods = set()
+        self.services = set()
+        globs = []
+        for rule in rules:
+            if _GLOB_CHARACTERS.intersection(rule):
+                globs.append(fnmatch.translate(rule))
+            elif rule.startswith("/"):
+                self.methods.add(rule)
+            else:
+                self.services.add(rule)
+        self.glob = re.compile("|".join(globs)) if globs else None
+        self.empty = not (self.methods or self.services or globs)
+
+    def match(self, method: str) -> bool:
+        if method in self.methods:
+            return True
+        # e.g. /package.ServiceName/MethodName
+        parts = method.split("/")
+        if len(parts) >= 3 and parts[1] in self.services:
+            return True
+        return self.glob is not None and self.glob.match(method) is not None
+
+
+class MethodFilter:
+    """
+    Decides which methods are instrumented by the interceptors.
+
+    A rule is either a full method path (``/package.Service/Method``), a
+    service name matching all of its methods (``grpc.health.v1.Health``), or a
+    glob pattern matched against the method path (``/grpc.reflection.*``). A
+    method is instrumented when it matches one of the include rules, or there
+    are none, and none of the exclude rules.
+
+    The rules are compiled once at construction and each decision is memoized,
+    so a method seen before costs a single dict lookup. The memo is bounded so
+    that arbitrary method names sent by clients cannot grow it without limit.
+    """
+
+    def __init__(
+        self,
+        include: Iterable[str] = (),
+        exclude: Iterable[str] = (),
+        cache_size: int = 1024,
+    ) -> None:
+        self._include = _Rules(include)
+        self._exclude = _Rules(exclude)
+        self._cache_size = cache_size
+        self._decisions: Dict[Union[str, bytes], bool] = {}
+
+    def __call__(self, method: Union[str, bytes]) -> bool:
+        """Returns whether the given method path should be instrumented."""
+        decision = self._decisions.get(method)
+        if decision is None:
+            decision = self._decide(
+                method.decode("utf-8", "replace")
+                if isinstance(method, bytes)
+                else method
+            )
+            if len(self._decisions) < self._cache_size:
+                self._decisions[method] = decision
+        return decision
+
+    def _decide(self, method: str) -> bool:
+        if not self._include.empty and not self._include.match(method):
+            return False
+        return not self._exclude.match(method)
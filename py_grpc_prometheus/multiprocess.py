@@ -0,0 +1,231 @@
+"""
+Exporting the metrics of pre-fork servers running several processes.
+
+This builds on prometheus_client's multiprocess mode: when the
+PROMETHEUS_MULTIPROC_DIR environment variable is set before prometheus_client
+is first imported, every metric value lives in a memory-mapped file of its
+process, and the metrics of all the processes are merged when scraped. See
+https://prometheus.github.io/client_python/multiprocess/ for its constraints.
+
+On top of it, this module adds a faster merge collector, and a
+mark_process_dead() that folds the files of dead
+workers into one archive per metric type, so the scrape cost depends on the
+live workers only, however often they are restarted.
+"""
+
+import contextlib
+import fcntl
+import glob
+import inspect
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from prometheus_client import multiprocess, values
+from prometheus_client.metrics_core import Metric
+from prometheus_client.mmap_dict import MmapedDict, mmap_key
+from prometheus_client.registry import CollectorRegistry
+from prometheus_client.utils import floatToGoString
+
+# The metric types whose values are merged by summing them across processes,
+# which is all the types the interceptors export.
+_ARCHIVED_TYPES = ("counter", "histogram", "summary")
+_LOCK_FILE = "py_grpc_prometheus.lock"
+
+# prometheus_client>=0.18 stores a timestamp next to every value: its files
+# then read as (key, value, timestamp, position) instead of (key, value,
+# position), and write_value() takes the timestamp.
+_WRITE_TIMESTAMP = "timestamp" in inspect.signature(MmapedDict.write_value).parameters
+
+
+def enabled() -> bool:
+    """Returns whether prometheus_client keeps metric values in per-process files."""
+    return values.ValueClass is not values.MutexValue
+
+
+def _directory(path: Optional[str]) -> str:
+    path = path or os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not path or not os.path.isdir(path):
+        raise ValueError("env PROMETHEUS_MULTIPROC_DIR is not set or not a directory")
+    return path
+
+
+@contextlib.contextmanager
+def _locked(path: str, operation: int) -> Iterator[None]:
+    # Scrapes take the lock shared and compactions exclusive, so a scrape
+    # never sees a dead worker both in its file and in the archive.
+    with open(os.path.join(path, _LOCK_FILE), "a") as lock_file:
+        fcntl.flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# (metric name, sample name, labels without le, le, help text)
+_ParsedKey = Tuple[str, str, tuple, Optional[float], str]
+
+
+class MultiProcessCollector(multiprocess.MultiProcessCollector):
+    """
+    Merges the metrics of all the processes writing into the directory.
+
+    prometheus_client's collector decodes the JSON key of every value of
+    every file and accumulates them through several nested dicts. Processes
+    write identical keys for identical series though, so the counter,
+    histogram and summary values are summed by raw key first, and each
+    distinct key is then decoded once and kept, up to max_cached_keys, for the
+    following scrapes. Gauges are still merged by prometheus_client, as their
+    merge depends on their multiprocess mode.
+    """
+
+    def __init__(
+        self,
+        registry: Optional[CollectorRegistry],
+        path: Optional[str] = None,
+        max_cached_keys: int = 100000,
+    ) -> None:
+        self._max_cached_keys = max_cached_keys
+        self._keys: Dict[str, _ParsedKey] = {}
+        super().__init__(registry, _directory(path))
+
+    def collect(self) -> Iterable[Metric]:
+        totals: Dict[str, float] = {}
+        types: Dict[str, str] = {}
+        with _locked(self._path, fcntl.LOCK_SH):
+            files = glob.glob(os.path.join(self._path, "*.db"))
+            gauge_files = []
+            for file_name in files:
+                typ = os.path.basename(file_name).split("_", 1)[0]
+                if typ == "gauge":
+                    gauge_files.append(file_name)
+                    continue
+                for entry in MmapedDict.read_all_values_from_file(file_name):
+                    key, value = entry[0], entry[1]
+                    total = totals.get(key)
+                    if total is None:
+                        types[key] = typ
+                        totals[key] = value
+                    else:
+                        totals[key] = total + value
+            gauges = self.merge(gauge_files, accumulate=True) if gauge_files else []
+        return list(self._build_metrics(totals, types)) + list(gauges)
+
+    def _parse_key(self, key: str) -> _ParsedKey:
+        parsed = self._keys.get(key)
+        if parsed is None:
+            metric_name, name, labels, help_text = json.loads(key)
+            bucket = labels.pop("le", None)
+            parsed = (
+                metric_name,
+                name,
+                tuple(sorted(labels.items())),
+                None if bucket is None else float(bucket),
+                help_text,
+            )
+            if len(self._keys) >= self._max_cached_keys:
+                self._keys.clear()
+            self._keys[key] = parsed
+        return parsed
+
+    def _build_metrics(
+        self, totals: Dict[str, float], types: Dict[str, str]
+    ) -> Iterable[Metric]:
+        metrics: Dict[str, Metric] = {}
+        # metric name -> labels -> [(upper bound, non cumulative count)]
+        buckets: Dict[str, Dict[tuple, List[Tuple[float, float]]]] = {}
+        for key, value in totals.items():
+            metric_name, name, labels, bucket, help_text = self._parse_key(key)
+            metric = metrics.get(metric_name)
+            if metric is None:
+                metric = metrics[metric_name] = Metric(
+                    metric_name, help_text, types[key]
+                )
+            if bucket is None:
+                metric.add_sample(name, dict(labels), value)
+            else:
+                buckets.setdefault(metric_name, {}).setdefault(labels, []).append(
+                    (bucket, value)
+                )
+
+        for metric_name, metric_buckets in buckets.items():
+            metric = metrics[metric_name]
+            for labels, label_buckets in metric_buckets.items():
+                count = 0.0
+                for bucket, value in sorted(label_buckets):
+                    count += value
+                    metric.add_sample(
+                        metric_name + "_bucket",
+                        dict(labels, le=floatToGoString(bucket)),
+                        count,
+                    )
+                metric.add_sample(metric_name + "_count", dict(labels), count)
+        return metrics.values()
+
+
+def make_registry(path: Optional[str] = None) -> CollectorRegistry:
+    """
+    Returns a registry exposing the merged metrics of all the processes.
+
+    Serve this registry, e.g. with start_http_server(port, registry=...),
+    from a single process. The metrics themselves are still created in the
+    default registry, or any other one, by each worker.
+    """
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry, path)
+    return registry
+
+
+def mark_process_dead(pid: int, path: Optional[str] = None) -> None:
+    """
+    Cleans up after a dead worker; call it from the parent when one exits.
+
+    On top of prometheus_client's bookkeeping for live gauges, the counter,
+    histogram and summary files of the worker are merged into the archive of
+    their type and removed. Their values are kept, so the merged counters do
+    not go backwards, while the number of files read on each scrape stays
+    bounded by the number of live workers.
+    """
+    path = _directory(path)
+    multiprocess.mark_process_dead(pid, path)
+    with _locked(path, fcntl.LOCK_EX):
+        for typ in _ARCHIVED_TYPES:
+            dead_file = os.path.join(path, "%s_%d.db" % (typ, pid))
+            if not os.path.exists(dead_file):
+                continue
+            archive_file = os.path.join(path, "%s_archive.db" % typ)
+            files = [dead_file]
+            if os.path.exists(archive_file):
+                files.append(archive_file)
+            _write_archive(
+                multiprocess.MultiProcessCollector.merge(files, accumulate=False),
+                archive_file,
+            )
+            os.remove(dead_file)
+
+
+def _write_archive(metrics: Iterable[Metric], archive_file: str) -> None:
+    # The archive is written aside and moved in place, so that it is never
+    # seen half written.
+    new_file = archive_file + ".new"
+    if os.path.exists(new_file):
+        os.remove(new_file)
+    archive = MmapedDict(new_file)
+    try:
+        for metric in metrics:
+            for sample in metric.samples:
+                labelnames = list(sample.labels)
+                key = mmap_key(
+                    metric.name,
+                    sample.name,
+                    labelnames,
+                    [sample.labels[name] for name in labelnames],
+                    metric.documentation,
+                )
+                if _WRITE_TIMESTAMP:
+                    archive.write_value(key, sample.value, 0.0)
+                else:
+                    archive.write_value(key, sample.value)  # type: ignore[call-arg]
+    finally:
+        archive.close()
+    os.replace(new_file, archive_file)
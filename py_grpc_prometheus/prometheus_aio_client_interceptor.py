@@ -1,12 +1,14 @@
 """Interceptor a client call with prometheus"""
 
-from timeit import default_timer
-
 import grpc.aio
 from prometheus_client.registry import REGISTRY
 
 from py_grpc_prometheus import grpc_utils
+from py_grpc_prometheus.channel import InstrumentedChannel
 from py_grpc_prometheus.client_metrics import init_metrics
+from py_grpc_prometheus.client_metrics import init_recorder
+from py_grpc_prometheus.client_metrics import MethodMetricsCache
+from py_grpc_prometheus.clock import DEFAULT_CLOCK
 
 class PromAioClientInterceptor(grpc.aio.UnaryUnaryClientInterceptor,
                             grpc.aio.UnaryStreamClientInterceptor,
@@ -22,170 +24,165 @@ class PromAioClientInterceptor(grpc.aio.UnaryUnaryClientInterceptor,
             enable_client_stream_receive_time_histogram=False,
             enable_client_stream_send_time_histogram=False,
             legacy=False,
-            registry=REGISTRY
+            registry=REGISTRY,
+            stream_flush_policy=grpc_utils.EXACT_FLUSH_POLICY,
+            latency_sampler=None,
+            buckets=None,
+            per_method_buckets=None,
+            method_filter=None,
+            cardinality_guard=None,
+            method_cache_size=1024,
+            clock=DEFAULT_CLOCK,
+            enable_in_flight_gauge=False,
+            enable_payload_size_histogram=False,
+            enable_serialization_time_histogram=False,
+            exemplar_sampler=None
   ):
     self._enable_client_handling_time_histogram = enable_client_handling_time_histogram
     self._enable_client_stream_receive_time_histogram = enable_client_stream_receive_time_histogram
     self._enable_client_stream_send_time_histogram = enable_client_stream_send_time_histogram
     self._legacy = legacy
-    self._metrics = init_metrics(registry)
+    self._metrics = init_metrics(
+        registry,
+        latency_sampling=latency_sampler is not None,
+        buckets=buckets,
+        per_method_buckets=per_method_buckets,
+        in_flight=enable_in_flight_gauge,
+        payload_size=enable_payload_size_histogram,
+        serialization_time=enable_serialization_time_histogram)
+    self._recorder = init_recorder(
+        self._metrics,
+        legacy,
+        enable_client_handling_time_histogram,
+        enable_client_stream_receive_time_histogram,
+        enable_client_stream_send_time_histogram,
+        latency_sampler,
+        stream_flush_policy.with_clock(clock),
+        cardinality_guard,
+        registry)
+    self._method_filter = method_filter
+    self._clock = clock
+    self._enable_in_flight_gauge = enable_in_flight_gauge
+    self._enable_payload_size_histogram = enable_payload_size_histogram
+    self._enable_serialization_time_histogram = enable_serialization_time_histogram
+    self._exemplar_sampler = exemplar_sampler
+    self._unary_metrics = MethodMetricsCache(
+        self._recorder, grpc_utils.UNARY, method_cache_size)
+    self._server_streaming_metrics = MethodMetricsCache(
+        self._recorder, grpc_utils.SERVER_STREAMING, method_cache_size)
+    self._client_streaming_metrics = MethodMetricsCache(
+        self._recorder, grpc_utils.CLIENT_STREAMING, method_cache_size)
+    self._bidi_streaming_metrics = MethodMetricsCache(
+        self._recorder, grpc_utils.BIDI_STREAMING, method_cache_size)
+
+  def instrument_channel(self, channel):
+    """
+    Returns channel with the serializers of its stubs recording the messages.
+
+    Interceptors never see serialized messages, so the payload size and
+    serialization time histograms are only recorded for the stubs created on
+    the returned channel, e.g. on
+    interceptor.instrument_channel(grpc.aio.insecure_channel(target,
+        interceptors=[interceptor])).
+    """
+    if not self._enable_payload_size_histogram and not self._enable_serialization_time_histogram:
+      return channel
+    return InstrumentedChannel(
+        channel, self._recorder, self._method_filter,
+        self._enable_payload_size_histogram, self._enable_serialization_time_histogram,
+        self._clock)
 
   async def intercept_unary_unary(self, continuation, client_call_details, request):
-    grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_call(client_call_details)
-    grpc_type = grpc_utils.UNARY
-
-
-    self._metrics["grpc_client_started_counter"].labels(
-        grpc_type=grpc_type,
-        grpc_service=grpc_service_name,
-        grpc_method=grpc_method_name).inc()
-
-    start = default_timer()
-    handler = await continuation(client_call_details, request)
-    if self._legacy:
-      self._metrics["legacy_grpc_client_completed_latency_seconds_histogram"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name).observe(max(default_timer() - start, 0))
-    elif self._enable_client_handling_time_histogram:
-      self._metrics["grpc_client_handled_histogram"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name).observe(max(default_timer() - start, 0))
-
-    if self._legacy:
-      self._metrics["legacy_grpc_client_completed_counter"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name,
-          code=handler.code().name).inc()
-    else:
-      self._metrics["grpc_client_handled_counter"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name,
-          grpc_code=handler.code().name).inc()
-
-    return handler
+    if self._method_filter is not None and not self._method_filter(client_call_details.method):
+      return await continuation(client_call_details, request)
+
+    method_metrics = self._unary_metrics.get(client_call_details)
+    method_metrics.record_started_rpc()
+
+    start = self._clock()
+    call = await self._invoke(method_metrics, continuation, client_call_details, request)
+    # The call is returned as soon as it is started, its code is only known
+    # once it has completed.
+    code = await call.code()
+    self._record_request_latency(method_metrics, self._clock() - start, client_call_details)
+    method_metrics.record_completed_rpc(code)
+
+    return call
 
   async def intercept_unary_stream(self, continuation, client_call_details, request):
-    grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_call(client_call_details)
-    grpc_type = grpc_utils.SERVER_STREAMING
-
-    self._metrics["grpc_client_started_counter"].labels(
-        grpc_type=grpc_type,
-        grpc_service=grpc_service_name,
-        grpc_method=grpc_method_name).inc()
-
-    start = default_timer()
-    handler = await continuation(client_call_details, request)
-    if self._legacy:
-      self._metrics["legacy_grpc_client_completed_latency_seconds_histogram"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name).observe(max(default_timer() - start, 0))
-
-    elif self._enable_client_handling_time_histogram:
-      self._metrics["grpc_client_handled_histogram"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name).observe(max(default_timer() - start, 0))
-
-    handler = grpc_utils.wrap_iterator_inc_counter(
-        handler,
-        self._metrics["grpc_client_stream_msg_received"],
-        grpc_type,
-        grpc_service_name,
-        grpc_method_name)
-
-    if self._enable_client_stream_receive_time_histogram and not self._legacy:
-      self._metrics["grpc_client_stream_recv_histogram"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name).observe(max(default_timer() - start, 0))
-
-    return handler
+    if self._method_filter is not None and not self._method_filter(client_call_details.method):
+      return await continuation(client_call_details, request)
+
+    method_metrics = self._server_streaming_metrics.get(client_call_details)
+    method_metrics.record_started_rpc()
+
+    start = self._clock()
+    call = await self._invoke(method_metrics, continuation, client_call_details, request)
+    self._record_request_latency(method_metrics, self._clock() - start, client_call_details)
+
+    response_iterator = method_metrics.record_stream_msg_received_async(call)
+    method_metrics.record_stream_recv_latency_ns(self._clock() - start)
+
+    return response_iterator
 
   async def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
-    grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_call(client_call_details)
-    grpc_type = grpc_utils.CLIENT_STREAMING
-
-    iterator_metric = self._metrics["grpc_client_stream_msg_sent"]
-
-    request_iterator = grpc_utils.wrap_iterator_inc_counter(
-        request_iterator,
-        iterator_metric,
-        grpc_type,
-        grpc_service_name,
-        grpc_method_name)
-
-    start = default_timer()
-    handler = await continuation(client_call_details, request_iterator)
-
-    if self._legacy:
-      self._metrics["grpc_client_started_counter"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name).inc()
-      self._metrics["legacy_grpc_client_completed_latency_seconds_histogram"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name).observe(max(default_timer() - start, 0))
-    else:
-      self._metrics["grpc_client_started_counter"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name).inc()
-      if self._enable_client_handling_time_histogram:
-        self._metrics["grpc_client_handled_histogram"].labels(
-            grpc_type=grpc_type,
-            grpc_service=grpc_service_name,
-            grpc_method=grpc_method_name).observe(max(default_timer() - start, 0))
-
-    if self._enable_client_stream_send_time_histogram and not self._legacy:
-      self._metrics["grpc_client_stream_send_histogram"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name).observe(max(default_timer() - start, 0))
-
-    return handler
-
-  def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
-    grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_call(
-        client_call_details)
-    grpc_type = grpc_utils.BIDI_STREAMING
-    start = default_timer()
-
-    iterator_sent_metric = self._metrics["grpc_client_stream_msg_sent"]
-
-    response_iterator = continuation(
+    if self._method_filter is not None and not self._method_filter(client_call_details.method):
+      return await continuation(client_call_details, request_iterator)
+
+    method_metrics = self._client_streaming_metrics.get(client_call_details)
+    request_iterator = self._record_stream_msg_sent(method_metrics, request_iterator)
+
+    start = self._clock()
+    call = await self._invoke(method_metrics, continuation, client_call_details, request_iterator)
+    method_metrics.record_started_rpc()
+    self._record_request_latency(method_metrics, self._clock() - start, client_call_details)
+    method_metrics.record_stream_send_latency_ns(self._clock() - start)
+
+    return call
+
+  async def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+    if self._method_filter is not None and not self._method_filter(client_call_details.method):
+      return await continuation(client_call_details, request_iterator)
+
+    method_metrics = self._bidi_streaming_metrics.get(client_call_details)
+    start = self._clock()
+
+    call = await self._invoke(
+        method_metrics, continuation,
         client_call_details,
-        grpc_utils.wrap_iterator_inc_counter(
-            request_iterator,
-            iterator_sent_metric,
-            grpc_type,
-            grpc_service_name,
-            grpc_method_name))
-
-    if self._enable_client_stream_send_time_histogram and not self._legacy:
-      self._metrics["grpc_client_stream_send_histogram"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name).observe(max(default_timer() - start, 0))
-
-    iterator_received_metric = self._metrics["grpc_client_stream_msg_received"]
-
-    response_iterator = grpc_utils.wrap_iterator_inc_counter(
-        response_iterator,
-        iterator_received_metric,
-        grpc_type,
-        grpc_service_name,
-        grpc_method_name)
-
-    if self._enable_client_stream_receive_time_histogram and not self._legacy:
-      self._metrics["grpc_client_stream_recv_histogram"].labels(
-          grpc_type=grpc_type,
-          grpc_service=grpc_service_name,
-          grpc_method=grpc_method_name).observe(max(default_timer() - start, 0))
-
-    return response_iterator
\ No newline at end of file
+        self._record_stream_msg_sent(method_metrics, request_iterator))
+    method_metrics.record_stream_send_latency_ns(self._clock() - start)
+
+    response_iterator = method_metrics.record_stream_msg_received_async(call)
+    method_metrics.record_stream_recv_latency_ns(self._clock() - start)
+
+    return response_iterator
+
+
+  def _record_request_latency(self, method_metrics, latency_ns, source):
+    exemplar = None
+    if self._exemplar_sampler is not None:
+      exemplar = self._exemplar_sampler.exemplar(latency_ns, source)
+    method_metrics.record_request_latency_ns(latency_ns, exemplar)
+
+  async def _invoke(self, method_metrics, continuation, client_call_details, request_or_iterator):
+    """Invokes the continuation, counting the call as in flight until it is done."""
+    if not self._enable_in_flight_gauge:
+      return await continuation(client_call_details, request_or_iterator)
+
+    method_metrics.record_rpc_in_flight()
+    try:
+      call = await continuation(client_call_details, request_or_iterator)
+    except Exception:
+      method_metrics.record_rpc_done()
+      raise
+    # Runs right away for calls that already completed.
+    call.add_done_callback(lambda _: method_metrics.record_rpc_done())
+    return call
+
+  @staticmethod
+  def _record_stream_msg_sent(method_metrics, request_iterator):
+    # grpc.aio takes both plain and async request iterators.
+    if hasattr(request_iterator, "__aiter__"):
+      return method_metrics.record_stream_msg_sent_async(request_iterator)
+    return method_metrics.record_stream_msg_sent(request_iterator)
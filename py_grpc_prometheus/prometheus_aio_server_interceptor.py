@@ -1,10 +1,10 @@
+import inspect
 import logging
-import grpc
-from timeit import default_timer
 from grpc.aio import ServerInterceptor
 from prometheus_client.registry import REGISTRY
 from py_grpc_prometheus import grpc_utils
 from py_grpc_prometheus import server_metrics
+from py_grpc_prometheus.clock import DEFAULT_CLOCK
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -16,16 +16,44 @@ class PromAioServerInterceptor(ServerInterceptor):
                legacy=False,
                skip_exceptions=False,
                log_exceptions=True,
-               registry=REGISTRY):
+               registry=REGISTRY,
+               stream_flush_policy=grpc_utils.EXACT_FLUSH_POLICY,
+               buckets=None,
+               per_method_buckets=None,
+               method_filter=None,
+               cardinality_guard=None,
+               clock=DEFAULT_CLOCK,
+               enable_in_flight_gauge=False,
+               enable_payload_size_histogram=False,
+               enable_serialization_time_histogram=False,
+               exemplar_sampler=None,
+               loop_monitor=None):
     self._enable_handling_time_histogram = enable_handling_time_histogram
     self._legacy = legacy
     self._grpc_server_handled_total_counter = server_metrics.get_grpc_server_handled_counter(
         self._legacy,
         registry
     )
-    self._metrics = server_metrics.init_metrics(registry)
+    self._metrics = server_metrics.init_metrics(
+        registry, buckets, per_method_buckets, enable_in_flight_gauge,
+        enable_payload_size_histogram, enable_serialization_time_histogram)
+    self._recorder = server_metrics.init_recorder(
+        self._metrics,
+        self._grpc_server_handled_total_counter,
+        self._legacy,
+        self._enable_handling_time_histogram,
+        stream_flush_policy.with_clock(clock),
+        cardinality_guard,
+        registry)
     self._skip_exceptions = skip_exceptions
     self._log_exceptions = log_exceptions
+    self._method_filter = method_filter
+    self._clock = clock
+    self._enable_in_flight_gauge = enable_in_flight_gauge
+    self._enable_payload_size_histogram = enable_payload_size_histogram
+    self._enable_serialization_time_histogram = enable_serialization_time_histogram
+    self._exemplar_sampler = exemplar_sampler
+    self._loop_monitor = loop_monitor
 
   async def intercept_service(self, continuation, handler_call_details):
     """
@@ -37,86 +65,184 @@ class PromAioServerInterceptor(ServerInterceptor):
     https://grpc.io/grpc/python/grpc.html#service-side-interceptor
     """
 
+    if self._method_filter is not None and not self._method_filter(handler_call_details.method):
+      return await continuation(handler_call_details)
+
     grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_call(handler_call_details)
 
     def metrics_wrapper(behavior, request_streaming, response_streaming):
-      async def new_behavior(request_or_iterator, servicer_context):
-        response_or_iterator = None
+      grpc_type = grpc_utils.get_method_type(request_streaming, response_streaming)
+      method_metrics = self._recorder.method_metrics(
+          grpc_type, grpc_service_name, grpc_method_name)
+      # grpc.aio picks the way it drives a handler from the kind of callable it
+      # gets, so the wrapper has to be of the same kind as the wrapped behavior.
+      if inspect.isasyncgenfunction(behavior):
+        return self._wrap_async_generator_behavior(behavior, method_metrics, request_streaming)
+      if inspect.iscoroutinefunction(behavior):
+        return self._wrap_coroutine_behavior(
+            behavior, method_metrics, request_streaming, response_streaming)
+      return self._wrap_sync_behavior(
+          behavior, method_metrics, request_streaming, response_streaming)
+
+    serializers_fn = None
+    if self._enable_payload_size_histogram or self._enable_serialization_time_histogram:
+      serializers_fn = grpc_utils.measuring_serializers_fn(
+          self._recorder, grpc_service_name, grpc_method_name,
+          self._enable_payload_size_histogram, self._enable_serialization_time_histogram,
+          self._clock)
+    response = await continuation(handler_call_details)
+    optional_any = grpc_utils.wrap_rpc_behavior(response, metrics_wrapper, serializers_fn)
+
+    return optional_any
+
+  def _wrap_async_generator_behavior(self, behavior, method_metrics, request_streaming):
+    """Wraps a response-streaming handler written as an async generator."""
+    async def new_behavior(request_or_iterator, servicer_context):
+      if self._enable_in_flight_gauge:
+        self._track_in_flight(method_metrics, servicer_context)
+      try:
+        request_or_iterator = self._start_rpc(
+            request_or_iterator, method_metrics, request_streaming, is_async=True)
+        response_iterator = method_metrics.record_stream_msg_sent_async(
+            behavior(request_or_iterator, servicer_context))
+      except Exception as e: # pylint: disable=broad-except
+        if not self._skip_exceptions:
+          raise e
+        if self._log_exceptions:
+          _LOGGER.error(e)
+        response_iterator = behavior(request_or_iterator, servicer_context)
+
+      if self._loop_monitor is None:
+        async for response in response_iterator:
+          yield response
+        return
+
+      while True:
+        try:
+          response = await self._timed(response_iterator.__anext__(), method_metrics)
+        except StopAsyncIteration:
+          return
+        yield response
+
+    return new_behavior
+
+  def _wrap_coroutine_behavior(
+      self, behavior, method_metrics, request_streaming, response_streaming):
+    """
+    Wraps a handler written as a coroutine.
+
+    Response-streaming coroutines use the reader/writer API and write their
+    responses through the servicer context, so there is no iterator to count.
+    """
+    async def new_behavior(request_or_iterator, servicer_context):
+      response_or_iterator = None
+      try:
+        start = self._clock()
+        if self._enable_in_flight_gauge:
+          self._track_in_flight(method_metrics, servicer_context)
         try:
-          start = default_timer()
-          grpc_type = grpc_utils.get_method_type(request_streaming, response_streaming)
-          try:
-            if request_streaming:
-              request_or_iterator = grpc_utils.wrap_iterator_inc_counter(
-                  request_or_iterator,
-                  self._metrics["grpc_server_stream_msg_received"],
-                  grpc_type,
-                  grpc_service_name,
-                  grpc_method_name)
-            else:
-              self._metrics["grpc_server_started_counter"].labels(
-                  grpc_type=grpc_type,
-                  grpc_service=grpc_service_name,
-                  grpc_method=grpc_method_name).inc()
-
-            # Invoke the original rpc behavior.
-            response_or_iterator = await behavior(request_or_iterator, servicer_context)
-
-            if response_streaming:
-              sent_metric = self._metrics["grpc_server_stream_msg_sent"]
-              response_or_iterator = grpc_utils.wrap_iterator_inc_counter(
-                  response_or_iterator,
-                  sent_metric,
-                  grpc_type,
-                  grpc_service_name,
-                  grpc_method_name)
-
-            else:
-              self.increase_grpc_server_handled_total_counter(grpc_type,
-                                                              grpc_service_name,
-                                                              grpc_method_name,
-                                                              grpc.StatusCode.OK)
+          request_or_iterator = self._start_rpc(
+              request_or_iterator, method_metrics, request_streaming, is_async=True)
+
+          # Invoke the original rpc behavior.
+          response_or_iterator = await self._timed(
+              behavior(request_or_iterator, servicer_context), method_metrics)
+
+          if not response_streaming:
+            method_metrics.record_completed_rpc(
+                grpc_utils.compute_status_code(servicer_context))
+          return response_or_iterator
+        except Exception as e: # pylint: disable=broad-except
+          # The only place recording failed RPCs, so each is counted once.
+          method_metrics.record_completed_rpc(
+              grpc_utils.compute_error_code(e, servicer_context))
+          raise e
+        finally:
+          if not response_streaming:
+            self._record_request_latency(method_metrics, self._clock() - start, servicer_context)
+      except Exception as e: # pylint: disable=broad-except
+        # Allow user to skip the exceptions in order to maintain
+        # the basic functionality in the server
+        # The logging function in exception can be toggled with log_exceptions
+        # in order to suppress the noise in logging
+        if self._skip_exceptions:
+          if self._log_exceptions:
+            _LOGGER.error(e)
+          if response_or_iterator is None:
             return response_or_iterator
-          except grpc.RpcError as e:
-            self.increase_grpc_server_handled_total_counter(grpc_type,
-                                                            grpc_service_name,
-                                                            grpc_method_name,
-                                                            grpc_utils.compute_error_code(e).name)
-            raise e
-
-          finally:
-
-            if not response_streaming:
-              if self._legacy:
-                self._metrics["legacy_grpc_server_handled_latency_seconds"].labels(
-                    grpc_type=grpc_type,
-                    grpc_service=grpc_service_name,
-                    grpc_method=grpc_method_name) \
-                    .observe(max(default_timer() - start, 0))
-              elif self._enable_handling_time_histogram:
-                self._metrics["grpc_server_handled_histogram"].labels(
-                    grpc_type=grpc_type,
-                    grpc_service=grpc_service_name,
-                    grpc_method=grpc_method_name) \
-                    .observe(max(default_timer() - start, 0))
+          return await behavior(request_or_iterator, servicer_context)
+        raise e
+
+    return new_behavior
+
+  def _wrap_sync_behavior(self, behavior, method_metrics, request_streaming, response_streaming):
+    """Wraps a synchronous handler, which grpc.aio runs in its thread pool."""
+    def new_behavior(request_or_iterator, servicer_context):
+      response_or_iterator = None
+      try:
+        start = self._clock()
+        if self._enable_in_flight_gauge:
+          self._track_in_flight(method_metrics, servicer_context)
+        try:
+          request_or_iterator = self._start_rpc(
+              request_or_iterator, method_metrics, request_streaming, is_async=False)
+
+          # Invoke the original rpc behavior.
+          response_or_iterator = behavior(request_or_iterator, servicer_context)
+
+          if response_streaming:
+            response_or_iterator = method_metrics.record_stream_msg_sent(response_or_iterator)
+          else:
+            method_metrics.record_completed_rpc(
+                grpc_utils.compute_status_code(servicer_context))
+          return response_or_iterator
         except Exception as e: # pylint: disable=broad-except
-          # Allow user to skip the exceptions in order to maintain
-          # the basic functionality in the server
-          # The logging function in exception can be toggled with log_exceptions
-          # in order to suppress the noise in logging
-          if self._skip_exceptions:
-            if self._log_exceptions:
-              _LOGGER.error(e)
-            if response_or_iterator is None:
-              return response_or_iterator
-            return await behavior(request_or_iterator, servicer_context)
+          # The only place recording failed RPCs, so each is counted once.
+          method_metrics.record_completed_rpc(
+              grpc_utils.compute_error_code(e, servicer_context))
           raise e
+        finally:
+          if not response_streaming:
+            self._record_request_latency(method_metrics, self._clock() - start, servicer_context)
+      except Exception as e: # pylint: disable=broad-except
+        if self._skip_exceptions:
+          if self._log_exceptions:
+            _LOGGER.error(e)
+          if response_or_iterator is None:
+            return response_or_iterator
+          return behavior(request_or_iterator, servicer_context)
+        raise e
 
-      return new_behavior
-    response = await continuation(handler_call_details)
-    optional_any = grpc_utils.wrap_rpc_behavior(response, metrics_wrapper)
+    return new_behavior
 
-    return optional_any
+  def _record_request_latency(self, method_metrics, latency_ns, source):
+    exemplar = None
+    if self._exemplar_sampler is not None:
+      exemplar = self._exemplar_sampler.exemplar(latency_ns, source)
+    method_metrics.record_request_latency_ns(latency_ns, exemplar)
+
+  def _timed(self, awaitable, method_metrics):
+    """Counts the slow steps of the handler on the loop monitor, if any."""
+    if self._loop_monitor is None:
+      return awaitable
+    return self._loop_monitor.timed(
+        awaitable, method_metrics.grpc_type, method_metrics.grpc_service,
+        method_metrics.grpc_method)
+
+  @staticmethod
+  def _track_in_flight(method_metrics, servicer_context):
+    # Done callbacks run when the RPC terminates, including cancelled streams.
+    method_metrics.record_rpc_in_flight()
+    servicer_context.add_done_callback(lambda _: method_metrics.record_rpc_done())
+
+  @staticmethod
+  def _start_rpc(request_or_iterator, method_metrics, request_streaming, is_async):
+    if not request_streaming:
+      method_metrics.record_started_rpc()
+      return request_or_iterator
+    if is_async:
+      return method_metrics.record_stream_msg_received_async(request_or_iterator)
+    return method_metrics.record_stream_msg_received(request_or_iterator)
 
   def increase_grpc_server_handled_total_counter(
       self, grpc_type, grpc_service_name, grpc_method_name, grpc_code):
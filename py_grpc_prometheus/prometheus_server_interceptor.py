@@ -1,13 +1,12 @@
 """Interceptor a client call with prometheus"""
 import logging
 
-from timeit import default_timer
-
 import grpc
 from prometheus_client.registry import REGISTRY
 
 from py_grpc_prometheus import grpc_utils
 from py_grpc_prometheus import server_metrics
+from py_grpc_prometheus.clock import DEFAULT_CLOCK
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -18,16 +17,47 @@ class PromServerInterceptor(grpc.ServerInterceptor):
                legacy=False,
                skip_exceptions=False,
                log_exceptions=True,
-               registry=REGISTRY):
+               registry=REGISTRY,
+               stream_flush_policy=grpc_utils.EXACT_FLUSH_POLICY,
+               buckets=None,
+               per_method_buckets=None,
+               handler_cache_size=1024,
+               method_filter=None,
+               aggregator=None,
+               cardinality_guard=None,
+               clock=DEFAULT_CLOCK,
+               enable_in_flight_gauge=False,
+               enable_payload_size_histogram=False,
+               enable_serialization_time_histogram=False,
+               exemplar_sampler=None):
     self._enable_handling_time_histogram = enable_handling_time_histogram
     self._legacy = legacy
     self._grpc_server_handled_total_counter = server_metrics.get_grpc_server_handled_counter(
         self._legacy,
         registry
     )
-    self._metrics = server_metrics.init_metrics(registry)
+    self._metrics = server_metrics.init_metrics(
+        registry, buckets, per_method_buckets, enable_in_flight_gauge,
+        enable_payload_size_histogram, enable_serialization_time_histogram)
+    self._recorder = server_metrics.init_recorder(
+        self._metrics,
+        self._grpc_server_handled_total_counter,
+        self._legacy,
+        self._enable_handling_time_histogram,
+        stream_flush_policy.with_clock(clock),
+        cardinality_guard,
+        registry)
+    if aggregator is not None:
+      self._recorder = aggregator.wrap(self._recorder)
     self._skip_exceptions = skip_exceptions
     self._log_exceptions = log_exceptions
+    self._handler_cache = grpc_utils.HandlerCache(self._wrap_handler, handler_cache_size)
+    self._method_filter = method_filter
+    self._clock = clock
+    self._enable_in_flight_gauge = enable_in_flight_gauge
+    self._enable_payload_size_histogram = enable_payload_size_histogram
+    self._enable_serialization_time_histogram = enable_serialization_time_histogram
+    self._exemplar_sampler = exemplar_sampler
 
   def intercept_service(self, continuation, handler_call_details):
     """
@@ -40,74 +70,52 @@ class PromServerInterceptor(grpc.ServerInterceptor):
     https://grpc.io/grpc/python/grpc.html#service-side-interceptor
     """
 
+    if self._method_filter is not None and not self._method_filter(handler_call_details.method):
+      return continuation(handler_call_details)
+
+    return self._handler_cache.get(continuation(handler_call_details), handler_call_details)
+
+  def _wrap_handler(self, handler, handler_call_details):
     grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_call(handler_call_details)
 
     def metrics_wrapper(behavior, request_streaming, response_streaming):
+      grpc_type = grpc_utils.get_method_type(request_streaming, response_streaming)
+      method_metrics = self._recorder.method_metrics(
+          grpc_type, grpc_service_name, grpc_method_name)
+
       def new_behavior(request_or_iterator, servicer_context):
         response_or_iterator = None
         try:
-          start = default_timer()
-          grpc_type = grpc_utils.get_method_type(request_streaming, response_streaming)
+          start = self._clock()
+          if self._enable_in_flight_gauge:
+            grpc_utils.track_in_flight(method_metrics, servicer_context)
           try:
             if request_streaming:
-              request_or_iterator = grpc_utils.wrap_iterator_inc_counter(
-                  request_or_iterator,
-                  self._metrics["grpc_server_stream_msg_received"],
-                  grpc_type,
-                  grpc_service_name,
-                  grpc_method_name)
+              request_or_iterator = method_metrics.record_stream_msg_received(
+                  request_or_iterator)
             else:
-              self._metrics["grpc_server_started_counter"].labels(
-                  grpc_type=grpc_type,
-                  grpc_service=grpc_service_name,
-                  grpc_method=grpc_method_name).inc()
+              method_metrics.record_started_rpc()
 
             # Invoke the original rpc behavior.
             response_or_iterator = behavior(request_or_iterator, servicer_context)
 
             if response_streaming:
-              sent_metric = self._metrics["grpc_server_stream_msg_sent"]
-              response_or_iterator = grpc_utils.wrap_iterator_inc_counter(
-                  response_or_iterator,
-                  sent_metric,
-                  grpc_type,
-                  grpc_service_name,
-                  grpc_method_name)
-
+              response_or_iterator = method_metrics.record_stream_msg_sent(
+                  response_or_iterator)
             else:
-              self.increase_grpc_server_handled_total_counter(grpc_type,
-                                                              grpc_service_name,
-                                                              grpc_method_name,
-                                                              self._compute_status_code(
-                                                                  servicer_context).name)
+              method_metrics.record_completed_rpc(
+                  self._compute_status_code(servicer_context))
             return response_or_iterator
-          except grpc.RpcError as e:
-            self.increase_grpc_server_handled_total_counter(grpc_type,
-                                                            grpc_service_name,
-                                                            grpc_method_name,
-                                                            grpc_utils.compute_error_code(e).name)
+          except Exception as e: # pylint: disable=broad-except
+            # The only place recording failed RPCs, so each is counted once.
+            method_metrics.record_completed_rpc(grpc_utils.compute_error_code(e))
             raise e
 
           finally:
 
             if not response_streaming:
-              if self._legacy:
-                self._metrics["legacy_grpc_server_handled_latency_seconds"].labels(
-                    grpc_type=grpc_type,
-                    grpc_service=grpc_service_name,
-                    grpc_method=grpc_method_name) \
-                    .observe(max(default_timer() - start, 0))
-              elif self._enable_handling_time_histogram:
-                self._metrics["grpc_server_handled_histogram"].labels(
-                    grpc_type=grpc_type,
-                    grpc_service=grpc_service_name,
-                    grpc_method=grpc_method_name) \
-                    .observe(max(default_timer() - start, 0))
+              self._record_request_latency(method_metrics, self._clock() - start, servicer_context)
         except Exception as e: # pylint: disable=broad-except
-          self.increase_grpc_server_handled_total_counter(grpc_type,
-                                                grpc_service_name,
-                                                grpc_method_name,
-                                                self._compute_error_code(e).name)
           # Allow user to skip the exceptions in order to maintain
           # the basic functionality in the server
           # The logging function in exception can be toggled with log_exceptions
@@ -122,19 +130,22 @@ class PromServerInterceptor(grpc.ServerInterceptor):
 
       return new_behavior
 
-    optional_any = grpc_utils.wrap_rpc_behavior(continuation(handler_call_details), metrics_wrapper)
+    serializers_fn = None
+    if self._enable_payload_size_histogram or self._enable_serialization_time_histogram:
+      serializers_fn = grpc_utils.measuring_serializers_fn(
+          self._recorder, grpc_service_name, grpc_method_name,
+          self._enable_payload_size_histogram, self._enable_serialization_time_histogram,
+          self._clock)
+    return grpc_utils.wrap_rpc_behavior(handler, metrics_wrapper, serializers_fn)
 
-    return optional_any
+  def _record_request_latency(self, method_metrics, latency_ns, source):
+    exemplar = None
+    if self._exemplar_sampler is not None:
+      exemplar = self._exemplar_sampler.exemplar(latency_ns, source)
+    method_metrics.record_request_latency_ns(latency_ns, exemplar)
 
-  # pylint: disable=protected-access
   def _compute_status_code(self, servicer_context):
-    if servicer_context._state.client == "cancelled":
-      return grpc.StatusCode.CANCELLED
-
-    if servicer_context._state.code is None:
-      return grpc.StatusCode.OK
-
-    return servicer_context._state.code
+    return grpc_utils.compute_status_code(servicer_context)
 
   def increase_grpc_server_handled_total_counter(
       self, grpc_type, grpc_service_name, grpc_method_name, grpc_code):
@@ -0,0 +1,385 @@
+"""
+The recording core shared by all the server and client interceptors.
+
+An interceptor describes the metric families it exports with a Recorder and
+gets one MethodMetrics per method from it. MethodMetrics holds the children
+already bound to the method's labels, so recording an RPC never goes through
+prometheus_client's label resolution once a method has been seen.
+"""
+
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import grpc
+from prometheus_client.registry import REGISTRY, CollectorRegistry
+
+from py_grpc_prometheus import grpc_utils
+from py_grpc_prometheus.cardinality import OTHER, CardinalityGuard
+from py_grpc_prometheus.sampling import Sampler
+
+# StatusCode values are (int, str) tuples with the ints 0..16.
+_STATUS_CODE_COUNT = len(grpc.StatusCode)
+
+
+def status_code_index(grpc_code: grpc.StatusCode) -> int:
+    """Returns the position of the code in the per-status-code tables."""
+    # _value_ is a plain attribute, unlike the value and name properties.
+    return grpc_code._value_[0]  # pylint: disable=protected-access
+
+
+class _NullChild:
+    """Stands in for the children of the metric families an interceptor does not export."""
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def observe(self, amount: float, exemplar: Optional[Dict[str, str]] = None) -> None:
+        pass
+
+    def dec(self, amount: float = 1) -> None:
+        pass
+
+
+_NULL_CHILD = _NullChild()
+
+
+class Recorder:
+    """
+    The metric families an interceptor records into.
+
+    Every family is optional: recording into a family that is None is a no-op.
+    The families are expected to be labelled by grpc_type, grpc_service and
+    grpc_method, in that order, with the handled counter additionally labelled
+    by the status code name, whatever that label is called. Methods rejected
+    by the cardinality_guard share the MethodMetrics of the __other__ method,
+    and are counted in the registry the families are registered in.
+    """
+
+    def __init__(
+        self,
+        started_counter=None,
+        handled_counter=None,
+        latency_histogram=None,
+        stream_msg_received_counter=None,
+        stream_msg_sent_counter=None,
+        stream_recv_latency_histogram=None,
+        stream_send_latency_histogram=None,
+        latency_sampler: Optional[Sampler] = None,
+        latency_sum_counter=None,
+        stream_flush_policy: grpc_utils.FlushPolicy = grpc_utils.EXACT_FLUSH_POLICY,
+        cardinality_guard: Optional[CardinalityGuard] = None,
+        in_flight_gauge=None,
+        msg_received_bytes_histogram=None,
+        msg_sent_bytes_histogram=None,
+        deserialize_latency_histogram=None,
+        serialize_latency_histogram=None,
+        registry: Optional[CollectorRegistry] = REGISTRY,
+    ) -> None:
+        self.started_counter = started_counter
+        self.handled_counter = handled_counter
+        self.latency_histogram = latency_histogram
+        self.stream_msg_received_counter = stream_msg_received_counter
+        self.stream_msg_sent_counter = stream_msg_sent_counter
+        self.stream_recv_latency_histogram = stream_recv_latency_histogram
+        self.stream_send_latency_histogram = stream_send_latency_histogram
+        self.latency_sampler = (
+            latency_sampler if latency_sum_counter is not None else None
+        )
+        self.latency_sum_counter = latency_sum_counter
+        self.stream_flush_policy = stream_flush_policy
+        self.cardinality_guard = cardinality_guard
+        self.in_flight_gauge = in_flight_gauge
+        self.msg_received_bytes_histogram = msg_received_bytes_histogram
+        self.msg_sent_bytes_histogram = msg_sent_bytes_histogram
+        self.deserialize_latency_histogram = deserialize_latency_histogram
+        self.serialize_latency_histogram = serialize_latency_histogram
+        self.registry = registry
+        self._method_metrics: Dict[Tuple[str, str, str], MethodMetrics] = {}
+
+    def method_metrics(
+        self, grpc_type: str, grpc_service: str, grpc_method: str
+    ) -> "MethodMetrics":
+        """Returns the metrics bound to the given method, creating them on first use."""
+        key = (grpc_type, grpc_service, grpc_method)
+        method_metrics = self._method_metrics.get(key)
+        if method_metrics is None:
+            guard = self.cardinality_guard
+            if guard is not None and not guard.admit(grpc_service, grpc_method):
+                # Not cached under its own key, so that rejected methods do
+                # not grow the cache either.
+                return self._overflow_method_metrics(guard, grpc_type)
+            method_metrics = self._method_metrics.setdefault(
+                key, MethodMetrics(self, grpc_type, grpc_service, grpc_method)
+            )
+        return method_metrics
+
+    def _overflow_method_metrics(
+        self, guard: CardinalityGuard, grpc_type: str
+    ) -> "MethodMetrics":
+        key = (grpc_type, OTHER, OTHER)
+        method_metrics = self._method_metrics.get(key)
+        if method_metrics is None:
+            method_metrics = self._method_metrics.setdefault(
+                key,
+                OverflowMethodMetrics(
+                    self, grpc_type, guard.overflowed_rpcs(grpc_type, self.registry)
+                ),
+            )
+        return method_metrics
+
+
+class MethodMetrics:
+    """
+    Metric children bound to the labels of a single gRPC method.
+
+    Resolving ``.labels(...)`` takes a lock and a dict lookup inside
+    prometheus_client, so it is done once per method rather than on every RPC.
+    Children are bound on first use, so methods do not export series that
+    would never be updated, and the handled counter children are kept in a
+    table indexed by status code.
+    """
+
+    __slots__ = (
+        "grpc_type",
+        "grpc_service",
+        "grpc_method",
+        "_recorder",
+        "_labels",
+        "_started_rpc",
+        "_completed_rpc",
+        "_response_latency",
+        "_response_latency_sum",
+        "_sample_latency",
+        "_stream_msg_received",
+        "_stream_msg_sent",
+        "_stream_recv_latency",
+        "_stream_send_latency",
+        "_in_flight",
+        "_msg_received_bytes",
+        "_msg_sent_bytes",
+        "_deserialize_latency",
+        "_serialize_latency",
+    )
+
+    def __init__(
+        self,
+        recorder: Recorder,
+        grpc_type: str,
+        grpc_service: str,
+        grpc_method: str,
+    ) -> None:
+        self.grpc_type = grpc_type
+        self.grpc_service = grpc_service
+        self.grpc_method = grpc_method
+        self._recorder = recorder
+        self._labels = (grpc_type, grpc_service, grpc_method)
+        self._started_rpc = None
+        self._completed_rpc: List = [None] * _STATUS_CODE_COUNT
+        self._response_latency = None
+        self._response_latency_sum: Any = None
+        self._sample_latency: Optional[Callable[[], bool]] = None
+        self._stream_msg_received = None
+        self._stream_msg_sent = None
+        self._stream_recv_latency = None
+        self._stream_send_latency = None
+        self._in_flight = None
+        self._msg_received_bytes = None
+        self._msg_sent_bytes = None
+        self._deserialize_latency = None
+        self._serialize_latency = None
+
+    def _bind(self, family, *extra_labels: str):
+        if family is None:
+            return _NULL_CHILD
+        return family.labels(*self._labels, *extra_labels)
+
+    def record_started_rpc(self) -> None:
+        started_rpc = self._started_rpc
+        if started_rpc is None:
+            started_rpc = self._started_rpc = self._bind(self._recorder.started_counter)
+        started_rpc.inc()
+
+    def record_completed_rpc(self, grpc_code: grpc.StatusCode) -> None:
+        index = status_code_index(grpc_code)
+        completed_rpc = self._completed_rpc[index]
+        if completed_rpc is None:
+            completed_rpc = self._completed_rpc[index] = self._bind(
+                self._recorder.handled_counter, grpc_code.name
+            )
+        completed_rpc.inc()
+
+    def record_request_latency(
+        self, latency: float, exemplar: Optional[Dict[str, str]] = None
+    ) -> None:
+        latency = max(latency, 0)
+        response_latency = self._response_latency
+        if response_latency is None:
+            response_latency = self._bind_response_latency()
+        if self._sample_latency is not None:
+            # Only sampled RPCs are observed into the histogram, the exact sum
+            # is kept aside.
+            self._response_latency_sum.inc(latency)
+            if not self._sample_latency():
+                return
+        if exemplar is None:
+            response_latency.observe(latency)
+        else:
+            response_latency.observe(latency, exemplar)
+
+    def record_request_latency_ns(
+        self, latency_ns: int, exemplar: Optional[Dict[str, str]] = None
+    ) -> None:
+        self.record_request_latency(latency_ns / 1e9, exemplar)
+
+    def _bind_response_latency(self):
+        recorder = self._recorder
+        if (
+            recorder.latency_histogram is not None
+            and recorder.latency_sampler is not None
+        ):
+            self._response_latency_sum = self._bind(recorder.latency_sum_counter)
+            self._sample_latency = recorder.latency_sampler.for_method(
+                self.grpc_service, self.grpc_method
+            )
+        self._response_latency = self._bind(recorder.latency_histogram)
+        return self._response_latency
+
+    def record_stream_recv_latency_ns(self, latency_ns: int) -> None:
+        stream_recv_latency = self._stream_recv_latency
+        if stream_recv_latency is None:
+            stream_recv_latency = self._stream_recv_latency = self._bind(
+                self._recorder.stream_recv_latency_histogram
+            )
+        stream_recv_latency.observe(latency_ns / 1e9)
+
+    def record_stream_send_latency_ns(self, latency_ns: int) -> None:
+        stream_send_latency = self._stream_send_latency
+        if stream_send_latency is None:
+            stream_send_latency = self._stream_send_latency = self._bind(
+                self._recorder.stream_send_latency_histogram
+            )
+        stream_send_latency.observe(latency_ns / 1e9)
+
+    def _in_flight_child(self):
+        if self._in_flight is None:
+            self._in_flight = self._bind(self._recorder.in_flight_gauge)
+        return self._in_flight
+
+    def record_rpc_in_flight(self) -> None:
+        """Counts the RPC as in flight, until record_rpc_done() is called."""
+        self._in_flight_child().inc()
+
+    def record_rpc_done(self) -> None:
+        self._in_flight_child().dec()
+
+    def record_msg_received_bytes(self, size: int) -> None:
+        """Records the serialized size of a message received."""
+        msg_received_bytes = self._msg_received_bytes
+        if msg_received_bytes is None:
+            msg_received_bytes = self._msg_received_bytes = self._bind(
+                self._recorder.msg_received_bytes_histogram
+            )
+        msg_received_bytes.observe(size)
+
+    def record_msg_sent_bytes(self, size: int) -> None:
+        """Records the serialized size of a message sent."""
+        msg_sent_bytes = self._msg_sent_bytes
+        if msg_sent_bytes is None:
+            msg_sent_bytes = self._msg_sent_bytes = self._bind(
+                self._recorder.msg_sent_bytes_histogram
+            )
+        msg_sent_bytes.observe(size)
+
+    def record_deserialize_latency_ns(self, latency_ns: int) -> None:
+        """Records the time taken to deserialize a message received."""
+        deserialize_latency = self._deserialize_latency
+        if deserialize_latency is None:
+            deserialize_latency = self._deserialize_latency = self._bind(
+                self._recorder.deserialize_latency_histogram
+            )
+        deserialize_latency.observe(latency_ns / 1e9)
+
+    def record_serialize_latency_ns(self, latency_ns: int) -> None:
+        """Records the time taken to serialize a message sent."""
+        serialize_latency = self._serialize_latency
+        if serialize_latency is None:
+            serialize_latency = self._serialize_latency = self._bind(
+                self._recorder.serialize_latency_histogram
+            )
+        serialize_latency.observe(latency_ns / 1e9)
+
+    def _stream_msg_received_child(self):
+        if self._stream_msg_received is None:
+            self._stream_msg_received = self._bind(
+                self._recorder.stream_msg_received_counter
+            )
+        return self._stream_msg_received
+
+    def _stream_msg_sent_child(self):
+        if self._stream_msg_sent is None:
+            self._stream_msg_sent = self._bind(self._recorder.stream_msg_sent_counter)
+        return self._stream_msg_sent
+
+    def record_stream_msgs_received(self, count: int) -> None:
+        self._stream_msg_received_child().inc(count)
+
+    def record_stream_msgs_sent(self, count: int) -> None:
+        self._stream_msg_sent_child().inc(count)
+
+    def record_stream_msg_received(
+        self, req_iterator: Iterator["grpc.TRequest"]
+    ) -> Iterator["grpc.TRequest"]:
+        return grpc_utils.count_iterator(
+            req_iterator,
+            self._stream_msg_received_child(),
+            self._recorder.stream_flush_policy,
+        )
+
+    def record_stream_msg_sent(
+        self, resp_iterator: Iterator["grpc.TResponse"]
+    ) -> Iterator["grpc.TResponse"]:
+        return grpc_utils.count_iterator(
+            resp_iterator,
+            self._stream_msg_sent_child(),
+            self._recorder.stream_flush_policy,
+        )
+
+    def record_stream_msg_received_async(
+        self, req_iterator: AsyncIterator["grpc.TRequest"]
+    ) -> AsyncIterator["grpc.TRequest"]:
+        return grpc_utils.count_async_iterator(
+            req_iterator,
+            self._stream_msg_received_child(),
+            self._recorder.stream_flush_policy,
+        )
+
+    def record_stream_msg_sent_async(
+        self, resp_iterator: AsyncIterator["grpc.TResponse"]
+    ) -> AsyncIterator["grpc.TResponse"]:
+        return grpc_utils.count_async_iterator(
+            resp_iterator,
+            self._stream_msg_sent_child(),
+            self._recorder.stream_flush_policy,
+        )
+
+
+class OverflowMethodMetrics(MethodMetrics):
+    """The MethodMetrics of the methods over the cardinality limit."""
+
+    __slots__ = ("_overflowed_rpcs",)
+
+    def __init__(self, recorder: Recorder, grpc_type: str, overflowed_rpcs) -> None:
+        super().__init__(recorder, grpc_type, OTHER, OTHER)
+        self._overflowed_rpcs = overflowed_rpcs
+
+    def record_started_rpc(self) -> None:
+        self._overflowed_rpcs.inc()
+        super().record_started_rpc()
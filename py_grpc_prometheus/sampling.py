@@ -0,0 +1,51 @@
+"""Samplers deciding which RPCs pay for a latency histogram observation."""
+
+import itertools
+import random
+from typing import Callable, Dict, Optional
+
+
+def _always() -> bool:
+    return True
+
+
+class Sampler:
+    """
+    Base class of the latency samplers.
+
+    A sampler hands out one decision function per method. The default rate
+    applies to every method unless it is overridden in ``per_method``, which is
+    keyed by the full method path, e.g. ``/package.Service/Method``.
+    """
+
+    def __init__(self, default_rate, per_method: Optional[Dict[str, object]] = None):
+        self._default_rate = default_rate
+        self._per_method = dict(per_method or {})
+
+    def for_method(self, grpc_service: str, grpc_method: str) -> Callable[[], bool]:
+        rate = self._per_method.get(
+            "/%s/%s" % (grpc_service, grpc_method), self._default_rate
+        )
+        return self._decision(rate)
+
+    def _decision(self, rate) -> Callable[[], bool]:
+        raise NotImplementedError()
+
+
+class EveryNthSampler(Sampler):
+    """Samples every n-th RPC of each method."""
+
+    def _decision(self, rate) -> Callable[[], bool]:
+        if rate <= 1:
+            return _always
+        counter = itertools.count()
+        return lambda: next(counter) % rate == 0
+
+
+class ProbabilitySampler(Sampler):
+    """Samples each RPC with the given probability."""
+
+    def _decision(self, rate) -> Callable[[], bool]:
+        if rate >= 1:
+            return _always
+        return lambda: random.random() < rate
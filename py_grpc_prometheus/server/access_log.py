@@ -0,0 +1,127 @@
+"""Per-RPC access logging for the server interceptor."""
+
+import logging
+import queue
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import grpc
+
+from py_grpc_prometheus.clock import DEFAULT_CLOCK, Clock
+
+_LOGGER = logging.getLogger("py_grpc_prometheus.server.interceptor")
+
+
+class AccessLogger:
+    """
+    Logs one line per RPC handled by the server interceptor.
+
+    Successful RPCs are logged at ok_level and failed ones at error_level. The
+    level is checked before anything else, so disabled levels cost a single
+    isEnabledFor() call.
+
+    With rate_limit_interval, at most one line per (method, code) is logged
+    in each interval and the number of suppressed lines is reported with the
+    next one, so an error storm does not turn into a logging storm. The
+    interval is measured with clock. With background=True the records are
+    handed to a bounded queue drained by a daemon thread, so slow handlers
+    never block the RPC thread; records that do not fit into the queue are
+    dropped and counted.
+    """
+
+    def __init__(
+        self,
+        logger: logging.Logger = _LOGGER,
+        ok_level: int = logging.DEBUG,
+        error_level: int = logging.ERROR,
+        rate_limit_interval: Optional[float] = None,
+        background: bool = False,
+        queue_size: int = 10000,
+        clock: Clock = DEFAULT_CLOCK,
+    ) -> None:
+        self._logger = logger
+        self._ok_level = ok_level
+        self._error_level = error_level
+        self._rate_limit_interval_ns = (
+            None if rate_limit_interval is None else int(rate_limit_interval * 1e9)
+        )
+        self._clock = clock
+        # (service, method, code) -> [next log time, suppressed lines]
+        self._rate_limits: Dict[Tuple[str, str, Optional[str]], List[int]] = {}
+        self._queue: Optional["queue.Queue[tuple]"] = None
+        self.dropped = 0
+        if background:
+            self._queue = queue.Queue(queue_size)
+            threading.Thread(
+                target=self._drain, name="grpc-access-log", daemon=True
+            ).start()
+
+    def log(
+        self,
+        grpc_type: str,
+        grpc_service: str,
+        grpc_method: str,
+        grpc_code: Optional[grpc.StatusCode],
+        exec_time: float,
+    ) -> None:
+        # Streaming responses are still running when the behavior returns, so
+        # they have no code yet and are not errors.
+        level = (
+            self._ok_level
+            if grpc_code is None or grpc_code is grpc.StatusCode.OK
+            else self._error_level
+        )
+        if not self._logger.isEnabledFor(level):
+            return
+
+        code_name = grpc_code.name if grpc_code is not None else None
+        suppressed = 0
+        if self._rate_limit_interval_ns is not None:
+            now = self._clock()
+            key = (grpc_service, grpc_method, code_name)
+            rate_limit = self._rate_limits.get(key)
+            if rate_limit is not None and now < rate_limit[0]:
+                rate_limit[1] += 1
+                return
+            if rate_limit is not None:
+                suppressed = rate_limit[1]
+            self._rate_limits[key] = [now + self._rate_limit_interval_ns, 0]
+
+        record = (
+            level,
+            grpc_type,
+            grpc_service,
+            grpc_method,
+            code_name,
+            exec_time,
+            suppressed,
+        )
+        if self._queue is None:
+            self._emit(record)
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _emit(self, record: tuple) -> None:
+        if not record[6]:
+            self._logger.log(record[0], "%s %s %s %s costs %.10f", *record[1:6])
+        else:
+            self._logger.log(
+                record[0],
+                "%s %s %s %s costs %.10f (%d similar lines suppressed)",
+                *record[1:]
+            )
+
+    def _drain(self) -> None:
+        assert self._queue is not None
+        while True:
+            record = self._queue.get()
+            try:
+                self._emit(record)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to write the access log")
+
+
+DEFAULT_ACCESS_LOGGER = AccessLogger()
@@ -1,20 +1,71 @@
 """Interceptor a client call with prometheus"""
-import logging
-from timeit import default_timer
-from typing import Callable, Iterator, Optional, Union, cast
+
+from typing import Callable, Dict, Iterator, Optional, Sequence, Union, cast
 
 import grpc
 from prometheus_client.registry import REGISTRY, CollectorRegistry
 
 from py_grpc_prometheus import grpc_utils
-from py_grpc_prometheus.server.metrics import Metrics
-
-_LOGGER = logging.getLogger(__name__)
+from py_grpc_prometheus.aggregator import (
+    BackgroundAggregator,
+    QueuedMethodMetrics,
+    QueuedRecorder,
+)
+from py_grpc_prometheus.cardinality import CardinalityGuard
+from py_grpc_prometheus.clock import DEFAULT_CLOCK, Clock
+from py_grpc_prometheus.exemplars import ExemplarSampler
+from py_grpc_prometheus.method_filter import MethodFilter
+from py_grpc_prometheus.recorder import Recorder
+from py_grpc_prometheus.sampling import Sampler
+from py_grpc_prometheus.server.access_log import DEFAULT_ACCESS_LOGGER, AccessLogger
+from py_grpc_prometheus.server.metrics import MethodMetrics, Metrics
 
 
 class PromServerInterceptor(grpc.ServerInterceptor):
-    def __init__(self, registry: Optional[CollectorRegistry] = REGISTRY) -> None:
-        self._metrics = Metrics(registry)
+    def __init__(
+        self,
+        registry: Optional[CollectorRegistry] = REGISTRY,
+        handler_cache_size: int = 1024,
+        stream_flush_policy: grpc_utils.FlushPolicy = grpc_utils.EXACT_FLUSH_POLICY,
+        latency_sampler: Optional[Sampler] = None,
+        buckets: Optional[Sequence[float]] = None,
+        per_method_buckets: Optional[Dict[str, Sequence[float]]] = None,
+        method_filter: Optional[MethodFilter] = None,
+        access_logger: Optional[AccessLogger] = DEFAULT_ACCESS_LOGGER,
+        sharded_metrics: bool = False,
+        aggregator: Optional[BackgroundAggregator] = None,
+        cardinality_guard: Optional[CardinalityGuard] = None,
+        clock: Clock = DEFAULT_CLOCK,
+        enable_in_flight_gauge: bool = False,
+        enable_payload_size_histogram: bool = False,
+        enable_serialization_time_histogram: bool = False,
+        exemplar_sampler: Optional[ExemplarSampler] = None,
+    ) -> None:
+        self._metrics = Metrics(
+            registry,
+            stream_flush_policy.with_clock(clock),
+            latency_sampler,
+            buckets,
+            per_method_buckets,
+            sharded_metrics,
+            cardinality_guard,
+            enable_in_flight_gauge,
+            enable_payload_size_histogram,
+            enable_serialization_time_histogram,
+        )
+        self._recorder: Union[Recorder, QueuedRecorder] = self._metrics.recorder
+        if aggregator is not None:
+            self._recorder = aggregator.wrap(self._recorder)
+        self._handler_cache = grpc_utils.HandlerCache(
+            self._wrap_handler, handler_cache_size
+        )
+        self._method_filter = method_filter
+        self._access_logger = access_logger
+        self._clock = clock
+        self._enable_in_flight_gauge = enable_in_flight_gauge
+        self._enable_payload_size_histogram = enable_payload_size_histogram
+        self._enable_serialization_time_histogram = enable_serialization_time_histogram
+        self._exemplar_sampler = exemplar_sampler
 
     def intercept_service(
         self, continuation, handler_call_details: grpc.HandlerCallDetails
@@ -29,10 +80,19 @@ class PromServerInterceptor(grpc.ServerInterceptor):
         https://grpc.io/grpc/python/grpc.html#service-side-interceptor
         """
 
+        if self._method_filter is not None and not self._method_filter(
+            handler_call_details.method
+        ):
+            return continuation(handler_call_details)
+
         handler: Optional[grpc.RpcMethodHandler] = continuation(handler_call_details)
-        if handler is None:
-            return None
+        return self._handler_cache.get(handler, handler_call_details)
 
+    def _wrap_handler(
+        self,
+        handler: grpc.RpcMethodHandler,
+        handler_call_details: grpc.HandlerCallDetails,
+    ) -> Optional[grpc.RpcMethodHandler]:
         if handler.request_streaming and handler.response_streaming:
             behavior_fn = handler.stream_stream
             handler_factory = grpc.stream_stream_rpc_method_handler
@@ -51,21 +111,41 @@ class PromServerInterceptor(grpc.ServerInterceptor):
         grpc_service_name, grpc_method_name, _ = grpc_utils.split_method_call(
             handler_call_details
         )
-        grpc_type = grpc_utils.get_method_type(
-            handler.request_streaming, handler.response_streaming
+        method_metrics = self._recorder.method_metrics(
+            grpc_utils.get_method_type(
+                handler.request_streaming, handler.response_streaming
+            ),
+            grpc_service_name,
+            grpc_method_name,
         )
 
+        request_deserializer = handler.request_deserializer
+        response_serializer = handler.response_serializer
+        if (
+            self._enable_payload_size_histogram
+            or self._enable_serialization_time_histogram
+        ):
+            (
+                request_deserializer,
+                response_serializer,
+            ) = grpc_utils.measure_handler_serializers(
+                method_metrics,
+                request_deserializer,
+                response_serializer,
+                self._enable_payload_size_histogram,
+                self._enable_serialization_time_histogram,
+                self._clock,
+            )
+
         return handler_factory(
             self._metrics_wrapper(
                 behavior_fn,
-                grpc_service_name,
-                grpc_method_name,
-                grpc_type,
+                method_metrics,
                 handler.request_streaming,
                 handler.response_streaming,
             ),
-            request_deserializer=handler.request_deserializer,
-            response_serializer=handler.response_serializer,
+            request_deserializer=request_deserializer,
+            response_serializer=response_serializer,
         )
 
     def _metrics_wrapper(
@@ -74,9 +154,7 @@ class PromServerInterceptor(grpc.ServerInterceptor):
             [Union["grpc.TRequest", Iterator["grpc.TRequest"]], grpc.ServicerContext],
             Union["grpc.TResponse", Iterator["grpc.TResponse"]],
         ],
-        grpc_service: str,
-        grpc_method: str,
-        grpc_type: str,
+        method_metrics: Union[MethodMetrics, QueuedMethodMetrics],
         request_streaming: bool,
         response_streaming: bool,
     ) -> Callable[
@@ -87,84 +165,57 @@ class PromServerInterceptor(grpc.ServerInterceptor):
             request_or_iterator: Union["grpc.TRequest", Iterator["grpc.TRequest"]],
             servicer_context: grpc.ServicerContext,
         ):
-            start = default_timer()
-            grpc_code: Optional[str] = None
+            start = self._clock()
+            grpc_code: Optional[grpc.StatusCode] = None
+            if self._enable_in_flight_gauge:
+                grpc_utils.track_in_flight(method_metrics, servicer_context)
             try:
                 if request_streaming:
-                    request_or_iterator = self._metrics.record_stream_msg_received(
-                        cast(Iterator["grpc.TRequest"], request_or_iterator),
-                        grpc_type,
-                        grpc_service,
-                        grpc_method,
+                    request_or_iterator = method_metrics.record_stream_msg_received(
+                        cast(Iterator["grpc.TRequest"], request_or_iterator)
                     )
                 else:
-                    self._metrics.record_started_rpc(
-                        grpc_type, grpc_service, grpc_method
-                    )
+                    method_metrics.record_started_rpc()
 
                 # Invoke the original rpc behavior.
                 response_or_iterator = behavior(request_or_iterator, servicer_context)
 
                 if response_streaming:
-                    response_or_iterator = self._metrics.record_stream_msg_sent(
-                        cast(Iterator["grpc.TResponse"], response_or_iterator),
-                        grpc_type,
-                        grpc_service,
-                        grpc_method,
+                    response_or_iterator = method_metrics.record_stream_msg_sent(
+                        cast(Iterator["grpc.TResponse"], response_or_iterator)
                     )
                 else:
-                    grpc_code = self._compute_status_code(servicer_context).name
-                    self._metrics.record_completed_rpc(
-                        grpc_type,
-                        grpc_service,
-                        grpc_method,
-                        grpc_code,
-                    )
+                    grpc_code = self._compute_status_code(servicer_context)
+                    method_metrics.record_completed_rpc(grpc_code)
                 return response_or_iterator
             except (grpc.RpcError, Exception) as err:
                 if isinstance(err, grpc.RpcError):
-                    grpc_code = self._compute_error_code(err).name
+                    grpc_code = grpc_utils.compute_error_code(err)
                 else:
-                    grpc_code = self._compute_status_code(servicer_context).name
-                self._metrics.record_completed_rpc(
-                    grpc_type,
-                    grpc_service,
-                    grpc_method,
-                    grpc_code,
-                )
+                    grpc_code = self._compute_status_code(servicer_context)
+                method_metrics.record_completed_rpc(grpc_code)
                 raise err
             finally:
-                _exec_time = default_timer() - start
+                _exec_time_ns = self._clock() - start
                 if not response_streaming:
-                    self._metrics.record_request_latency(
-                        grpc_type, grpc_service, grpc_method, _exec_time
+                    exemplar = None
+                    if self._exemplar_sampler is not None:
+                        exemplar = self._exemplar_sampler.exemplar(
+                            _exec_time_ns, servicer_context
+                        )
+                    method_metrics.record_request_latency_ns(_exec_time_ns, exemplar)
+                if self._access_logger is not None:
+                    self._access_logger.log(
+                        method_metrics.grpc_type,
+                        method_metrics.grpc_service,
+                        method_metrics.grpc_method,
+                        grpc_code,
+                        _exec_time_ns / 1e9,
                     )
-                _LOGGER.log(
-                    logging.DEBUG if grpc_code == grpc.StatusCode.OK.name else logging.ERROR,
-                    "%s %s %s %s costs %.10f",
-                    grpc_type,
-                    grpc_service,
-                    grpc_method,
-                    grpc_code,
-                    _exec_time,
-                )
 
         return _wrap_behavior
 
-    # pylint: disable=protected-access
     def _compute_status_code(
         self, servicer_context: grpc.ServicerContext
     ) -> grpc.StatusCode:
-        if servicer_context._state.client == "cancelled":  # type: ignore
-            return grpc.StatusCode.CANCELLED
-
-        if servicer_context._state.code is None:  # type: ignore
-            return grpc.StatusCode.OK
-
-        return servicer_context._state.code  # type: ignore
-
-    def _compute_error_code(self, grpc_exception: grpc.RpcError) -> grpc.StatusCode:
-        if isinstance(grpc_exception, grpc.Call):
-            return grpc_exception.code()
-
-        return grpc.StatusCode.UNKNOWN
+        return grpc_utils.compute_status_code(servicer_context)
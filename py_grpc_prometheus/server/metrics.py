@@ -1,98 +1,160 @@
-from typing import Optional, Iterator
+from typing import Dict, Optional, Sequence
 
-import grpc
-from prometheus_client import Counter, Histogram
+from prometheus_client import Counter, Gauge
 from prometheus_client.registry import CollectorRegistry
 
+from py_grpc_prometheus import grpc_utils
+from py_grpc_prometheus.buckets import (
+    PAYLOAD_SIZE_BUCKETS,
+    SERIALIZATION_BUCKETS,
+    histogram,
+)
+from py_grpc_prometheus.cardinality import CardinalityGuard
+from py_grpc_prometheus.recorder import MethodMetrics, Recorder
+from py_grpc_prometheus.sampling import Sampler
+from py_grpc_prometheus.sharded import ShardedCounter, ShardedHistogram
+
 
 class Metrics:
-    def __init__(self, registry: Optional[CollectorRegistry]) -> None:
-        self.completed_rpc_counter = Counter(
+    def __init__(
+        self,
+        registry: Optional[CollectorRegistry],
+        stream_flush_policy: grpc_utils.FlushPolicy = grpc_utils.EXACT_FLUSH_POLICY,
+        latency_sampler: Optional[Sampler] = None,
+        buckets: Optional[Sequence[float]] = None,
+        per_method_buckets: Optional[Dict[str, Sequence[float]]] = None,
+        sharded: bool = False,
+        cardinality_guard: Optional[CardinalityGuard] = None,
+        in_flight: bool = False,
+        payload_size: bool = False,
+        serialization_time: bool = False,
+    ) -> None:
+        self.stream_flush_policy = stream_flush_policy
+        self.latency_sampler = latency_sampler
+        # Sharded metrics keep one shard per thread and only merge them at
+        # scrape time, so that the workers of a thread pool do not contend.
+        counter = ShardedCounter if sharded else Counter
+        latency_histogram = ShardedHistogram if sharded else histogram
+        self.completed_rpc_counter = counter(
             "grpc_server_handled_total",
             "Total number of RPCs completed on the server, regardless of success or failure.",
             ["grpc_type", "grpc_service", "grpc_method", "grpc_code"],
             registry=registry,
         )
-        self.started_rpc_counter = Counter(
+        self.started_rpc_counter = counter(
             "grpc_server_started_total",
             "Total number of RPCs started on the server.",
             ["grpc_type", "grpc_service", "grpc_method"],
             registry=registry,
         )
-        self.stream_msg_received_counter = Counter(
+        self.stream_msg_received_counter = counter(
             "grpc_server_msg_received_total",
             "Total number of RPC stream messages received on the server.",
             ["grpc_type", "grpc_service", "grpc_method"],
             registry=registry,
         )
-        self.stream_msg_sent_counter = Counter(
+        self.stream_msg_sent_counter = counter(
             "grpc_server_msg_sent_total",
             "Total number of gRPC stream messages sent by the server.",
             ["grpc_type", "grpc_service", "grpc_method"],
             registry=registry,
         )
-        self.response_latency_sec_histogram = Histogram(
+        self.response_latency_sec_histogram = latency_histogram(
             "grpc_server_handling_seconds",
             "Histogram of response latency (seconds) of gRPC that had been application-level handled by the server."
             "handled by the server.",
             ["grpc_type", "grpc_service", "grpc_method"],
+            registry,
+            buckets,
+            per_method_buckets,
+        )
+        self.response_latency_sec_counter = None
+        if latency_sampler is not None:
+            # Only sampled RPCs are observed into the histogram, so its _sum and
+            # _count undercount. The exact count is grpc_server_handled_total and
+            # this counter keeps the exact sum.
+            self.response_latency_sec_counter = counter(
+                "grpc_server_handled_seconds_total",
+                "Total response latency (seconds) of all gRPC handled by the server, "
+                "including the ones not sampled into grpc_server_handling_seconds.",
+                ["grpc_type", "grpc_service", "grpc_method"],
+                registry=registry,
+            )
+        self.in_flight_gauge = None
+        if in_flight:
+            # Decremented when the RPC terminates, so that streams are counted
+            # until they end or are cancelled.
+            self.in_flight_gauge = Gauge(
+                "grpc_server_in_flight_rpcs",
+                "Number of RPCs started on the server and not completed yet.",
+                ["grpc_type", "grpc_service", "grpc_method"],
+                registry=registry,
+                multiprocess_mode="livesum",
+            )
+        self.msg_received_bytes_histogram = None
+        self.msg_sent_bytes_histogram = None
+        if payload_size:
+            self.msg_received_bytes_histogram = latency_histogram(
+                "grpc_server_msg_received_bytes",
+                "Histogram of the serialized size (bytes) of the messages received by the server.",
+                ["grpc_type", "grpc_service", "grpc_method"],
+                registry,
+                PAYLOAD_SIZE_BUCKETS,
+            )
+            self.msg_sent_bytes_histogram = latency_histogram(
+                "grpc_server_msg_sent_bytes",
+                "Histogram of the serialized size (bytes) of the messages sent by the server.",
+                ["grpc_type", "grpc_service", "grpc_method"],
+                registry,
+                PAYLOAD_SIZE_BUCKETS,
+            )
+        self.deserialize_latency_histogram = None
+        self.serialize_latency_histogram = None
+        if serialization_time:
+            self.deserialize_latency_histogram = latency_histogram(
+                "grpc_server_msg_deserialize_seconds",
+                "Histogram of the time (seconds) taken to deserialize the messages received by the server.",
+                ["grpc_type", "grpc_service", "grpc_method"],
+                registry,
+                SERIALIZATION_BUCKETS,
+            )
+            self.serialize_latency_histogram = latency_histogram(
+                "grpc_server_msg_serialize_seconds",
+                "Histogram of the time (seconds) taken to serialize the messages sent by the server.",
+                ["grpc_type", "grpc_service", "grpc_method"],
+                registry,
+                SERIALIZATION_BUCKETS,
+            )
+        self.recorder = Recorder(
+            started_counter=self.started_rpc_counter,
+            handled_counter=self.completed_rpc_counter,
+            latency_histogram=self.response_latency_sec_histogram,
+            stream_msg_received_counter=self.stream_msg_received_counter,
+            stream_msg_sent_counter=self.stream_msg_sent_counter,
+            latency_sampler=latency_sampler,
+            latency_sum_counter=self.response_latency_sec_counter,
+            stream_flush_policy=stream_flush_policy,
+            cardinality_guard=cardinality_guard,
+            in_flight_gauge=self.in_flight_gauge,
+            msg_received_bytes_histogram=self.msg_received_bytes_histogram,
+            msg_sent_bytes_histogram=self.msg_sent_bytes_histogram,
+            deserialize_latency_histogram=self.deserialize_latency_histogram,
+            serialize_latency_histogram=self.serialize_latency_histogram,
             registry=registry,
         )
 
-    def record_started_rpc(
-        self, grpc_type: str, grpc_service: str, grpc_method: str
-    ) -> None:
-        self.started_rpc_counter.labels(
-            grpc_type=grpc_type,
-            grpc_service=grpc_service,
-            grpc_method=grpc_method,
-        ).inc()
-
-    def record_completed_rpc(
-        self, grpc_type: str, grpc_service: str, grpc_method: str, grpc_code: str
-    ) -> None:
-        self.completed_rpc_counter.labels(
-            grpc_type=grpc_type,
-            grpc_service=grpc_service,
-            grpc_method=grpc_method,
-            grpc_code=grpc_code,
-        ).inc()
-
-    def record_request_latency(
-        self, grpc_type: str, grpc_service: str, grpc_method: str, latency: float
-    ) -> None:
-        self.response_latency_sec_histogram.labels(
-            grpc_type=grpc_type,
-            grpc_service=grpc_service,
-            grpc_method=grpc_method,
-        ).observe(max(latency, 0))
-
-    def record_stream_msg_received(
+    def method_metrics(
         self,
-        req_iterator: Iterator["grpc.TRequest"],
-        grpc_type: str,
         grpc_service: str,
         grpc_method: str,
-    ) -> Iterator["grpc.TRequest"]:
-        for req_item in req_iterator:
-            self.stream_msg_received_counter.labels(
-                grpc_type=grpc_type,
-                grpc_service=grpc_service,
-                grpc_method=grpc_method,
-            ).inc()
-            yield req_item
+        request_streaming: bool,
+        response_streaming: bool,
+    ) -> "MethodMetrics":
+        """
+        Returns the metrics bound to the given method, creating them on first use.
 
-    def record_stream_msg_sent(
-        self,
-        resp_iterator: Iterator["grpc.TResponse"],
-        grpc_type: str,
-        grpc_service: str,
-        grpc_method: str,
-    ) -> Iterator["grpc.TResponse"]:
-        for resp_item in resp_iterator:
-            self.stream_msg_sent_counter.labels(
-                grpc_type=grpc_type,
-                grpc_service=grpc_service,
-                grpc_method=grpc_method,
-            ).inc()
-            yield resp_item
+        This can also be called ahead of time, e.g. at server startup, to bind the
+        metrics of the known methods before the first RPC arrives.
+        """
+        grpc_type = grpc_utils.get_method_type(request_streaming, response_streaming)
+        return self.recorder.method_metrics(grpc_type, grpc_service, grpc_method)
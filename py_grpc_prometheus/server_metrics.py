@@ -1,8 +1,17 @@
 from prometheus_client import Counter
+from prometheus_client import Gauge
 from prometheus_client import Histogram
+from prometheus_client.registry import REGISTRY
 
-def init_metrics(registry):
-  return {
+from py_grpc_prometheus import grpc_utils
+from py_grpc_prometheus.buckets import PAYLOAD_SIZE_BUCKETS
+from py_grpc_prometheus.buckets import SERIALIZATION_BUCKETS
+from py_grpc_prometheus.buckets import histogram
+from py_grpc_prometheus.recorder import Recorder
+
+def init_metrics(registry, buckets=None, per_method_buckets=None, in_flight=False,
+                 payload_size=False, serialization_time=False):
+  metrics = {
       "grpc_server_started_counter": Counter(
           "grpc_server_started_total",
           "Total number of RPCs started on the server.",
@@ -21,21 +30,64 @@ def init_metrics(registry):
           ["grpc_type", "grpc_service", "grpc_method"],
           registry=registry
       ),
-      "grpc_server_handled_histogram": Histogram(
+      "grpc_server_handled_histogram": histogram(
           "grpc_server_handling_seconds",
           "Histogram of response latency (seconds) of gRPC that had been application-level "
           "handled by the server.",
           ["grpc_type", "grpc_service", "grpc_method"],
-          registry=registry
+          registry,
+          buckets,
+          per_method_buckets
       ),
-      "legacy_grpc_server_handled_latency_seconds": Histogram(
+      "legacy_grpc_server_handled_latency_seconds": histogram(
           "grpc_server_handled_latency_seconds",
           "Histogram of response latency (seconds) of gRPC that had been "
           "application-level handled by the server",
           ["grpc_type", "grpc_service", "grpc_method"],
-          registry=registry
+          registry,
+          buckets,
+          per_method_buckets
       )
   }
+  if in_flight:
+    metrics["grpc_server_in_flight_gauge"] = Gauge(
+        "grpc_server_in_flight_rpcs",
+        "Number of RPCs started on the server and not completed yet.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=registry,
+        multiprocess_mode="livesum"
+    )
+  if payload_size:
+    metrics["grpc_server_msg_received_bytes"] = Histogram(
+        "grpc_server_msg_received_bytes",
+        "Histogram of the serialized size (bytes) of the messages received by the server.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=registry,
+        buckets=PAYLOAD_SIZE_BUCKETS
+    )
+    metrics["grpc_server_msg_sent_bytes"] = Histogram(
+        "grpc_server_msg_sent_bytes",
+        "Histogram of the serialized size (bytes) of the messages sent by the server.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=registry,
+        buckets=PAYLOAD_SIZE_BUCKETS
+    )
+  if serialization_time:
+    metrics["grpc_server_msg_deserialize_histogram"] = Histogram(
+        "grpc_server_msg_deserialize_seconds",
+        "Histogram of the time (seconds) taken to deserialize the messages received by the server.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=registry,
+        buckets=SERIALIZATION_BUCKETS
+    )
+    metrics["grpc_server_msg_serialize_histogram"] = Histogram(
+        "grpc_server_msg_serialize_seconds",
+        "Histogram of the time (seconds) taken to serialize the messages sent by the server.",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=registry,
+        buckets=SERIALIZATION_BUCKETS
+    )
+  return metrics
 
 
 # Legacy metrics for backward compatibility
@@ -52,4 +104,32 @@ def get_grpc_server_handled_counter(is_legacy, registry):
       "Total number of RPCs completed on the server, regardless of success or failure.",
       ["grpc_type", "grpc_service", "grpc_method", "grpc_code"],
       registry=registry
-  )
\ No newline at end of file
+  )
+
+
+def init_recorder(metrics, handled_counter, is_legacy, enable_handling_time_histogram,
+                  stream_flush_policy=grpc_utils.EXACT_FLUSH_POLICY,
+                  cardinality_guard=None,
+                  registry=REGISTRY):
+  """Returns the Recorder for the metrics the server interceptors export."""
+  if is_legacy:
+    latency_histogram = metrics["legacy_grpc_server_handled_latency_seconds"]
+  elif enable_handling_time_histogram:
+    latency_histogram = metrics["grpc_server_handled_histogram"]
+  else:
+    latency_histogram = None
+  return Recorder(
+      started_counter=metrics["grpc_server_started_counter"],
+      handled_counter=handled_counter,
+      latency_histogram=latency_histogram,
+      stream_msg_received_counter=metrics["grpc_server_stream_msg_received"],
+      stream_msg_sent_counter=metrics["grpc_server_stream_msg_sent"],
+      stream_flush_policy=stream_flush_policy,
+      cardinality_guard=cardinality_guard,
+      in_flight_gauge=metrics.get("grpc_server_in_flight_gauge"),
+      msg_received_bytes_histogram=metrics.get("grpc_server_msg_received_bytes"),
+      msg_sent_bytes_histogram=metrics.get("grpc_server_msg_sent_bytes"),
+      deserialize_latency_histogram=metrics.get("grpc_server_msg_deserialize_histogram"),
+      serialize_latency_histogram=metrics.get("grpc_server_msg_serialize_histogram"),
+      registry=registry
+  )
@@ -0,0 +1,240 @@
+"""
+Counters and histograms that keep one shard per thread.
+
+prometheus_client children guard their value with a lock, so the worker
+threads of a busy thread-pool server all serialize on the same few children.
+The metrics here give every thread its own shard of each child, which only
+that thread writes, and sum the shards when the registry is scraped. They
+expose the same ``labels(...).inc()`` / ``labels(...).observe()`` interface as
+the prometheus_client ones.
+
+The shards of a thread outlive it, so that its increments are not lost, which
+makes them a good fit for long-lived worker pools rather than for threads
+created per request.
+"""
+
+import bisect
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from prometheus_client import values
+from prometheus_client.metrics_core import (
+    CounterMetricFamily,
+    HistogramMetricFamily,
+    Metric,
+)
+from prometheus_client.registry import CollectorRegistry
+from prometheus_client.samples import Exemplar
+from prometheus_client.utils import floatToGoString
+
+from py_grpc_prometheus.buckets import DEFAULT_BUCKETS
+
+
+class _ShardedChild:
+    __slots__ = ("_local", "_lock", "_shards", "_shard_size")
+
+    def __init__(self, shard_size: int) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[List[float]] = []
+        self._shard_size = shard_size
+
+    def _shard(self) -> List[float]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = [0.0] * self._shard_size
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _merged(self) -> List[float]:
+        merged = [0.0] * self._shard_size
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for i, value in enumerate(shard):
+                merged[i] += value
+        return merged
+
+
+class ShardedCounterChild(_ShardedChild):
+    __slots__ = ()
+
+    def __init__(self) -> None:
+        super().__init__(1)
+
+    def inc(self, amount: float = 1) -> None:
+        if amount < 0:
+            raise ValueError(
+                "Counters can only be incremented by non-negative amounts."
+            )
+        self._shard()[0] += amount
+
+    def get(self) -> float:
+        return self._merged()[0]
+
+
+class ShardedHistogramChild(_ShardedChild):
+    """
+    Each shard holds the per-bucket (non cumulative) counts, then the sum.
+
+    The last exemplar of each bucket is shared by all the threads.
+    """
+
+    __slots__ = ("_upper_bounds", "_exemplars")
+
+    def __init__(self, upper_bounds: Sequence[float]) -> None:
+        super().__init__(len(upper_bounds) + 1)
+        self._upper_bounds = upper_bounds
+        self._exemplars: List[Optional[Exemplar]] = [None] * len(upper_bounds)
+
+    def observe(self, amount: float, exemplar: Optional[Dict[str, str]] = None) -> None:
+        shard = self._shard()
+        bucket = bisect.bisect_left(self._upper_bounds, amount)
+        shard[bucket] += 1
+        shard[-1] += amount
+        if exemplar is not None:
+            self._exemplars[bucket] = Exemplar(exemplar, amount, time.time())
+
+    def get(self) -> Tuple[List[tuple], float]:
+        merged = self._merged()
+        buckets: List[tuple] = []
+        count = 0.0
+        for upper_bound, bucket_count, exemplar in zip(
+            self._upper_bounds, merged, self._exemplars
+        ):
+            count += bucket_count
+            if exemplar is None:
+                buckets.append((floatToGoString(upper_bound), count))
+            else:
+                buckets.append((floatToGoString(upper_bound), count, exemplar))
+        return buckets, merged[-1]
+
+
+class _ShardedMetric:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        registry: Optional[CollectorRegistry],
+    ) -> None:
+        if values.ValueClass is not values.MutexValue:
+            raise ValueError(
+                "Sharded metrics live in process memory and cannot be used in "
+                "prometheus_client's multiprocess mode."
+            )
+        self._name = name
+        self._documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], _ShardedChild] = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *labelvalues: str, **labelkwargs: str):
+        if labelkwargs:
+            labelvalues = tuple(labelkwargs[name] for name in self._labelnames)
+        elif len(labelvalues) != len(self._labelnames):
+            raise ValueError("Incorrect label count")
+        labelvalues = tuple(str(value) for value in labelvalues)
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.get(labelvalues)
+                if child is None:
+                    child = self._children[labelvalues] = self._new_child(labelvalues)
+        return child
+
+    def _new_child(self, labelvalues: Tuple[str, ...]) -> _ShardedChild:
+        raise NotImplementedError
+
+    def _family(self) -> Metric:
+        raise NotImplementedError
+
+    def _add_child(self, family, labelvalues, child) -> None:
+        raise NotImplementedError
+
+    def describe(self) -> Iterable[Metric]:
+        return [self._family()]
+
+    def collect(self) -> Iterable[Metric]:
+        family = self._family()
+        with self._lock:
+            children = list(self._children.items())
+        for labelvalues, child in children:
+            self._add_child(family, list(labelvalues), child)
+        return [family]
+
+
+class ShardedCounter(_ShardedMetric):
+    """A labelled counter whose children keep one shard per thread."""
+
+    def _new_child(self, labelvalues: Tuple[str, ...]) -> ShardedCounterChild:
+        return ShardedCounterChild()
+
+    def _family(self) -> CounterMetricFamily:
+        return CounterMetricFamily(
+            self._name, self._documentation, labels=self._labelnames
+        )
+
+    def _add_child(self, family, labelvalues, child) -> None:
+        family.add_metric(labelvalues, child.get())
+
+
+class ShardedHistogram(_ShardedMetric):
+    """
+    A labelled histogram whose children keep one shard per thread.
+
+    Like MethodHistogram, the bucket layout can be overridden per method path.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        registry: Optional[CollectorRegistry],
+        buckets: Optional[Sequence[float]] = None,
+        per_method_buckets: Optional[Dict[str, Sequence[float]]] = None,
+    ) -> None:
+        self._upper_bounds = _upper_bounds(
+            DEFAULT_BUCKETS if buckets is None else buckets
+        )
+        self._per_method_upper_bounds = {
+            method: _upper_bounds(method_buckets)
+            for method, method_buckets in (per_method_buckets or {}).items()
+        }
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self, labelvalues: Tuple[str, ...]) -> ShardedHistogramChild:
+        upper_bounds = self._upper_bounds
+        if self._per_method_upper_bounds:
+            labels = dict(zip(self._labelnames, labelvalues))
+            upper_bounds = self._per_method_upper_bounds.get(
+                "/%s/%s" % (labels["grpc_service"], labels["grpc_method"]),
+                upper_bounds,
+            )
+        return ShardedHistogramChild(upper_bounds)
+
+    def _family(self) -> HistogramMetricFamily:
+        return HistogramMetricFamily(
+            self._name, self._documentation, labels=self._labelnames
+        )
+
+    def _add_child(self, family, labelvalues, child) -> None:
+        buckets, sum_value = child.get()
+        family.add_metric(labelvalues, buckets, sum_value)
+
+
+def _upper_bounds(buckets: Sequence[float]) -> Tuple[float, ...]:
+    upper_bounds = [float(bucket) for bucket in buckets]
+    if upper_bounds != sorted(upper_bounds):
+        raise ValueError("Buckets not in sorted order")
+    if not upper_bounds or upper_bounds[-1] != math.inf:
+        upper_bounds.append(math.inf)
+    return tuple(upper_bounds)
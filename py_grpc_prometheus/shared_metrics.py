@@ -0,0 +1,41 @@
+"""
+Metrics shared by all the objects exporting them to the same registry.
+
+Some metrics describe a helper rather than the interceptor using it, e.g. the
+RPCs a CardinalityGuard sent over its limit. Such a helper can be used by
+several interceptors, each exporting to its own registry, while a registry
+rejects a second metric of the same name. The helper thus gets its metric
+for the registry of the interceptor at hand through registry_metric().
+"""
+
+import threading
+import weakref
+from typing import Any, Callable, Dict, Optional
+
+from prometheus_client.registry import CollectorRegistry
+
+_lock = threading.Lock()
+_metrics: "weakref.WeakKeyDictionary[CollectorRegistry, Dict[str, Any]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def registry_metric(
+    registry: Optional[CollectorRegistry],
+    name: str,
+    factory: Callable[[Optional[CollectorRegistry]], Any],
+) -> Any:
+    """
+    Returns the metric name of registry, created by factory(registry) once.
+
+    With registry None, the metric is not registered anywhere, so every call
+    creates a new one.
+    """
+    if registry is None:
+        return factory(None)
+    with _lock:
+        metrics = _metrics.setdefault(registry, {})
+        metric = metrics.get(name)
+        if metric is None:
+            metric = metrics[name] = factory(registry)
+        return metric
@@ -37,6 +37,7 @@ setup(
     long_description_content_type="text/markdown",
     author="Lin Chen",
     author_email="linchen04@gmail.com",
+    python_requires=">=3.7",
     install_requires=[
         "setuptools>=39.0.1",
         "grpcio>=1.10.0",
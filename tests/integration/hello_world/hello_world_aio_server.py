@@ -0,0 +1,69 @@
+import asyncio
+import logging
+
+import grpc
+
+import tests.integration.hello_world.hello_world_pb2 as hello_world_pb2
+import tests.integration.hello_world.hello_world_pb2_grpc as hello_world_grpc
+from py_grpc_prometheus.exposition import start_aio_http_server
+from py_grpc_prometheus.prometheus_aio_server_interceptor import (
+    PromAioServerInterceptor,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AioGreeter(hello_world_grpc.GreeterServicer):
+    async def SayHello(self, request, context):
+        if request.name == "invalid":
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("Consarnit!")
+            return hello_world_pb2.HelloReply()
+        if request.name == "rpcError":
+            raise grpc.RpcError()
+        if request.name == "unknownError":
+            raise ValueError(request.name)
+        if request.name == "abort":
+            await context.abort(grpc.StatusCode.NOT_FOUND, "abort err string")
+        return hello_world_pb2.HelloReply(message="Hello, %s!" % request.name)
+
+    async def SayHelloUnaryStream(self, request, context):
+        for i in range(request.res):
+            yield hello_world_pb2.HelloReply(
+                message="Hello, %s %s!" % (request.name, i)
+            )
+
+    async def SayHelloStreamUnary(self, request_iterator, context):
+        names = ""
+        async for request in request_iterator:
+            names += request.name + " "
+        return hello_world_pb2.HelloReply(message="Hello, %s!" % names)
+
+    async def SayHelloBidiStream(self, request_iterator, context):
+        async for request in request_iterator:
+            yield hello_world_pb2.HelloReply(message="Hello, %s!" % request.name)
+
+
+async def serve():
+    logging.basicConfig(level=logging.DEBUG, format="%(asctime)-15s %(message)s")
+    _LOGGER.info("Starting py-grpc-promtheus hello word aio server")
+    server = grpc.aio.server(
+        interceptors=(PromAioServerInterceptor(enable_handling_time_histogram=True),),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(AioGreeter(), server)
+    server.add_insecure_port("[::]:50051")
+    await server.start()
+    metrics_server = await start_aio_http_server(50052)
+
+    _LOGGER.info(
+        "Started py-grpc-promtheus hello word aio server, grpc at localhost:50051, "
+        "metrics at http://localhost:50052"
+    )
+    try:
+        await server.wait_for_termination()
+    finally:
+        await metrics_server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -4,13 +4,13 @@ myPath = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, myPath + "/../../../")
 import logging
 import time
-from concurrent import futures
 
 import grpc
 from prometheus_client import start_http_server
 
 import tests.integration.hello_world.hello_world_pb2 as hello_world_pb2
 import tests.integration.hello_world.hello_world_pb2_grpc as hello_world_grpc
+from py_grpc_prometheus.executor import InstrumentedThreadPoolExecutor
 from py_grpc_prometheus.server.interceptor import PromServerInterceptor
 
 _ONE_DAY_IN_SECONDS = 60 * 60 * 24
@@ -60,7 +60,7 @@ def serve():
     logging.basicConfig(level=logging.DEBUG, format="%(asctime)-15s %(message)s")
     _LOGGER.info("Starting py-grpc-promtheus hello word server")
     server = grpc.server(
-        futures.ThreadPoolExecutor(max_workers=10),
+        InstrumentedThreadPoolExecutor(max_workers=10),
         interceptors=(PromServerInterceptor(),),
     )
     hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
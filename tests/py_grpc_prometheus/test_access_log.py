@@ -0,0 +1,51 @@
+import logging
+import time
+
+import grpc
+
+from py_grpc_prometheus.clock import ManualClock
+from py_grpc_prometheus.server.access_log import AccessLogger
+
+_LOGGER_NAME = "tests.access_log"
+
+
+def test_access_log_levels(caplog):
+    access_logger = AccessLogger(logging.getLogger(_LOGGER_NAME))
+    with caplog.at_level(logging.ERROR, logger=_LOGGER_NAME):
+        access_logger.log("UNARY", "Greeter", "SayHello", grpc.StatusCode.OK, 0.1)
+        access_logger.log("UNARY", "Greeter", "SayHello", None, 0.1)
+        access_logger.log(
+            "UNARY", "Greeter", "SayHello", grpc.StatusCode.UNAVAILABLE, 0.1
+        )
+    assert [record.levelno for record in caplog.records] == [logging.ERROR]
+    assert "UNAVAILABLE" in caplog.records[0].getMessage()
+
+
+def test_access_log_rate_limit(caplog):
+    clock = ManualClock()
+    access_logger = AccessLogger(
+        logging.getLogger(_LOGGER_NAME), rate_limit_interval=0.05, clock=clock
+    )
+    with caplog.at_level(logging.DEBUG, logger=_LOGGER_NAME):
+        for _ in range(10):
+            access_logger.log(
+                "UNARY", "Greeter", "SayHello", grpc.StatusCode.UNAVAILABLE, 0.1
+            )
+        access_logger.log("UNARY", "Greeter", "SayHello", grpc.StatusCode.OK, 0.1)
+        clock.advance(seconds=0.05)
+        access_logger.log(
+            "UNARY", "Greeter", "SayHello", grpc.StatusCode.UNAVAILABLE, 0.1
+        )
+    messages = [record.getMessage() for record in caplog.records]
+    assert len(messages) == 3
+    assert messages[2].endswith("(9 similar lines suppressed)")
+
+
+def test_access_log_background(caplog):
+    access_logger = AccessLogger(logging.getLogger(_LOGGER_NAME), background=True)
+    with caplog.at_level(logging.DEBUG, logger=_LOGGER_NAME):
+        access_logger.log("UNARY", "Greeter", "SayHello", grpc.StatusCode.OK, 0.1)
+        deadline = time.time() + 5
+        while not caplog.records and time.time() < deadline:
+            time.sleep(0.01)
+    assert len(caplog.records) == 1
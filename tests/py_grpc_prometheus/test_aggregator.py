@@ -0,0 +1,124 @@
+from concurrent import futures
+
+import grpc
+import pytest
+from prometheus_client import registry
+
+from py_grpc_prometheus.aggregator import DROP, RECORD_INLINE, BackgroundAggregator
+from py_grpc_prometheus.prometheus_client_interceptor import PromClientInterceptor
+from py_grpc_prometheus.server.interceptor import PromServerInterceptor
+from py_grpc_prometheus.server.metrics import Metrics
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+UNARY_LABELS = {
+    "grpc_type": "UNARY",
+    "grpc_service": "Greeter",
+    "grpc_method": "SayHello",
+}
+
+
+def test_aggregated_server_and_client_metrics():
+    prom_registry = registry.CollectorRegistry()
+    aggregator = BackgroundAggregator(flush_interval=3600)
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=2),
+        interceptors=(
+            PromServerInterceptor(registry=prom_registry, aggregator=aggregator),
+        ),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        with grpc.intercept_channel(
+            grpc.insecure_channel("localhost:%d" % port),
+            PromClientInterceptor(registry=prom_registry, aggregator=aggregator),
+        ) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            for i in range(5):
+                stub.SayHello(hello_world_pb2.HelloRequest(name=str(i)))
+            list(
+                stub.SayHelloUnaryStream(
+                    hello_world_pb2.MultipleHelloResRequest(name="stream", res=3)
+                )
+            )
+    finally:
+        server.stop(0)
+
+    # Nothing is recorded until the aggregator applies the events.
+    assert (
+        prom_registry.get_sample_value("grpc_server_started_total", UNARY_LABELS)
+        is None
+    )
+    aggregator.close()
+
+    assert (
+        prom_registry.get_sample_value("grpc_server_started_total", UNARY_LABELS) == 5
+    )
+    assert (
+        prom_registry.get_sample_value("grpc_client_started_total", UNARY_LABELS) == 5
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handled_total", dict(UNARY_LABELS, grpc_code="OK")
+        )
+        == 5
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_msg_sent_total",
+            {
+                "grpc_type": "SERVER_STREAMING",
+                "grpc_service": "Greeter",
+                "grpc_method": "SayHelloUnaryStream",
+            },
+        )
+        == 3
+    )
+    assert prom_registry.get_sample_value("grpc_metrics_dropped_events_total") == 0
+
+
+@pytest.mark.parametrize(
+    "overflow, started, dropped", [(DROP, 2, 3), (RECORD_INLINE, 5, 0)]
+)
+def test_aggregator_overflow(overflow, started, dropped):
+    prom_registry = registry.CollectorRegistry()
+    aggregator = BackgroundAggregator(
+        max_queue_size=2, flush_interval=3600, overflow=overflow
+    )
+    method_metrics = aggregator.wrap(Metrics(prom_registry).recorder).method_metrics(
+        "UNARY", "Greeter", "SayHello"
+    )
+    for _ in range(5):
+        method_metrics.record_started_rpc()
+    aggregator.close()
+
+    assert (
+        prom_registry.get_sample_value("grpc_server_started_total", UNARY_LABELS)
+        == started
+    )
+    assert (
+        prom_registry.get_sample_value("grpc_metrics_dropped_events_total") == dropped
+    )
+
+
+def test_dropped_events_are_counted_in_the_recorder_registry():
+    registries = [registry.CollectorRegistry(), registry.CollectorRegistry()]
+    aggregator = BackgroundAggregator(max_queue_size=0, flush_interval=3600)
+    # A second aggregator exporting to the same registry shares the counter.
+    other_aggregator = BackgroundAggregator(max_queue_size=0, flush_interval=3600)
+    for count, prom_registry in enumerate(registries, 1):
+        recorder = Metrics(prom_registry).recorder
+        for queued in (aggregator.wrap(recorder), other_aggregator.wrap(recorder)):
+            method_metrics = queued.method_metrics("UNARY", "Greeter", "SayHello")
+            for _ in range(count):
+                method_metrics.record_started_rpc()
+    aggregator.close()
+    other_aggregator.close()
+
+    assert [
+        prom_registry.get_sample_value("grpc_metrics_dropped_events_total")
+        for prom_registry in registries
+    ] == [2, 4]
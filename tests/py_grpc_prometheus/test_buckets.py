@@ -0,0 +1,55 @@
+import pytest
+from prometheus_client import generate_latest, registry
+from prometheus_client.parser import text_string_to_metric_families
+
+from py_grpc_prometheus.buckets import exponential_buckets, linear_buckets
+from py_grpc_prometheus.server.metrics import Metrics
+
+
+def test_exponential_buckets():
+    assert exponential_buckets(0.001, 2, 4) == [0.001, 0.002, 0.004, 0.008]
+    with pytest.raises(ValueError):
+        exponential_buckets(0.001, 1, 4)
+
+
+def test_linear_buckets():
+    assert linear_buckets(1, 2, 3) == [1, 3, 5]
+    with pytest.raises(ValueError):
+        linear_buckets(1, 0, 3)
+
+
+def test_per_method_buckets():
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+    metrics = Metrics(
+        prom_registry,
+        buckets=[0.1, 1],
+        per_method_buckets={"/Greeter/SayHelloSlowly": [60, 600]},
+    )
+    metrics.method_metrics("Greeter", "SayHello", False, False).record_request_latency(
+        0.05
+    )
+    metrics.method_metrics(
+        "Greeter", "SayHelloSlowly", False, False
+    ).record_request_latency(120)
+
+    families = [
+        family
+        for family in text_string_to_metric_families(
+            generate_latest(prom_registry).decode()
+        )
+        if family.name == "grpc_server_handling_seconds"
+    ]
+    assert len(families) == 1
+    buckets = {
+        (sample.labels["grpc_method"], sample.labels["le"]): sample.value
+        for sample in families[0].samples
+        if sample.name == "grpc_server_handling_seconds_bucket"
+    }
+    assert buckets == {
+        ("SayHello", "0.1"): 1,
+        ("SayHello", "1.0"): 1,
+        ("SayHello", "+Inf"): 1,
+        ("SayHelloSlowly", "60.0"): 0,
+        ("SayHelloSlowly", "600.0"): 1,
+        ("SayHelloSlowly", "+Inf"): 1,
+    }
@@ -0,0 +1,119 @@
+from concurrent import futures
+
+import grpc
+from prometheus_client import REGISTRY, Counter, registry
+
+from py_grpc_prometheus.aggregator import BackgroundAggregator
+from py_grpc_prometheus.cardinality import OTHER, CardinalityGuard, service_methods
+from py_grpc_prometheus.prometheus_client_interceptor import PromClientInterceptor
+from py_grpc_prometheus.recorder import Recorder
+from py_grpc_prometheus.server.interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+
+def _recorder(prom_registry, guard):
+    started = Counter(
+        "started_total",
+        "",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=prom_registry,
+    )
+    return Recorder(
+        started_counter=started, cardinality_guard=guard, registry=prom_registry
+    )
+
+
+def _started(prom_registry, service, method):
+    return prom_registry.get_sample_value(
+        "started_total",
+        {"grpc_type": "UNARY", "grpc_service": service, "grpc_method": method},
+    )
+
+
+def test_methods_over_the_limit_are_collapsed():
+    prom_registry = registry.CollectorRegistry()
+    guard = CardinalityGuard(max_methods=1, known_methods=["/Greeter/SayHello"])
+    recorder = _recorder(prom_registry, guard)
+    for method in ["SayHello", "First", "Second", "Third", "SayHello", "First"]:
+        recorder.method_metrics("UNARY", "Greeter", method).record_started_rpc()
+
+    assert _started(prom_registry, "Greeter", "SayHello") == 2
+    assert _started(prom_registry, "Greeter", "First") == 2
+    assert _started(prom_registry, OTHER, OTHER) == 2
+    assert _started(prom_registry, "Greeter", "Second") is None
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_metrics_overflowed_rpcs_total", {"grpc_type": "UNARY"}
+        )
+        == 2
+    )
+    # The rejected methods are not cached.
+    assert len(recorder._method_metrics) == 3  # pylint: disable=protected-access
+
+
+def test_aggregated_methods_are_collapsed():
+    prom_registry = registry.CollectorRegistry()
+    guard = CardinalityGuard(max_methods=0)
+    aggregator = BackgroundAggregator()
+    recorder = aggregator.wrap(_recorder(prom_registry, guard))
+    for i in range(10):
+        recorder.method_metrics("UNARY", "Greeter", str(i)).record_started_rpc()
+    aggregator.close()
+
+    assert _started(prom_registry, OTHER, OTHER) == 10
+    assert len(recorder._method_metrics) == 1  # pylint: disable=protected-access
+
+
+def test_overflowed_rpcs_are_counted_in_the_interceptor_registry():
+    server_registry = registry.CollectorRegistry()
+    client_registry = registry.CollectorRegistry()
+    guard = CardinalityGuard(max_methods=0)
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=2),
+        interceptors=(
+            PromServerInterceptor(
+                registry=server_registry, access_logger=None, cardinality_guard=guard
+            ),
+        ),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        with grpc.intercept_channel(
+            grpc.insecure_channel("localhost:%d" % port),
+            # A second guard exporting to another registry.
+            PromClientInterceptor(
+                registry=client_registry,
+                cardinality_guard=CardinalityGuard(max_methods=0),
+            ),
+        ) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            stub.SayHello(hello_world_pb2.HelloRequest(name="overflow"))
+    finally:
+        server.stop(0)
+
+    for prom_registry in (server_registry, client_registry):
+        assert (
+            prom_registry.get_sample_value(
+                "grpc_metrics_overflowed_rpcs_total", {"grpc_type": "UNARY"}
+            )
+            == 1
+        )
+    assert (
+        REGISTRY.get_sample_value(
+            "grpc_metrics_overflowed_rpcs_total", {"grpc_type": "UNARY"}
+        )
+        is None
+    )
+
+
+def test_service_methods():
+    assert service_methods(hello_world_pb2.DESCRIPTOR.services_by_name["Greeter"]) == [
+        "/Greeter/SayHello",
+        "/Greeter/SayHelloUnaryStream",
+        "/Greeter/SayHelloStreamUnary",
+        "/Greeter/SayHelloBidiStream",
+    ]
@@ -0,0 +1,44 @@
+from py_grpc_prometheus import grpc_utils
+from py_grpc_prometheus.client_metrics import MethodMetricsCache
+from py_grpc_prometheus.recorder import Recorder
+
+
+class _CallDetails:
+    def __init__(self, method):
+        self.method = method
+
+
+class _CountingRecorder(Recorder):
+    def __init__(self):
+        super().__init__()
+        self.lookups = 0
+
+    def method_metrics(self, grpc_type, grpc_service, grpc_method):
+        self.lookups += 1
+        return super().method_metrics(grpc_type, grpc_service, grpc_method)
+
+
+def test_method_metrics_cache_resolves_each_path_once():
+    recorder = _CountingRecorder()
+    cache = MethodMetricsCache(recorder, grpc_utils.UNARY)
+    method_metrics = cache.get(_CallDetails("/Greeter/SayHello"))
+    assert cache.get(_CallDetails("/Greeter/SayHello")) is method_metrics
+    assert recorder.lookups == 1
+    assert (
+        method_metrics.grpc_type,
+        method_metrics.grpc_service,
+        method_metrics.grpc_method,
+    ) == ("UNARY", "Greeter", "SayHello")
+
+    # grpc.aio passes the path encoded.
+    assert cache.get(_CallDetails(b"/Greeter/SayHello")) is method_metrics
+    assert recorder.lookups == 2
+
+
+def test_method_metrics_cache_is_bounded():
+    recorder = _CountingRecorder()
+    cache = MethodMetricsCache(recorder, grpc_utils.UNARY, max_size=1)
+    for _ in range(2):
+        cache.get(_CallDetails("/Greeter/SayHello"))
+        cache.get(_CallDetails("/Greeter/Other"))
+    assert recorder.lookups == 3
@@ -0,0 +1,75 @@
+from concurrent import futures
+
+import grpc
+import pytest
+from prometheus_client import registry
+
+from py_grpc_prometheus.clock import ManualClock
+from py_grpc_prometheus.prometheus_client_interceptor import PromClientInterceptor
+from py_grpc_prometheus.server.interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+
+LABELS = {"grpc_type": "UNARY", "grpc_service": "Greeter", "grpc_method": "SayHello"}
+
+
+class _SlowGreeter(hello_world_grpc.GreeterServicer):
+    def __init__(self, clock):
+        self._clock = clock
+
+    def SayHello(self, request, context):
+        self._clock.advance(0.25)
+        return hello_world_pb2.HelloReply(message="Hello, %s!" % request.name)
+
+
+def test_manual_clock():
+    prom_registry = registry.CollectorRegistry()
+    clock = ManualClock()
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=1),
+        interceptors=(
+            PromServerInterceptor(
+                registry=prom_registry, access_logger=None, clock=clock
+            ),
+        ),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(_SlowGreeter(clock), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        with grpc.intercept_channel(
+            grpc.insecure_channel("localhost:%d" % port),
+            PromClientInterceptor(
+                enable_client_handling_time_histogram=True,
+                registry=prom_registry,
+                clock=clock,
+            ),
+        ) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            for i in range(3):
+                stub.SayHello(hello_world_pb2.HelloRequest(name=str(i)))
+    finally:
+        server.stop(0)
+
+    assert (
+        prom_registry.get_sample_value("grpc_server_handling_seconds_sum", LABELS)
+        == 0.75
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handling_seconds_bucket", dict(LABELS, le="0.25")
+        )
+        == 3
+    )
+    assert (
+        prom_registry.get_sample_value("grpc_client_handling_seconds_sum", LABELS)
+        == 0.75
+    )
+
+
+def test_manual_clock_does_not_go_backwards():
+    clock = ManualClock(10)
+    clock.advance(nanoseconds=5)
+    assert clock() == 15
+    with pytest.raises(ValueError):
+        clock.advance(-1)
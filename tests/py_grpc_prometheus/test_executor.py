@@ -0,0 +1,98 @@
+import threading
+
+import grpc
+from prometheus_client import registry
+
+from py_grpc_prometheus.clock import ManualClock
+from py_grpc_prometheus.executor import ExecutorMetrics, InstrumentedThreadPoolExecutor
+from py_grpc_prometheus.server.interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+LABELS = {"executor": "test"}
+
+
+def _sample(prom_registry, name):
+    return prom_registry.get_sample_value(name, LABELS)
+
+
+def test_queue_wait_and_utilization():
+    prom_registry = registry.CollectorRegistry()
+    clock = ManualClock()
+    executor = InstrumentedThreadPoolExecutor(
+        1, name="test", metrics=ExecutorMetrics(prom_registry), clock=clock
+    )
+    running = threading.Event()
+    release = threading.Event()
+
+    def block():
+        running.set()
+        release.wait()
+
+    try:
+        first = executor.submit(block)
+        running.wait()
+        second = executor.submit(lambda x: x * 2, 21)
+        assert _sample(prom_registry, "grpc_server_executor_max_workers") == 1
+        assert _sample(prom_registry, "grpc_server_executor_busy_workers") == 1
+        assert _sample(prom_registry, "grpc_server_executor_queued_tasks") == 1
+
+        clock.advance(0.5)
+        release.set()
+        first.result()
+        assert second.result() == 42
+    finally:
+        executor.shutdown()
+
+    assert _sample(prom_registry, "grpc_server_executor_busy_workers") == 0
+    assert _sample(prom_registry, "grpc_server_executor_queued_tasks") == 0
+    assert _sample(prom_registry, "grpc_server_executor_queue_wait_seconds_count") == 2
+    assert _sample(prom_registry, "grpc_server_executor_queue_wait_seconds_sum") == 0.5
+
+
+def test_cancelled_tasks_leave_the_queue():
+    prom_registry = registry.CollectorRegistry()
+    executor = InstrumentedThreadPoolExecutor(
+        1, name="test", metrics=ExecutorMetrics(prom_registry)
+    )
+    running = threading.Event()
+    release = threading.Event()
+
+    def block():
+        running.set()
+        release.wait()
+
+    executor.submit(block)
+    running.wait()
+    queued = [executor.submit(print) for _ in range(3)]
+    assert _sample(prom_registry, "grpc_server_executor_queued_tasks") == 3
+    assert all(future.cancel() for future in queued)
+    assert _sample(prom_registry, "grpc_server_executor_queued_tasks") == 0
+    release.set()
+    executor.shutdown()
+    assert _sample(prom_registry, "grpc_server_executor_queue_wait_seconds_count") == 1
+
+
+def test_grpc_server():
+    prom_registry = registry.CollectorRegistry()
+    server = grpc.server(
+        InstrumentedThreadPoolExecutor(
+            2, name="test", metrics=ExecutorMetrics(prom_registry)
+        ),
+        interceptors=(
+            PromServerInterceptor(registry=prom_registry, access_logger=None),
+        ),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        with grpc.insecure_channel("localhost:%d" % port) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            for i in range(3):
+                stub.SayHello(hello_world_pb2.HelloRequest(name=str(i)))
+    finally:
+        server.stop(None)
+
+    assert _sample(prom_registry, "grpc_server_executor_queue_wait_seconds_count") >= 3
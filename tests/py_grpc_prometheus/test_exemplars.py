@@ -0,0 +1,156 @@
+import types
+from concurrent import futures
+
+import grpc
+import pytest
+from prometheus_client import registry
+from prometheus_client.openmetrics.exposition import generate_latest
+
+from py_grpc_prometheus.aggregator import BackgroundAggregator
+from py_grpc_prometheus.exemplars import ExemplarSampler, metadata_exemplar
+from py_grpc_prometheus.prometheus_client_interceptor import PromClientInterceptor
+from py_grpc_prometheus.server.interceptor import PromServerInterceptor
+from py_grpc_prometheus.server.metrics import Metrics
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+
+def test_metadata_exemplar():
+    exemplar_fn = metadata_exemplar("x-trace-id")
+    server_context = types.SimpleNamespace(
+        invocation_metadata=lambda: (("x-trace-id", "abc"),)
+    )
+    assert exemplar_fn(server_context) == {"trace_id": "abc"}
+    call_details = types.SimpleNamespace(metadata=[("x-trace-id", b"def")])
+    assert exemplar_fn(call_details) == {"trace_id": "def"}
+    assert exemplar_fn(types.SimpleNamespace(metadata=None)) is None
+    oversized = types.SimpleNamespace(metadata=[("x-trace-id", "a" * 200)])
+    assert exemplar_fn(oversized) is None
+
+
+def test_exemplar_sampler_threshold():
+    sources = []
+
+    def exemplar_fn(source):
+        sources.append(source)
+        return {"trace_id": source}
+
+    sampler = ExemplarSampler(exemplar_fn, min_latency=0.5)
+    assert sampler.exemplar(499999999, "fast") is None
+    assert sampler.exemplar(500000000, "slow") == {"trace_id": "slow"}
+    assert sources == ["slow"]
+
+
+def test_exemplar_sampler_drops_invalid_exemplars():
+    def exemplar_fn(source):
+        if source == "error":
+            raise KeyError(source)
+        return source
+
+    sampler = ExemplarSampler(exemplar_fn)
+    assert sampler.exemplar(0, "error") is None
+    assert sampler.exemplar(0, {"trace_id": "a" * 200}) is None
+    assert sampler.exemplar(0, {"trace-id": "abc"}) is None
+    assert sampler.exemplar(0, {"trace_id": "abc"}) == {"trace_id": "abc"}
+
+
+def _call(prom_registry, server_kwargs, min_latency, trace_id="abc123"):
+    sampler = ExemplarSampler(
+        lambda source: {"trace_id": dict(_metadata(source))["x-trace-id"]},
+        min_latency,
+    )
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=2),
+        interceptors=(
+            PromServerInterceptor(
+                registry=prom_registry,
+                access_logger=None,
+                exemplar_sampler=sampler,
+                **server_kwargs,
+            ),
+        ),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        with grpc.intercept_channel(
+            grpc.insecure_channel("localhost:%d" % port),
+            PromClientInterceptor(
+                registry=prom_registry,
+                enable_client_handling_time_histogram=True,
+                exemplar_sampler=sampler,
+            ),
+        ) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            stub.SayHello(
+                hello_world_pb2.HelloRequest(name="exemplar"),
+                metadata=(("x-trace-id", trace_id),),
+            )
+    finally:
+        server.stop(0)
+    return generate_latest(prom_registry).decode()
+
+
+def _metadata(source):
+    if hasattr(source, "invocation_metadata"):
+        return source.invocation_metadata()
+    return source.metadata
+
+
+@pytest.mark.parametrize("sharded", [False, True], ids=["default", "sharded"])
+def test_exemplars(sharded):
+    exposition = _call(
+        registry.CollectorRegistry(), {"sharded_metrics": sharded}, min_latency=0
+    )
+    for metric in ("grpc_server_handling_seconds", "grpc_client_handling_seconds"):
+        assert any(
+            line.startswith(metric + "_bucket") and '# {trace_id="abc123"}' in line
+            for line in exposition.splitlines()
+        ), metric
+
+
+def test_no_exemplars_below_min_latency():
+    exposition = _call(registry.CollectorRegistry(), {}, min_latency=60)
+    assert "trace_id" not in exposition
+
+
+@pytest.mark.parametrize("sharded", [False, True], ids=["default", "sharded"])
+def test_oversized_exemplars_are_dropped(sharded):
+    prom_registry = registry.CollectorRegistry()
+    # Would raise grpc.RpcError had the exemplar failed the RPC.
+    exposition = _call(
+        prom_registry, {"sharded_metrics": sharded}, min_latency=0, trace_id="a" * 200
+    )
+    assert "trace_id" not in exposition
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handled_total",
+            {
+                "grpc_type": "UNARY",
+                "grpc_service": "Greeter",
+                "grpc_method": "SayHello",
+                "grpc_code": "OK",
+            },
+        )
+        == 1
+    )
+
+
+def test_aggregated_exemplars():
+    prom_registry = registry.CollectorRegistry()
+    aggregator = BackgroundAggregator(flush_interval=3600)
+    method_metrics = aggregator.wrap(Metrics(prom_registry).recorder).method_metrics(
+        "UNARY", "Greeter", "SayHello"
+    )
+    method_metrics.record_request_latency_ns(10**6)
+    method_metrics.record_request_latency_ns(2 * 10**9, {"trace_id": "abc123"})
+    aggregator.close()
+
+    exposition = generate_latest(prom_registry).decode()
+    assert (
+        'grpc_server_handling_seconds_bucket{grpc_method="SayHello",'
+        'grpc_service="Greeter",grpc_type="UNARY",le="2.5"} 2.0 # {trace_id="abc123"} 2.0'
+        in exposition
+    )
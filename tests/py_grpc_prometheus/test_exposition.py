@@ -0,0 +1,170 @@
+import asyncio
+import gzip
+import threading
+import time
+import urllib.error
+import urllib.request
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+from prometheus_client import Counter, registry
+
+from py_grpc_prometheus.exposition import (
+    CachedRenderer,
+    make_wsgi_app,
+    start_aio_http_server,
+)
+
+
+def _registry(**counters):
+    prom_registry = registry.CollectorRegistry()
+    for name, value in counters.items():
+        Counter(name, name, registry=prom_registry).inc(value)
+    return prom_registry
+
+
+def _scrape(path="/metrics", method="GET", headers=None, **counters):
+    prom_registry = _registry(**counters)
+
+    async def _run():
+        server = await start_aio_http_server(0, "localhost", registry=prom_registry)
+        request = urllib.request.Request(
+            "http://localhost:%d%s" % (server.port, path),
+            method=method,
+            headers=headers or {},
+        )
+        try:
+            # The scrape runs in a thread, so it only succeeds if the event
+            # loop keeps serving the connection.
+            return await asyncio.get_running_loop().run_in_executor(
+                None, lambda: urllib.request.urlopen(request, timeout=5)
+            )
+        finally:
+            await server.stop()
+
+    response = asyncio.run(_run())
+    return response.headers, response.read()
+
+
+def test_scrape():
+    headers, body = _scrape(requests=3)
+    assert headers["Content-Type"].startswith("text/plain")
+    assert b"requests_total 3.0" in body
+
+
+def test_openmetrics():
+    headers, body = _scrape(
+        headers={"Accept": "application/openmetrics-text"}, requests=1
+    )
+    assert headers["Content-Type"].startswith("application/openmetrics-text")
+    assert body.endswith(b"# EOF\n")
+
+
+def test_restricted_names():
+    _, body = _scrape("/metrics?name[]=requests_total", requests=1, errors=2)
+    assert b"requests_total 1.0" in body
+    assert b"errors_total" not in body
+
+
+def test_gzip():
+    headers, body = _scrape(headers={"Accept-Encoding": "gzip"}, requests=1)
+    assert headers["Content-Encoding"] == "gzip"
+    assert b"requests_total 1.0" in gzip.decompress(body)
+
+
+def test_method_not_allowed():
+    with pytest.raises(urllib.error.HTTPError) as error:
+        _scrape(method="POST")
+    assert error.value.code == 405
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl():
+    prom_registry = _registry(requests=1)
+    clock = _Clock()
+    renderer = CachedRenderer(prom_registry, ttl=5, clock=clock)
+    assert b"requests_total 1.0" in renderer.render().body
+
+    Counter("late", "late", registry=prom_registry).inc()
+    clock.now = 4.9
+    assert b"late_total" not in renderer.render().body
+    clock.now = 5
+    assert b"late_total 1.0" in renderer.render().body
+
+
+def test_restricted_renders_are_not_cached():
+    prom_registry = _registry(requests=1)
+    renderer = CachedRenderer(prom_registry, ttl=5, clock=_Clock())
+    for i in range(100):
+        payload = renderer.render(names=["requests_total", "x%d" % i])
+        assert b"requests_total 1.0" in payload.body
+    assert not renderer._payloads  # pylint: disable=protected-access
+    assert not renderer._locks  # pylint: disable=protected-access
+
+
+def test_cached_payloads_are_bounded():
+    prom_registry = _registry(requests=1)
+    renderer = CachedRenderer(prom_registry, ttl=5, clock=_Clock(), max_payloads=2)
+    # Every format, compressed or not, is a payload of its own.
+    for accept_header in ("text/plain", "application/openmetrics-text"):
+        for accept_encoding in ("", "gzip"):
+            payload = renderer.render(accept_header, accept_encoding=accept_encoding)
+            body = payload.body
+            if accept_encoding:
+                body = gzip.decompress(body)
+            assert b"requests_total 1.0" in body
+    assert len(renderer._payloads) == 2  # pylint: disable=protected-access
+    assert len(renderer._locks) == 2  # pylint: disable=protected-access
+
+
+class _SlowCollector:
+    def __init__(self):
+        self.collections = 0
+
+    def collect(self):
+        self.collections += 1
+        time.sleep(0.2)
+        return []
+
+
+def test_concurrent_scrapes_are_coalesced():
+    prom_registry = registry.CollectorRegistry()
+    collector = _SlowCollector()
+    prom_registry.register(collector)
+    renderer = CachedRenderer(prom_registry)
+
+    threads = [threading.Thread(target=renderer.render) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert collector.collections == 1
+
+    # Without ttl, a later scrape renders again.
+    renderer.render()
+    assert collector.collections == 2
+
+
+def test_wsgi_not_modified():
+    app = make_wsgi_app(_registry(requests=1))
+    responses = []
+
+    def _get(**environ):
+        setup_testing_defaults(environ)
+        body = b"".join(app(environ, lambda *response: responses.append(response)))
+        return responses[-1], body
+
+    (status, headers), body = _get()
+    assert status == "200 OK"
+    assert b"requests_total 1.0" in body
+
+    (status, _), body = _get(HTTP_IF_NONE_MATCH=dict(headers)["ETag"])
+    assert status == "304 Not Modified"
+    assert body == b""
@@ -0,0 +1,165 @@
+import asyncio
+
+import grpc
+import pytest
+from prometheus_client import registry
+
+from py_grpc_prometheus.grpc_utils import EXACT_FLUSH_POLICY, FlushPolicy
+from py_grpc_prometheus.prometheus_aio_server_interceptor import (
+    PromAioServerInterceptor,
+)
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_aio_server import AioGreeter
+
+
+def _run_against_aio_server(call, **interceptor_kwargs):
+    prom_registry = registry.CollectorRegistry(auto_describe=True)
+
+    async def _run():
+        server = grpc.aio.server(
+            interceptors=(
+                PromAioServerInterceptor(registry=prom_registry, **interceptor_kwargs),
+            )
+        )
+        hello_world_grpc.add_GreeterServicer_to_server(AioGreeter(), server)
+        port = server.add_insecure_port("localhost:0")
+        await server.start()
+        try:
+            async with grpc.aio.insecure_channel("localhost:%d" % port) as channel:
+                await call(hello_world_grpc.GreeterStub(channel))
+        finally:
+            await server.stop(0)
+
+    asyncio.run(_run())
+    return prom_registry
+
+
+def _labels(grpc_type, grpc_method, **extra):
+    return dict(
+        grpc_type=grpc_type, grpc_service="Greeter", grpc_method=grpc_method, **extra
+    )
+
+
+@pytest.mark.parametrize("target_count", [1, 10])
+def test_aio_unary(target_count):
+    async def _call(stub):
+        for i in range(target_count):
+            await stub.SayHello(hello_world_pb2.HelloRequest(name=str(i)))
+
+    prom_registry = _run_against_aio_server(_call, enable_handling_time_histogram=True)
+    labels = _labels("UNARY", "SayHello")
+    assert (
+        prom_registry.get_sample_value("grpc_server_started_total", labels)
+        == target_count
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handled_total", dict(labels, grpc_code="OK")
+        )
+        == target_count
+    )
+    assert (
+        prom_registry.get_sample_value("grpc_server_handling_seconds_count", labels)
+        == target_count
+    )
+
+
+@pytest.mark.parametrize("number_of_res", [1, 10, 100])
+def test_aio_unary_stream(number_of_res):
+    async def _call(stub):
+        responses = stub.SayHelloUnaryStream(
+            hello_world_pb2.MultipleHelloResRequest(
+                name="unary stream", res=number_of_res
+            )
+        )
+        assert len([response async for response in responses]) == number_of_res
+
+    prom_registry = _run_against_aio_server(_call)
+    labels = _labels("SERVER_STREAMING", "SayHelloUnaryStream")
+    assert prom_registry.get_sample_value("grpc_server_started_total", labels) == 1
+    assert (
+        prom_registry.get_sample_value("grpc_server_msg_sent_total", labels)
+        == number_of_res
+    )
+
+
+@pytest.mark.parametrize("number_of_names", [1, 10, 100])
+def test_aio_stream_unary(number_of_names):
+    async def _requests():
+        for i in range(number_of_names):
+            yield hello_world_pb2.HelloRequest(name=str(i))
+
+    async def _call(stub):
+        await stub.SayHelloStreamUnary(_requests())
+
+    prom_registry = _run_against_aio_server(_call)
+    labels = _labels("CLIENT_STREAMING", "SayHelloStreamUnary")
+    assert (
+        prom_registry.get_sample_value("grpc_server_msg_received_total", labels)
+        == number_of_names
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handled_total", dict(labels, grpc_code="OK")
+        )
+        == 1
+    )
+
+
+@pytest.mark.parametrize(
+    "number_of_names, flush_policy",
+    [(1, EXACT_FLUSH_POLICY), (100, EXACT_FLUSH_POLICY), (100, FlushPolicy(7, 60))],
+)
+def test_aio_bidi_stream(number_of_names, flush_policy):
+    async def _requests():
+        for i in range(number_of_names):
+            yield hello_world_pb2.MultipleHelloResRequest(name=str(i), res=1)
+
+    async def _call(stub):
+        responses = stub.SayHelloBidiStream(_requests())
+        assert len([response async for response in responses]) == number_of_names
+
+    prom_registry = _run_against_aio_server(_call, stream_flush_policy=flush_policy)
+    labels = _labels("BIDI_STREAMING", "SayHelloBidiStream")
+    assert (
+        prom_registry.get_sample_value("grpc_server_msg_received_total", labels)
+        == number_of_names
+    )
+    assert (
+        prom_registry.get_sample_value("grpc_server_msg_sent_total", labels)
+        == number_of_names
+    )
+
+
+@pytest.mark.parametrize(
+    "name, grpc_code",
+    [
+        ("invalid", "INVALID_ARGUMENT"),
+        ("abort", "NOT_FOUND"),
+        ("unknownError", "UNKNOWN"),
+        ("rpcError", "UNKNOWN"),
+    ],
+)
+def test_aio_unary_status_code(name, grpc_code):
+    async def _call(stub):
+        for _ in range(3):
+            with pytest.raises(grpc.RpcError):
+                await stub.SayHello(hello_world_pb2.HelloRequest(name=name))
+
+    prom_registry = _run_against_aio_server(_call)
+    labels = _labels("UNARY", "SayHello")
+    handled = [
+        (sample.labels["grpc_code"], sample.value)
+        for metric in prom_registry.collect()
+        if metric.name == "grpc_server_handled"
+        for sample in metric.samples
+        if sample.name == "grpc_server_handled_total"
+    ]
+    assert handled == [(grpc_code, 3)]
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handled_total", dict(labels, grpc_code=grpc_code)
+        )
+        == 3
+    )
@@ -51,10 +51,11 @@ def test_grpc_server_handled_before_request_error(
 ):  # pylint: disable=unused-argument
     for _ in range(target_count):
         with patch(
-            "py_grpc_prometheus.server.interceptor.Metrics.record_stream_msg_received",
+            "py_grpc_prometheus.server.interceptor.MethodMetrics.record_started_rpc",
             side_effect=Exception("mocked error"),
         ):
-            assert (
-                grpc_stub.SayHello(hello_world_pb2.HelloRequest(name="unary")).message
-                == "Hello, unary!"
-            )
+            with pytest.raises(grpc.RpcError):
+                grpc_stub.SayHello(hello_world_pb2.HelloRequest(name="unary"))
+
+    target_metric = get_server_metric("grpc_server_handled")
+    assert target_metric.samples[0].value == target_count
@@ -1,9 +1,169 @@
-from grpc import HandlerCallDetails
+import types
 
-from py_grpc_prometheus.grpc_utils import split_method_call
+import pytest
+from grpc import HandlerCallDetails, StatusCode
+from prometheus_client import CollectorRegistry, Counter
+
+from py_grpc_prometheus.clock import ManualClock
+from py_grpc_prometheus.grpc_utils import (
+    FlushPolicy,
+    HandlerCache,
+    compute_status_code,
+    count_iterator,
+    measure_deserializer,
+    measure_serializer,
+    split_method_call,
+)
 
 
 def test_split_method_call():
     details = HandlerCallDetails()
     details.method = "ABC"
     assert split_method_call(details) == ("", "", False)
+
+
+class _CallDetails:
+    def __init__(self, method):
+        self.method = method
+
+
+def test_handler_cache_reuses_wrapped_handler():
+    wrapped = []
+
+    def wrap_handler(handler, handler_call_details):
+        wrapped.append(handler)
+        return (handler, handler_call_details.method)
+
+    cache = HandlerCache(wrap_handler, max_size=1)
+    handler = object()
+    first = cache.get(handler, _CallDetails("/Greeter/SayHello"))
+    assert cache.get(handler, _CallDetails("/Greeter/SayHello")) is first
+    assert len(wrapped) == 1
+
+    # A different handler for the same method is wrapped again.
+    cache.get(object(), _CallDetails("/Greeter/SayHello"))
+    assert len(wrapped) == 2
+
+    # Methods beyond the bound are wrapped on every call but never cached.
+    cache.get(handler, _CallDetails("/Greeter/Unknown"))
+    cache.get(handler, _CallDetails("/Greeter/Unknown"))
+    assert len(wrapped) == 4
+    assert cache.get(None, _CallDetails("/Greeter/Unknown")) is None
+
+
+def _counter():
+    prom_registry = CollectorRegistry()
+    counter = Counter("test_messages", "Test messages.", registry=prom_registry)
+    return counter, lambda: prom_registry.get_sample_value("test_messages_total")
+
+
+def test_count_iterator_exact():
+    counter, count = _counter()
+    assert list(count_iterator(iter(range(5)), counter)) == [0, 1, 2, 3, 4]
+    assert count() == 5
+
+
+def test_count_iterator_flushes_in_batches():
+    counter, count = _counter()
+    iterator = count_iterator(iter(range(10)), counter, FlushPolicy(max_messages=4))
+    for _ in range(5):
+        next(iterator)
+    assert count() == 4
+    list(iterator)
+    assert count() == 10
+
+
+def test_count_iterator_flushes_on_close_and_error():
+    counter, count = _counter()
+    iterator = count_iterator(iter(range(10)), counter, FlushPolicy(max_messages=100))
+    next(iterator)
+    next(iterator)
+    iterator.close()
+    assert count() == 2
+
+    def _failing():
+        yield 1
+        raise ValueError("broken stream")
+
+    iterator = count_iterator(
+        _failing(), counter, FlushPolicy(max_messages=100, max_interval=60)
+    )
+    with pytest.raises(ValueError):
+        list(iterator)
+    assert count() == 3
+
+
+def test_count_iterator_flushes_on_interval():
+    counter, count = _counter()
+    clock = ManualClock()
+    policy = FlushPolicy(max_messages=100, max_interval=1).with_clock(clock)
+    iterator = count_iterator(iter(range(10)), counter, policy)
+    next(iterator)
+    next(iterator)
+    assert count() == 0
+    clock.advance(seconds=1)
+    next(iterator)
+    assert count() == 3
+
+
+class _Context:
+    def __init__(self, active=True, code=None):
+        self._active = active
+        self._code = code
+
+    def is_active(self):
+        return self._active
+
+    def code(self):
+        return self._code
+
+
+class _LegacyContext:
+    # Contexts of grpcio < 1.38, without code().
+    def __init__(self, code=None):
+        self._state = types.SimpleNamespace(code=code)
+
+    def is_active(self):
+        return True
+
+
+@pytest.mark.parametrize(
+    "context,expected",
+    [
+        (_Context(), StatusCode.OK),
+        (_Context(code=StatusCode.NOT_FOUND), StatusCode.NOT_FOUND),
+        (_Context(active=False, code=StatusCode.NOT_FOUND), StatusCode.CANCELLED),
+        (_LegacyContext(), StatusCode.OK),
+        (_LegacyContext(StatusCode.ABORTED), StatusCode.ABORTED),
+    ],
+)
+def test_compute_status_code(context, expected):
+    assert compute_status_code(context) is expected
+
+
+def test_measure_serializers():
+    clock = ManualClock()
+    sizes, latencies = [], []
+
+    def serializer(message):
+        clock.advance(0.001)
+        return message.encode()
+
+    def deserializer(data):
+        clock.advance(0.002)
+        return data.decode()
+
+    serialize = measure_serializer(serializer, sizes.append, latencies.append, clock)
+    deserialize = measure_deserializer(
+        deserializer, sizes.append, latencies.append, clock
+    )
+    assert deserialize(serialize("hello")) == "hello"
+    assert sizes == [5, 5]
+    assert latencies == [1000000, 2000000]
+
+    # Bytes passed through are measured, but not timed.
+    assert measure_deserializer(None, sizes.append, latencies.append)(b"hi") == b"hi"
+    assert sizes[-1] == 2 and len(latencies) == 2
+    # Nothing to measure.
+    assert measure_serializer(None, None, latencies.append) is None
+    assert measure_deserializer(deserializer) is deserializer
@@ -0,0 +1,169 @@
+import asyncio
+import threading
+import time
+from concurrent import futures
+
+import grpc
+import pytest
+from prometheus_client import registry
+
+from py_grpc_prometheus.prometheus_aio_client_interceptor import (
+    PromAioClientInterceptor,
+)
+from py_grpc_prometheus.prometheus_aio_server_interceptor import (
+    PromAioServerInterceptor,
+)
+from py_grpc_prometheus.prometheus_client_interceptor import PromClientInterceptor
+from py_grpc_prometheus.server.interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+
+
+def _in_flight(prom_registry, side, grpc_type, grpc_method):
+    return prom_registry.get_sample_value(
+        "grpc_%s_in_flight_rpcs" % side,
+        {"grpc_type": grpc_type, "grpc_service": "Greeter", "grpc_method": grpc_method},
+    )
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class _Greeter(hello_world_grpc.GreeterServicer):
+    def __init__(self, prom_registry):
+        self._registry = prom_registry
+        self.observed = []
+        self.streaming = threading.Event()
+
+    def SayHello(self, request, context):
+        self.observed.append(
+            (
+                _in_flight(self._registry, "server", "UNARY", "SayHello"),
+                _in_flight(self._registry, "client", "UNARY", "SayHello"),
+            )
+        )
+        return hello_world_pb2.HelloReply(message="Hello, %s!" % request.name)
+
+    def SayHelloUnaryStream(self, request, context):
+        while context.is_active():
+            self.streaming.set()
+            yield hello_world_pb2.HelloReply(message="Hello, %s!" % request.name)
+            time.sleep(0.01)
+
+
+def test_sync_in_flight():
+    prom_registry = registry.CollectorRegistry()
+    greeter = _Greeter(prom_registry)
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=2),
+        interceptors=(
+            PromServerInterceptor(
+                registry=prom_registry, access_logger=None, enable_in_flight_gauge=True
+            ),
+        ),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(greeter, server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        with grpc.intercept_channel(
+            grpc.insecure_channel("localhost:%d" % port),
+            PromClientInterceptor(registry=prom_registry, enable_in_flight_gauge=True),
+        ) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            stub.SayHello(hello_world_pb2.HelloRequest(name="unary"))
+            assert greeter.observed == [(1, 1)]
+            assert _in_flight(prom_registry, "client", "UNARY", "SayHello") == 0
+            _wait_for(
+                lambda: _in_flight(prom_registry, "server", "UNARY", "SayHello") == 0
+            )
+
+            # A stream is in flight until its deadline expires, although its
+            # responses are never exhausted.
+            responses = stub.SayHelloUnaryStream(
+                hello_world_pb2.MultipleHelloResRequest(name="stream", res=1),
+                timeout=1,
+            )
+            next(responses)
+            greeter.streaming.wait()
+            for side in ("server", "client"):
+                assert (
+                    _in_flight(
+                        prom_registry, side, "SERVER_STREAMING", "SayHelloUnaryStream"
+                    )
+                    == 1
+                )
+            with pytest.raises(grpc.RpcError) as error:
+                for _ in responses:
+                    pass
+            assert error.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+            for side in ("server", "client"):
+                _wait_for(
+                    lambda side=side: _in_flight(
+                        prom_registry, side, "SERVER_STREAMING", "SayHelloUnaryStream"
+                    )
+                    == 0
+                )
+    finally:
+        server.stop(0)
+
+
+class _AioGreeter(hello_world_grpc.GreeterServicer):
+    def __init__(self, prom_registry):
+        self._registry = prom_registry
+        self.observed = []
+
+    async def SayHello(self, request, context):
+        self.observed.append(
+            (
+                _in_flight(self._registry, "server", "UNARY", "SayHello"),
+                _in_flight(self._registry, "client", "UNARY", "SayHello"),
+            )
+        )
+        return hello_world_pb2.HelloReply(message="Hello, %s!" % request.name)
+
+    async def SayHelloUnaryStream(self, request, context):
+        for i in range(request.res):
+            yield hello_world_pb2.HelloReply(
+                message="Hello, %s %s!" % (request.name, i)
+            )
+
+
+def test_aio_in_flight():
+    prom_registry = registry.CollectorRegistry()
+    greeter = _AioGreeter(prom_registry)
+
+    async def _run():
+        server = grpc.aio.server(
+            interceptors=(
+                PromAioServerInterceptor(
+                    registry=prom_registry, enable_in_flight_gauge=True
+                ),
+            )
+        )
+        hello_world_grpc.add_GreeterServicer_to_server(greeter, server)
+        port = server.add_insecure_port("localhost:0")
+        await server.start()
+        try:
+            async with grpc.aio.insecure_channel(
+                "localhost:%d" % port,
+                interceptors=[
+                    PromAioClientInterceptor(
+                        registry=prom_registry, enable_in_flight_gauge=True
+                    )
+                ],
+            ) as channel:
+                stub = hello_world_grpc.GreeterStub(channel)
+                await stub.SayHello(hello_world_pb2.HelloRequest(name="unary"))
+                await asyncio.sleep(0.1)
+        finally:
+            await server.stop(0)
+
+    asyncio.run(_run())
+    assert greeter.observed == [(1, 1)]
+    for side in ("server", "client"):
+        assert _in_flight(prom_registry, side, "UNARY", "SayHello") == 0
@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import grpc
+import pytest
+from prometheus_client import registry
+
+from py_grpc_prometheus.clock import ManualClock
+from py_grpc_prometheus.loop_monitor import LoopMonitor
+from py_grpc_prometheus.prometheus_aio_server_interceptor import (
+    PromAioServerInterceptor,
+)
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+
+LABELS = {"grpc_type": "UNARY", "grpc_service": "Greeter", "grpc_method": "SayHello"}
+
+
+def test_timed_counts_slow_steps():
+    prom_registry = registry.CollectorRegistry()
+    clock = ManualClock()
+    monitor = LoopMonitor(prom_registry, slow_callback_threshold=0.1, clock=clock)
+
+    async def handler():
+        clock.advance(0.25)
+        await asyncio.sleep(0)
+        clock.advance(0.05)
+        await asyncio.sleep(0)
+        clock.advance(0.5)
+        return "done"
+
+    async def failing_handler():
+        await asyncio.sleep(0)
+        clock.advance(0.25)
+        raise ValueError("failed")
+
+    async def run():
+        assert await monitor.timed(handler(), *LABELS.values()) == "done"
+        with pytest.raises(ValueError):
+            await monitor.timed(failing_handler(), *LABELS.values())
+
+    asyncio.run(run())
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_event_loop_slow_callbacks_total", LABELS
+        )
+        == 3
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_event_loop_slow_callback_seconds_total", LABELS
+        )
+        == 1
+    )
+
+
+def test_timed_propagates_cancellation():
+    prom_registry = registry.CollectorRegistry()
+    monitor = LoopMonitor(prom_registry)
+    cancelled = []
+
+    async def handler():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        task = asyncio.ensure_future(monitor.timed(handler(), *LABELS.values()))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert cancelled == [True]
+
+
+class _BlockingGreeter(hello_world_grpc.GreeterServicer):
+    async def SayHello(self, request, context):
+        await asyncio.sleep(0)
+        time.sleep(0.2)
+        return hello_world_pb2.HelloReply(message="Hello, %s!" % request.name)
+
+    async def SayHelloUnaryStream(self, request, context):
+        for i in range(request.res):
+            time.sleep(0.2)
+            yield hello_world_pb2.HelloReply(
+                message="Hello, %s %s!" % (request.name, i)
+            )
+
+
+def test_aio_server():
+    prom_registry = registry.CollectorRegistry()
+    monitor = LoopMonitor(prom_registry, interval=0.01, slow_callback_threshold=0.1)
+
+    async def run():
+        monitor.start()
+        server = grpc.aio.server(
+            interceptors=(
+                PromAioServerInterceptor(registry=prom_registry, loop_monitor=monitor),
+            )
+        )
+        hello_world_grpc.add_GreeterServicer_to_server(_BlockingGreeter(), server)
+        port = server.add_insecure_port("localhost:0")
+        await server.start()
+        try:
+            async with grpc.aio.insecure_channel("localhost:%d" % port) as channel:
+                stub = hello_world_grpc.GreeterStub(channel)
+                await stub.SayHello(hello_world_pb2.HelloRequest(name="unary"))
+                responses = [
+                    response
+                    async for response in stub.SayHelloUnaryStream(
+                        hello_world_pb2.MultipleHelloResRequest(name="stream", res=2)
+                    )
+                ]
+                assert len(responses) == 2
+                await asyncio.sleep(0.05)
+        finally:
+            await server.stop(0)
+            await monitor.stop()
+
+    asyncio.run(run())
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_event_loop_slow_callbacks_total", LABELS
+        )
+        == 1
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_event_loop_slow_callbacks_total",
+            {
+                "grpc_type": "SERVER_STREAMING",
+                "grpc_service": "Greeter",
+                "grpc_method": "SayHelloUnaryStream",
+            },
+        )
+        == 2
+    )
+    # The probe was late while the handlers blocked the loop.
+    assert (
+        prom_registry.get_sample_value("grpc_server_event_loop_lag_seconds_count") > 0
+    )
+    assert prom_registry.get_sample_value(
+        "grpc_server_event_loop_lag_seconds_bucket", {"le": "0.128"}
+    ) < prom_registry.get_sample_value("grpc_server_event_loop_lag_seconds_count")
+    assert prom_registry.get_sample_value("grpc_server_event_loop_tasks") >= 1
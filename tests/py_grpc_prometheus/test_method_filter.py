@@ -0,0 +1,78 @@
+from concurrent import futures
+
+import grpc
+from prometheus_client import registry
+
+from py_grpc_prometheus.method_filter import MethodFilter
+from py_grpc_prometheus.server.interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+
+def test_method_filter_rules():
+    method_filter = MethodFilter(
+        exclude=["grpc.health.v1.Health", "/Greeter/SayHello", "/grpc.reflection.*"]
+    )
+    assert not method_filter("/grpc.health.v1.Health/Check")
+    assert not method_filter("/Greeter/SayHello")
+    assert not method_filter(b"/Greeter/SayHello")
+    assert not method_filter("/grpc.reflection.v1alpha.ServerReflection/Info")
+    assert method_filter("/Greeter/SayHelloUnaryStream")
+    assert method_filter("garbage")
+
+
+def test_method_filter_include():
+    method_filter = MethodFilter(include=["Greeter"], exclude=["/Greeter/SayHello"])
+    assert method_filter("/Greeter/SayHelloBidiStream")
+    assert not method_filter("/Greeter/SayHello")
+    assert not method_filter("/Other/SayHello")
+
+
+def test_excluded_methods_are_not_instrumented():
+    prom_registry = registry.CollectorRegistry()
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=2),
+        interceptors=(
+            PromServerInterceptor(
+                registry=prom_registry,
+                method_filter=MethodFilter(exclude=["/Greeter/SayHello"]),
+            ),
+        ),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        with grpc.insecure_channel("localhost:%d" % port) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            assert (
+                stub.SayHello(hello_world_pb2.HelloRequest(name="filtered")).message
+                == "Hello, filtered!"
+            )
+            list(
+                stub.SayHelloUnaryStream(
+                    hello_world_pb2.MultipleHelloResRequest(name="kept", res=2)
+                )
+            )
+    finally:
+        server.stop(0)
+
+    labels = {"grpc_service": "Greeter", "grpc_type": "UNARY"}
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_started_total", dict(labels, grpc_method="SayHello")
+        )
+        is None
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_started_total",
+            {
+                "grpc_service": "Greeter",
+                "grpc_type": "SERVER_STREAMING",
+                "grpc_method": "SayHelloUnaryStream",
+            },
+        )
+        == 1
+    )
@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from prometheus_client import multiprocess as prometheus_multiprocess
+from prometheus_client import registry
+
+from py_grpc_prometheus import multiprocess
+
+# Records RPCs from a worker process in multiprocess mode and prints its pid.
+WORKER = """
+import os
+import grpc
+from py_grpc_prometheus.server.metrics import Metrics
+
+method_metrics = Metrics(None).method_metrics("Greeter", "SayHello", False, False)
+for _ in range(3):
+    method_metrics.record_started_rpc()
+    method_metrics.record_completed_rpc(grpc.StatusCode.OK)
+    method_metrics.record_request_latency(0.02)
+print(os.getpid())
+"""
+
+LABELS = {"grpc_type": "UNARY", "grpc_service": "Greeter", "grpc_method": "SayHello"}
+
+
+def _run_worker(path):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(path))
+    return int(
+        subprocess.check_output([sys.executable, "-c", WORKER], env=env).decode()
+    )
+
+
+def _samples(prom_registry):
+    return sorted(
+        (sample.name, tuple(sorted(sample.labels.items())), sample.value)
+        for metric in prom_registry.collect()
+        for sample in metric.samples
+    )
+
+
+def test_workers_are_merged(tmp_path):
+    pids = [_run_worker(tmp_path) for _ in range(2)]
+    prom_registry = multiprocess.make_registry(str(tmp_path))
+
+    assert prom_registry.get_sample_value("grpc_server_started_total", LABELS) == 6
+    assert (
+        prom_registry.get_sample_value("grpc_server_handling_seconds_count", LABELS)
+        == 6
+    )
+    reference = registry.CollectorRegistry()
+    prometheus_multiprocess.MultiProcessCollector(reference, str(tmp_path))
+    assert _samples(prom_registry) == _samples(reference)
+
+    # Dead workers are folded into the archive without losing their values.
+    before = _samples(prom_registry)
+    for pid in pids:
+        multiprocess.mark_process_dead(pid, str(tmp_path))
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith(".db")) == [
+        "counter_archive.db",
+        "histogram_archive.db",
+    ]
+    assert _samples(prom_registry) == before
+
+    _run_worker(tmp_path)
+    assert prom_registry.get_sample_value("grpc_server_started_total", LABELS) == 9
+
+
+def test_missing_directory():
+    with pytest.raises(ValueError):
+        multiprocess.make_registry("/nonexistent/py_grpc_prometheus")
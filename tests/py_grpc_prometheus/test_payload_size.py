@@ -0,0 +1,139 @@
+import asyncio
+from concurrent import futures
+
+import grpc
+import pytest
+from prometheus_client import registry
+
+from py_grpc_prometheus.prometheus_aio_client_interceptor import (
+    PromAioClientInterceptor,
+)
+from py_grpc_prometheus.prometheus_aio_server_interceptor import (
+    PromAioServerInterceptor,
+)
+from py_grpc_prometheus.prometheus_client_interceptor import PromClientInterceptor
+from py_grpc_prometheus.prometheus_server_interceptor import (
+    PromServerInterceptor as LegacyPromServerInterceptor,
+)
+from py_grpc_prometheus.server.interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+UNARY = {"grpc_type": "UNARY", "grpc_service": "Greeter", "grpc_method": "SayHello"}
+SERVER_STREAMING = {
+    "grpc_type": "SERVER_STREAMING",
+    "grpc_service": "Greeter",
+    "grpc_method": "SayHelloUnaryStream",
+}
+REQUEST = hello_world_pb2.HelloRequest(name="x" * 100)
+REPLY = hello_world_pb2.HelloReply(message="Hello, %s!" % REQUEST.name)
+
+
+def _bytes(prom_registry, name, labels):
+    return (
+        prom_registry.get_sample_value(name + "_count", labels),
+        prom_registry.get_sample_value(name + "_sum", labels),
+    )
+
+
+@pytest.mark.parametrize(
+    "server_interceptor",
+    [
+        lambda prom_registry: PromServerInterceptor(
+            registry=prom_registry,
+            access_logger=None,
+            enable_payload_size_histogram=True,
+        ),
+        lambda prom_registry: LegacyPromServerInterceptor(
+            registry=prom_registry, enable_payload_size_histogram=True
+        ),
+    ],
+    ids=["server", "legacy_server"],
+)
+def test_sync_payload_size(server_interceptor):
+    prom_registry = registry.CollectorRegistry()
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=2),
+        interceptors=(server_interceptor(prom_registry),),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    client_interceptor = PromClientInterceptor(
+        registry=prom_registry, enable_payload_size_histogram=True
+    )
+    try:
+        with grpc.intercept_channel(
+            client_interceptor.instrument_channel(
+                grpc.insecure_channel("localhost:%d" % port)
+            ),
+            client_interceptor,
+        ) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            assert stub.SayHello(REQUEST) == REPLY
+            responses = list(
+                stub.SayHelloUnaryStream(
+                    hello_world_pb2.MultipleHelloResRequest(name="stream", res=3)
+                )
+            )
+    finally:
+        server.stop(0)
+
+    for name in ("grpc_server_msg_received_bytes", "grpc_client_msg_sent_bytes"):
+        assert _bytes(prom_registry, name, UNARY) == (1, REQUEST.ByteSize())
+    for name in ("grpc_server_msg_sent_bytes", "grpc_client_msg_received_bytes"):
+        assert _bytes(prom_registry, name, UNARY) == (1, REPLY.ByteSize())
+        assert _bytes(prom_registry, name, SERVER_STREAMING) == (
+            3,
+            sum(response.ByteSize() for response in responses),
+        )
+
+
+def test_aio_payload_size():
+    prom_registry = registry.CollectorRegistry()
+    client_interceptor = PromAioClientInterceptor(
+        registry=prom_registry, enable_payload_size_histogram=True
+    )
+
+    async def _run():
+        server = grpc.aio.server(
+            futures.ThreadPoolExecutor(max_workers=2),
+            interceptors=(
+                PromAioServerInterceptor(
+                    registry=prom_registry, enable_payload_size_histogram=True
+                ),
+            ),
+        )
+        hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+        port = server.add_insecure_port("localhost:0")
+        await server.start()
+        try:
+            async with client_interceptor.instrument_channel(
+                grpc.aio.insecure_channel(
+                    "localhost:%d" % port, interceptors=[client_interceptor]
+                )
+            ) as channel:
+                stub = hello_world_grpc.GreeterStub(channel)
+                assert await stub.SayHello(REQUEST) == REPLY
+        finally:
+            await server.stop(0)
+
+    asyncio.run(_run())
+    for name in ("grpc_server_msg_received_bytes", "grpc_client_msg_sent_bytes"):
+        assert _bytes(prom_registry, name, UNARY) == (1, REQUEST.ByteSize())
+    for name in ("grpc_server_msg_sent_bytes", "grpc_client_msg_received_bytes"):
+        assert _bytes(prom_registry, name, UNARY) == (1, REPLY.ByteSize())
+
+
+def test_instrument_channel_is_a_no_op_when_disabled():
+    channel = grpc.insecure_channel("localhost:1")
+    try:
+        assert (
+            PromClientInterceptor(
+                registry=registry.CollectorRegistry()
+            ).instrument_channel(channel)
+            is channel
+        )
+    finally:
+        channel.close()
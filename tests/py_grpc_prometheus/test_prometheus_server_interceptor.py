@@ -0,0 +1,45 @@
+from concurrent import futures
+
+import grpc
+import pytest
+from prometheus_client import registry
+
+from py_grpc_prometheus.prometheus_server_interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+
+@pytest.mark.parametrize("name", ["rpcError", "unknownError"])
+def test_handled_once_when_handler_raises(name):
+    prom_registry = registry.CollectorRegistry()
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=2),
+        interceptors=(
+            PromServerInterceptor(registry=prom_registry, log_exceptions=False),
+        ),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        with grpc.insecure_channel("localhost:%d" % port) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            for _ in range(3):
+                with pytest.raises(grpc.RpcError):
+                    stub.SayHello(hello_world_pb2.HelloRequest(name=name))
+    finally:
+        server.stop(0)
+
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handled_total",
+            {
+                "grpc_type": "UNARY",
+                "grpc_service": "Greeter",
+                "grpc_method": "SayHello",
+                "grpc_code": "UNKNOWN",
+            },
+        )
+        == 3
+    )
@@ -0,0 +1,67 @@
+import asyncio
+
+import grpc
+from prometheus_client import Counter, registry
+
+from py_grpc_prometheus.recorder import Recorder, status_code_index
+
+LABELS = {
+    "grpc_type": "BIDI_STREAMING",
+    "grpc_service": "Greeter",
+    "grpc_method": "Chat",
+}
+
+
+def test_status_code_index_covers_all_codes():
+    assert sorted(status_code_index(code) for code in grpc.StatusCode) == list(
+        range(len(grpc.StatusCode))
+    )
+
+
+def test_recorder_skips_missing_families():
+    prom_registry = registry.CollectorRegistry()
+    handled = Counter(
+        "handled_total",
+        "",
+        ["grpc_type", "grpc_service", "grpc_method", "code"],
+        registry=prom_registry,
+    )
+    method_metrics = Recorder(handled_counter=handled).method_metrics(
+        "BIDI_STREAMING", "Greeter", "Chat"
+    )
+    method_metrics.record_started_rpc()
+    method_metrics.record_request_latency_ns(1000)
+    method_metrics.record_completed_rpc(grpc.StatusCode.ABORTED)
+
+    assert (
+        prom_registry.get_sample_value("handled_total", dict(LABELS, code="ABORTED"))
+        == 1
+    )
+
+
+def test_recorder_counts_async_stream_messages():
+    prom_registry = registry.CollectorRegistry()
+    received = Counter(
+        "received_total",
+        "",
+        ["grpc_type", "grpc_service", "grpc_method"],
+        registry=prom_registry,
+    )
+    method_metrics = Recorder(stream_msg_received_counter=received).method_metrics(
+        "BIDI_STREAMING", "Greeter", "Chat"
+    )
+
+    async def _messages():
+        for i in range(3):
+            yield i
+
+    async def _consume():
+        return [
+            message
+            async for message in method_metrics.record_stream_msg_received_async(
+                _messages()
+            )
+        ]
+
+    assert asyncio.run(_consume()) == [0, 1, 2]
+    assert prom_registry.get_sample_value("received_total", LABELS) == 3
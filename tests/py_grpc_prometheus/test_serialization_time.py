@@ -0,0 +1,71 @@
+from concurrent import futures
+
+import grpc
+from prometheus_client import registry
+
+from py_grpc_prometheus.prometheus_client_interceptor import PromClientInterceptor
+from py_grpc_prometheus.server.interceptor import PromServerInterceptor
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+UNARY = {"grpc_type": "UNARY", "grpc_service": "Greeter", "grpc_method": "SayHello"}
+SERVER_STREAMING = {
+    "grpc_type": "SERVER_STREAMING",
+    "grpc_service": "Greeter",
+    "grpc_method": "SayHelloUnaryStream",
+}
+
+
+def test_serialization_time():
+    prom_registry = registry.CollectorRegistry()
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=2),
+        interceptors=(
+            PromServerInterceptor(
+                registry=prom_registry,
+                access_logger=None,
+                enable_serialization_time_histogram=True,
+            ),
+        ),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    client_interceptor = PromClientInterceptor(
+        registry=prom_registry, enable_serialization_time_histogram=True
+    )
+    try:
+        with grpc.intercept_channel(
+            client_interceptor.instrument_channel(
+                grpc.insecure_channel("localhost:%d" % port)
+            ),
+            client_interceptor,
+        ) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            stub.SayHello(hello_world_pb2.HelloRequest(name="unary"))
+            list(
+                stub.SayHelloUnaryStream(
+                    hello_world_pb2.MultipleHelloResRequest(name="stream", res=3)
+                )
+            )
+    finally:
+        server.stop(0)
+
+    for name, labels, count in [
+        ("grpc_server_msg_deserialize_seconds", UNARY, 1),
+        ("grpc_server_msg_serialize_seconds", UNARY, 1),
+        ("grpc_client_msg_serialize_seconds", UNARY, 1),
+        ("grpc_client_msg_deserialize_seconds", UNARY, 1),
+        ("grpc_server_msg_deserialize_seconds", SERVER_STREAMING, 1),
+        ("grpc_server_msg_serialize_seconds", SERVER_STREAMING, 3),
+        ("grpc_client_msg_serialize_seconds", SERVER_STREAMING, 1),
+        ("grpc_client_msg_deserialize_seconds", SERVER_STREAMING, 3),
+    ]:
+        assert prom_registry.get_sample_value(name + "_count", labels) == count
+        assert prom_registry.get_sample_value(name + "_sum", labels) > 0
+    # The sizes are not recorded unless asked for.
+    assert (
+        prom_registry.get_sample_value("grpc_server_msg_received_bytes_count", UNARY)
+        is None
+    )
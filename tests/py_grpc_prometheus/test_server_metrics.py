@@ -0,0 +1,87 @@
+import grpc
+from prometheus_client import registry
+
+from py_grpc_prometheus.sampling import EveryNthSampler, ProbabilitySampler
+from py_grpc_prometheus.server.metrics import Metrics
+
+
+def test_method_metrics_is_bound_once():
+    metrics = Metrics(registry.CollectorRegistry())
+    method_metrics = metrics.method_metrics("Greeter", "SayHello", False, False)
+    assert metrics.method_metrics("Greeter", "SayHello", False, False) is method_metrics
+    assert (
+        metrics.method_metrics("Greeter", "SayHelloBidiStream", True, True)
+        is not method_metrics
+    )
+
+
+def test_method_metrics_records_per_status_code():
+    prom_registry = registry.CollectorRegistry()
+    method_metrics = Metrics(prom_registry).method_metrics(
+        "Greeter", "SayHello", False, False
+    )
+    method_metrics.record_started_rpc()
+    method_metrics.record_completed_rpc(grpc.StatusCode.OK)
+    method_metrics.record_completed_rpc(grpc.StatusCode.OK)
+    method_metrics.record_completed_rpc(grpc.StatusCode.UNAVAILABLE)
+
+    labels = {
+        "grpc_type": "UNARY",
+        "grpc_service": "Greeter",
+        "grpc_method": "SayHello",
+    }
+    assert prom_registry.get_sample_value("grpc_server_started_total", labels) == 1
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handled_total", dict(labels, grpc_code="OK")
+        )
+        == 2
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handled_total", dict(labels, grpc_code="UNAVAILABLE")
+        )
+        == 1
+    )
+    # Streaming counters are never bound for unary methods.
+    assert prom_registry.get_sample_value("grpc_server_msg_sent_total", labels) is None
+
+
+def test_sampled_latency_keeps_exact_sum():
+    prom_registry = registry.CollectorRegistry()
+    metrics = Metrics(
+        prom_registry,
+        latency_sampler=EveryNthSampler(4, per_method={"/Greeter/SayHelloAll": 1}),
+    )
+    say_hello = metrics.method_metrics("Greeter", "SayHello", False, False)
+    say_hello_all = metrics.method_metrics("Greeter", "SayHelloAll", False, False)
+    for _ in range(8):
+        say_hello.record_request_latency(0.5)
+        say_hello_all.record_request_latency(0.5)
+
+    labels = {
+        "grpc_type": "UNARY",
+        "grpc_service": "Greeter",
+        "grpc_method": "SayHello",
+    }
+    assert (
+        prom_registry.get_sample_value("grpc_server_handling_seconds_count", labels)
+        == 2
+    )
+    assert (
+        prom_registry.get_sample_value("grpc_server_handled_seconds_total", labels) == 4
+    )
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handling_seconds_count",
+            dict(labels, grpc_method="SayHelloAll"),
+        )
+        == 8
+    )
+
+
+def test_probability_sampler():
+    assert ProbabilitySampler(1.0).for_method("Greeter", "SayHello")()
+    assert not any(
+        ProbabilitySampler(0.0).for_method("Greeter", "SayHello")() for _ in range(100)
+    )
@@ -0,0 +1,105 @@
+import threading
+from concurrent import futures
+
+import grpc
+from prometheus_client import Counter, Histogram, generate_latest, registry
+
+from py_grpc_prometheus.server.interceptor import PromServerInterceptor
+from py_grpc_prometheus.sharded import ShardedCounter, ShardedHistogram
+from tests.integration.hello_world import hello_world_pb2
+from tests.integration.hello_world import hello_world_pb2_grpc as hello_world_grpc
+from tests.integration.hello_world.hello_world_server import Greeter
+
+LABELNAMES = ["grpc_type", "grpc_service", "grpc_method"]
+LABELS = ("UNARY", "Greeter", "SayHello")
+
+
+def _exposition(prom_registry):
+    return [
+        line
+        for line in generate_latest(prom_registry).decode().splitlines()
+        if "_created" not in line
+    ]
+
+
+def test_sharded_metrics_merge_threads():
+    prom_registry = registry.CollectorRegistry()
+    counter = ShardedCounter("requests_total", "", LABELNAMES, prom_registry)
+    latency = ShardedHistogram(
+        "latency_seconds", "", LABELNAMES, prom_registry, buckets=[0.1, 1]
+    )
+
+    def _record():
+        for _ in range(1000):
+            counter.labels(*LABELS).inc()
+            latency.labels(*LABELS).observe(0.5)
+
+    threads = [threading.Thread(target=_record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    labels = dict(zip(LABELNAMES, LABELS))
+    assert prom_registry.get_sample_value("requests_total", labels) == 8000
+    assert (
+        prom_registry.get_sample_value("latency_seconds_bucket", dict(labels, le="0.1"))
+        == 0
+    )
+    assert (
+        prom_registry.get_sample_value("latency_seconds_bucket", dict(labels, le="1.0"))
+        == 8000
+    )
+    assert prom_registry.get_sample_value("latency_seconds_sum", labels) == 4000
+
+
+def test_sharded_metrics_expose_like_prometheus_client():
+    plain_registry = registry.CollectorRegistry()
+    sharded_registry = registry.CollectorRegistry()
+    plain = (
+        Counter("requests_total", "Requests.", LABELNAMES, registry=plain_registry),
+        Histogram("latency_seconds", "Latency.", LABELNAMES, registry=plain_registry),
+    )
+    sharded = (
+        ShardedCounter("requests_total", "Requests.", LABELNAMES, sharded_registry),
+        ShardedHistogram("latency_seconds", "Latency.", LABELNAMES, sharded_registry),
+    )
+    for counter, histogram in (plain, sharded):
+        for latency in (0.001, 0.02, 0.02, 3, 20):
+            counter.labels(*LABELS).inc()
+            histogram.labels(*LABELS).observe(latency)
+
+    assert _exposition(sharded_registry) == _exposition(plain_registry)
+
+
+def test_sharded_server_metrics():
+    prom_registry = registry.CollectorRegistry()
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=4),
+        interceptors=(
+            PromServerInterceptor(registry=prom_registry, sharded_metrics=True),
+        ),
+    )
+    hello_world_grpc.add_GreeterServicer_to_server(Greeter(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        with grpc.insecure_channel("localhost:%d" % port) as channel:
+            stub = hello_world_grpc.GreeterStub(channel)
+            for i in range(10):
+                stub.SayHello(hello_world_pb2.HelloRequest(name=str(i)))
+    finally:
+        server.stop(0)
+
+    labels = dict(zip(LABELNAMES, LABELS))
+    assert prom_registry.get_sample_value("grpc_server_started_total", labels) == 10
+    assert (
+        prom_registry.get_sample_value(
+            "grpc_server_handled_total", dict(labels, grpc_code="OK")
+        )
+        == 10
+    )
+    assert (
+        prom_registry.get_sample_value("grpc_server_handling_seconds_count", labels)
+        == 10
+    )